@@ -11,6 +11,12 @@ st.set_page_config(
     layout="wide"
 )
 
+@st.cache_resource(show_spinner="ベクトルDBを初期化中...")
+def get_vector_db():
+    """VectorDBProcessorをプロセス内で1つだけ作成して全セッションで共有"""
+    from vector_db_processor import VectorDBProcessor
+    return VectorDBProcessor(persist_query_cache=True)
+
 def check_system_requirements():
     """システム要件チェック"""
     st.sidebar.header("🔧 システム診断")
@@ -33,13 +39,14 @@ def check_system_requirements():
     
     # ChromaDBチェック
     try:
-        from vector_db_processor import VectorDBProcessor
-        vector_db = VectorDBProcessor()
+        vector_db = get_vector_db()
         if vector_db.collection:
             stats = vector_db.get_stats()
             st.sidebar.success(f"✅ ChromaDB: {stats['total_documents']}件")
             return vector_db
         else:
+            # 失敗した状態を共有しないよう、次回の再実行で再初期化する
+            get_vector_db.clear()
             st.sidebar.error("❌ ChromaDB: 初期化失敗")
             return None
     except Exception as e:
@@ -193,9 +200,9 @@ def main():
                 with col2:
                     max_results = st.slider(
                         "📚 参照データ数",
-                        min_value=10,
+                        min_value=5,
                         max_value=50,  # GPT-4oなら50件でも問題なし
-                        value=30,      # デフォルトを30に
+                        value=10,      # ハイブリッド検索で上位の精度が上がったため10件に
                         help="GPT-4oの128Kトークンで大容量処理可能"
                     )
                 
@@ -210,8 +217,8 @@ def main():
             # GPT-4o高度分析実行
             if st.button("🚀 GPT-4o高度分析実行", type="primary") and search_query and vector_db:
                 with st.spinner("🧠 GPT-4o大容量分析実行中..."):
-                    # ベクトル検索
-                    results = vector_db.search(search_query, n_results=max_results)
+                    # ハイブリッド検索（ベクトル + キーワード）
+                    results = vector_db.hybrid_search(search_query, n_results=max_results)
                     
                     if results:
                         st.success(f"✅ {len(results)}件の関連データを発見")
@@ -252,7 +259,7 @@ def main():
                 if vector_db and st.secrets.get("OPENAI_API_KEY"):
                     try:
                         # 関連文書検索
-                        relevant_docs = vector_db.search(prompt, n_results=5)
+                        relevant_docs = vector_db.hybrid_search(prompt, n_results=5)
                         
                         # OpenAI API呼び出し（GPT-4o）
                         import openai
@@ -307,15 +314,28 @@ def main():
                     try:
                         from notion_processor import NotionProcessor
                         
-                        with st.spinner("Notionデータ取得中..."):
+                        # 前回の同期以降に更新された文書だけを順次ベクトル化して書き込む
+                        failed_windows = []
+                        
+                        def check_window(window_number, doc_count, chunk_count):
+                            if doc_count and not chunk_count:
+                                failed_windows.append(window_number)
+                        
+                        with st.spinner("Notionデータ取得・統合中..."):
                             processor = NotionProcessor()
-                            documents = processor.get_all_pages()
+                            document_count = vector_db.add_documents(
+                                processor.iter_changed_documents(), on_window=check_window
+                            )
+                            # 書き込みに失敗したウィンドウがあれば同期状態を進めない（次回再取得）
+                            if not failed_windows:
+                                processor.commit_sync()
                         
-                        if documents:
-                            vector_db.add_documents(documents)
-                            st.success(f"✅ {len(documents)}件のNotionデータを統合しました")
+                        if failed_windows:
+                            st.warning("⚠️ 一部のNotionデータの書き込みに失敗しました（次回の更新で再取得します）")
+                        elif document_count:
+                            st.success(f"✅ {document_count}件の更新されたNotionデータを統合しました")
                         else:
-                            st.warning("⚠️ Notionデータが見つかりませんでした")
+                            st.info("ℹ️ 前回の更新以降に変更されたNotionデータはありません")
                             
                     except Exception as e:
                         st.error(f"❌ Notion取得エラー: {e}")
@@ -329,10 +349,11 @@ def main():
                     stats = vector_db.get_stats()
                     st.metric("総文書数", stats['total_documents'])
                     
-                    # Notion固有の統計は検索で取得
-                    notion_results = vector_db.search("notion", n_results=100)
-                    notion_docs = [r for r in notion_results if r['metadata'].get('source') == 'notion']
-                    st.metric("Notion文書数", len(notion_docs))
+                    # Notion固有の統計は文書カタログの件数から取得
+                    source_counts = vector_db.get_source_counts()
+                    st.metric("Notion文書数", source_counts['by_source'].get('notion', 0))
+                    for doc_type, count in source_counts['by_source_type'].get('notion', {}).items():
+                        st.write(f"- {doc_type}: {count}件")
                     
                 except Exception as e:
                     st.error(f"❌ 統計取得エラー: {e}")
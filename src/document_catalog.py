@@ -0,0 +1,132 @@
+"""
+文書カタログモジュール - 親文書単位の登録情報とソース別・タイプ別件数を管理（SQLite永続化）
+"""
+
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+_SQL_CHUNK_SIZE = 500
+
+
+class DocumentCatalog:
+    """親文書の一覧と件数カウンター（件数はトリガーで常に最新に保つ）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                type TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                chunk_count INTEGER NOT NULL,
+                updated_ts INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS counts (
+                source TEXT NOT NULL,
+                type TEXT NOT NULL,
+                documents INTEGER NOT NULL,
+                PRIMARY KEY (source, type)
+            );
+            CREATE TRIGGER IF NOT EXISTS documents_insert AFTER INSERT ON documents BEGIN
+                INSERT INTO counts (source, type, documents) VALUES (NEW.source, NEW.type, 1)
+                ON CONFLICT (source, type) DO UPDATE SET documents = documents + 1;
+            END;
+            CREATE TRIGGER IF NOT EXISTS documents_delete AFTER DELETE ON documents BEGIN
+                UPDATE counts SET documents = documents - 1
+                WHERE source = OLD.source AND type = OLD.type;
+            END;
+            CREATE TRIGGER IF NOT EXISTS documents_update AFTER UPDATE OF source, type ON documents BEGIN
+                UPDATE counts SET documents = documents - 1
+                WHERE source = OLD.source AND type = OLD.type;
+                INSERT INTO counts (source, type, documents) VALUES (NEW.source, NEW.type, 1)
+                ON CONFLICT (source, type) DO UPDATE SET documents = documents + 1;
+            END;
+            """
+        )
+        self._conn.commit()
+
+    def upsert(self, rows: Iterable[Tuple[str, str, str, str, int, int]]):
+        """(doc_id, source, type, content_hash, chunk_count, updated_ts) を登録"""
+        rows = list(rows)
+        if not rows:
+            return
+
+        with self._lock:
+            self._conn.executemany(
+                """
+                INSERT INTO documents (doc_id, source, type, content_hash, chunk_count, updated_ts)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (doc_id) DO UPDATE SET
+                    source = excluded.source,
+                    type = excluded.type,
+                    content_hash = excluded.content_hash,
+                    chunk_count = excluded.chunk_count,
+                    updated_ts = excluded.updated_ts
+                """,
+                rows
+            )
+            self._conn.commit()
+
+    def delete(self, doc_ids: List[str]):
+        """文書をカタログから削除"""
+        if not doc_ids:
+            return
+
+        with self._lock:
+            for i in range(0, len(doc_ids), _SQL_CHUNK_SIZE):
+                chunk = doc_ids[i:i + _SQL_CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                self._conn.execute(f"DELETE FROM documents WHERE doc_id IN ({placeholders})", chunk)
+            self._conn.commit()
+
+    def clear(self):
+        """カタログを全削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM documents")
+            self._conn.execute("DELETE FROM counts")
+            self._conn.commit()
+
+    def count(self) -> int:
+        """登録済み文書数（カウンターの合計）"""
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(documents), 0) FROM counts").fetchone()[0]
+
+    def get_counts(self) -> Dict:
+        """ソース別・タイプ別の文書数を取得"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source, type, documents FROM counts WHERE documents > 0"
+            ).fetchall()
+
+        by_source = {}
+        by_type = {}
+        by_source_type = {}
+        for source, doc_type, documents in rows:
+            by_source[source] = by_source.get(source, 0) + documents
+            by_type[doc_type] = by_type.get(doc_type, 0) + documents
+            by_source_type.setdefault(source, {})[doc_type] = documents
+
+        return {
+            "total": sum(by_source.values()),
+            "by_source": by_source,
+            "by_type": by_type,
+            "by_source_type": by_source_type
+        }
+
+    def close(self):
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,202 @@
+"""
+埋め込みキャッシュモジュール - モデル名 + 正規化コンテンツハッシュで埋め込みを永続化
+クエリ埋め込み用のLRUキャッシュも提供
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# SQLiteのバインド変数上限（古いSQLiteは999）を超えないように分割
+_SQL_CHUNK_SIZE = 500
+
+
+def normalize_content(text: str) -> str:
+    """ハッシュ用にテキストを正規化（Unicode正規化・改行統一・前後空白除去）"""
+    text = unicodedata.normalize('NFC', str(text))
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text.strip()
+
+
+def content_hash(text: str) -> str:
+    """正規化済みテキストのSHA-256ハッシュ"""
+    return hashlib.sha256(normalize_content(text).encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLiteベースの永続埋め込みキャッシュ"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model_name TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model_name, content_hash)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get_many(self, model_name: str, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """キャッシュ済みの埋め込みを一括取得（見つかったものだけ返す）"""
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+
+        with self._lock:
+            for i in range(0, len(unique_hashes), _SQL_CHUNK_SIZE):
+                chunk = unique_hashes[i:i + _SQL_CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT content_hash, dim, vector FROM embeddings "
+                    f"WHERE model_name = ? AND content_hash IN ({placeholders})",
+                    [model_name, *chunk]
+                ).fetchall()
+                for key, dim, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    if vector.shape[0] == dim:
+                        found[key] = vector
+
+            self.hits += len(found)
+            self.misses += len(unique_hashes) - len(found)
+
+        return found
+
+    def put_many(self, model_name: str, items: Dict[str, np.ndarray]):
+        """埋め込みを一括保存"""
+        if not items:
+            return
+
+        rows = []
+        for key, vector in items.items():
+            vector = np.asarray(vector, dtype=np.float32)
+            rows.append((model_name, key, int(vector.shape[0]), vector.tobytes()))
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model_name, content_hash, dim, vector) "
+                "VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def get_stats(self) -> Dict:
+        """キャッシュ統計を取得"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def close(self):
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
+
+
+def normalize_query(query: str) -> str:
+    """検索クエリを正規化（全角/半角統一・空白の圧縮）"""
+    query = unicodedata.normalize('NFKC', str(query))
+    return ' '.join(query.split())
+
+
+class QueryEmbeddingCache:
+    """クエリ埋め込みのLRUキャッシュ（任意でEmbeddingCacheにディスク永続化）"""
+
+    def __init__(self, max_size: int = 256, persistent_cache: Optional[EmbeddingCache] = None):
+        self.max_size = max_size
+        self.persistent_cache = persistent_cache
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _namespace(model_name: str) -> str:
+        """永続化時に文書埋め込みと区別するための名前空間"""
+        return f"{model_name}#query"
+
+    def get(self, model_name: str, query: str) -> Optional[np.ndarray]:
+        """キャッシュ済みのクエリ埋め込みを取得（なければNone）"""
+        key = (model_name, normalize_query(query))
+
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+
+        if self.persistent_cache:
+            try:
+                digest = content_hash(key[1])
+                found = self.persistent_cache.get_many(self._namespace(model_name), [digest])
+                if digest in found:
+                    self._remember(key, found[digest])
+                    with self._lock:
+                        self.hits += 1
+                    return found[digest]
+            except Exception as e:
+                print(f"⚠️ クエリキャッシュ読み込みエラー: {e}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, model_name: str, query: str, vector: np.ndarray):
+        """クエリ埋め込みを保存"""
+        key = (model_name, normalize_query(query))
+        vector = np.asarray(vector, dtype=np.float32)
+        self._remember(key, vector)
+
+        if self.persistent_cache:
+            try:
+                self.persistent_cache.put_many(
+                    self._namespace(model_name),
+                    {content_hash(key[1]): vector}
+                )
+            except Exception as e:
+                print(f"⚠️ クエリキャッシュ書き込みエラー: {e}")
+
+    def _remember(self, key, vector: np.ndarray):
+        """LRUに登録し、上限を超えたら最も古いものを捨てる"""
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_stats(self) -> Dict:
+        """キャッシュ統計を取得"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "persistent": self.persistent_cache is not None
+            }
@@ -0,0 +1,244 @@
+"""
+埋め込みエンコーダーモジュール - トークン長でソートし、トークン予算でバッチを組んでエンコード
+トークナイズ（バックグラウンドスレッド）とモデルのフォワードパスをパイプライン化する
+"""
+
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 1バッチあたりのトークン予算（最長テキストのトークン数 × 件数 = パディング込みの計算量）
+DEFAULT_TOKEN_BUDGET = 8192
+DEFAULT_MAX_BATCH_SIZE = 64
+
+# 先読みしてトークナイズしておくバッチ数
+DEFAULT_PREFETCH_DEPTH = 2
+
+
+def plan_token_batches(token_counts: List[int], token_budget: int = DEFAULT_TOKEN_BUDGET,
+                       max_batch_size: int = DEFAULT_MAX_BATCH_SIZE) -> List[List[int]]:
+    """トークン数の降順に並べ、パディング込みのトークン数が予算内に収まるようバッチを組む
+
+    戻り値は元のインデックスのリストのリスト。長さの近いテキストが同じバッチに入るため
+    パディングの無駄が少なくなる。予算を超える1件だけのバッチも許容する。
+    """
+    order = sorted(range(len(token_counts)), key=lambda i: token_counts[i], reverse=True)
+
+    batches = []
+    current = []
+    current_max = 0
+    for index in order:
+        length = max(token_counts[index], 1)
+        padded_max = max(current_max, length)
+        if current and (padded_max * (len(current) + 1) > token_budget or len(current) >= max_batch_size):
+            batches.append(current)
+            current = []
+            padded_max = length
+        current.append(index)
+        current_max = padded_max
+
+    if current:
+        batches.append(current)
+
+    return batches
+
+
+class EmbeddingEncoder:
+    """トークン予算ベースの動的バッチでSentenceTransformerを呼び出すエンコーダー"""
+
+    def __init__(self, model, count_tokens: Callable[[List[str]], List[int]],
+                 token_budget: int = DEFAULT_TOKEN_BUDGET,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 prefetch_depth: int = DEFAULT_PREFETCH_DEPTH,
+                 pipelined: bool = True):
+        self.model = model
+        self.count_tokens = count_tokens
+        self.token_budget = token_budget
+        self.max_batch_size = max_batch_size
+        self.prefetch_depth = max(1, prefetch_depth)
+        self.pipelined = pipelined
+        # 直近のencode()の段階別所要時間（秒）
+        self.last_timings = {}
+
+    def _max_seq_length(self) -> int:
+        return getattr(self.model, 'max_seq_length', None) or 512
+
+    def plan(self, texts: List[str], token_counts: Optional[List[int]] = None) -> List[List[int]]:
+        """テキストのバッチ分割計画を作成（モデルの上限で切り詰められる分は数えない）
+
+        token_counts を渡した場合（チャンク分割時に数えた値など）は数え直さない。
+        """
+        max_seq_length = self._max_seq_length()
+        if token_counts is None or len(token_counts) != len(texts):
+            token_counts = self.count_tokens(texts)
+        token_counts = [min(count, max_seq_length) for count in token_counts]
+        return plan_token_batches(token_counts, self.token_budget, self.max_batch_size)
+
+    def encode_batch(self, batch_texts: List[str]) -> np.ndarray:
+        """1バッチを1回のフォワードパスでエンコード"""
+        embeddings = self.model.encode(
+            batch_texts,
+            batch_size=len(batch_texts),
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def bisect_batch(self, batch_texts: List[str]) -> Tuple[Dict[int, np.ndarray], Dict[int, Exception]]:
+        """失敗したバッチを半分ずつに分けて再エンコードし、失敗の原因となるテキストを特定
+
+        成功したテキストの埋め込みと、単独でも失敗したテキストの例外を
+        バッチ内のインデックスで返す。
+        """
+        embeddings = {}
+        failures = {}
+        pending = [list(range(len(batch_texts)))]
+
+        while pending:
+            indices = pending.pop()
+            try:
+                batch_embeddings = self.encode_batch([batch_texts[i] for i in indices])
+                for index, embedding in zip(indices, batch_embeddings):
+                    embeddings[index] = embedding
+            except Exception as e:
+                if len(indices) == 1:
+                    failures[indices[0]] = e
+                else:
+                    middle = len(indices) // 2
+                    pending.extend([indices[middle:], indices[:middle]])
+
+        return embeddings, failures
+
+    def _supports_pipeline(self) -> bool:
+        """トークナイズとフォワードを分けて呼べるモデルか"""
+        return (self.pipelined
+                and callable(getattr(self.model, 'tokenize', None))
+                and callable(getattr(self.model, 'forward', None)))
+
+    def forward_features(self, features) -> np.ndarray:
+        """トークナイズ済みの入力でフォワードパスを実行し、正規化した埋め込みを返す"""
+        import torch
+
+        device = getattr(self.model, 'device', None)
+        if device is not None:
+            features = {key: value.to(device) if hasattr(value, 'to') else value
+                        for key, value in features.items()}
+
+        with torch.inference_mode():
+            output = self.model.forward(features)
+            embeddings = torch.nn.functional.normalize(output['sentence_embedding'], p=2, dim=1)
+        return embeddings.float().cpu().numpy()
+
+    def encode(self, texts: List[str],
+               on_batch: Optional[Callable[[List[int], np.ndarray], None]] = None,
+               token_counts: Optional[List[int]] = None
+               ) -> Tuple[Dict[int, np.ndarray], Dict[int, Exception]]:
+        """テキストをエンコードし、元のインデックス → 埋め込み の辞書を返す
+
+        失敗したバッチのインデックスは例外とともに2つ目の辞書で返す。
+        on_batch はバッチ完了ごとに (インデックス, 埋め込み) で呼ばれる。
+        token_counts は既知のトークン数（バッチ計画に使い、数え直しを省く）。
+        """
+        started = time.perf_counter()
+        batches = self.plan(texts, token_counts)
+        plan_seconds = time.perf_counter() - started
+
+        if self._supports_pipeline():
+            embeddings, failures, timings = self._encode_pipelined(texts, batches, on_batch)
+        else:
+            embeddings, failures, timings = self._encode_sequential(texts, batches, on_batch)
+
+        timings['plan_seconds'] = plan_seconds
+        timings['total_seconds'] = time.perf_counter() - started
+        timings['batches'] = len(batches)
+        self.last_timings = timings
+        return embeddings, failures
+
+    def _store_batch(self, indices, batch_embeddings, embeddings, on_batch, batch_number, total):
+        for index, embedding in zip(indices, batch_embeddings):
+            embeddings[index] = embedding
+        if on_batch:
+            on_batch(indices, batch_embeddings)
+        print(f"✅ バッチ {batch_number}/{total} 完了（{len(indices)}件）")
+
+    def _encode_sequential(self, texts, batches, on_batch):
+        """model.encode をバッチごとに順番に呼ぶ（パイプライン非対応モデル用）"""
+        embeddings = {}
+        failures = {}
+        encode_seconds = 0.0
+
+        for batch_number, indices in enumerate(batches, start=1):
+            try:
+                started = time.perf_counter()
+                batch_embeddings = self.encode_batch([texts[i] for i in indices])
+                encode_seconds += time.perf_counter() - started
+                self._store_batch(indices, batch_embeddings, embeddings, on_batch, batch_number, len(batches))
+
+            except Exception as e:
+                print(f"❌ バッチ処理エラー: {e}")
+                for index in indices:
+                    failures[index] = e
+
+        return embeddings, failures, {'encode_seconds': encode_seconds}
+
+    def _encode_pipelined(self, texts, batches, on_batch):
+        """バックグラウンドでバッチN+1をトークナイズしながらバッチNのフォワードを実行"""
+        embeddings = {}
+        failures = {}
+        tokenized = queue.Queue(maxsize=self.prefetch_depth)
+        timings = {'tokenize_seconds': 0.0, 'forward_seconds': 0.0, 'wait_seconds': 0.0}
+        stop = threading.Event()
+
+        def tokenize_worker():
+            for indices in batches:
+                if stop.is_set():
+                    break
+                try:
+                    started = time.perf_counter()
+                    features = self.model.tokenize([texts[i] for i in indices])
+                    timings['tokenize_seconds'] += time.perf_counter() - started
+                    tokenized.put((indices, features, None))
+                except Exception as e:
+                    tokenized.put((indices, None, e))
+            tokenized.put(None)
+
+        worker = threading.Thread(target=tokenize_worker, name="rag-tokenizer", daemon=True)
+        worker.start()
+
+        batch_number = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                item = tokenized.get()
+                timings['wait_seconds'] += time.perf_counter() - started
+                if item is None:
+                    break
+
+                indices, features, error = item
+                batch_number += 1
+                try:
+                    if error is not None:
+                        raise error
+                    started = time.perf_counter()
+                    batch_embeddings = self.forward_features(features)
+                    timings['forward_seconds'] += time.perf_counter() - started
+                    self._store_batch(indices, batch_embeddings, embeddings, on_batch, batch_number, len(batches))
+
+                except Exception as e:
+                    print(f"❌ バッチ処理エラー: {e}")
+                    for index in indices:
+                        failures[index] = e
+        finally:
+            # 途中で例外が出てもトークナイズスレッドを止める
+            stop.set()
+            while worker.is_alive():
+                try:
+                    tokenized.get_nowait()
+                except queue.Empty:
+                    worker.join(timeout=0.05)
+
+        return embeddings, failures, timings
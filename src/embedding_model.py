@@ -0,0 +1,179 @@
+"""
+埋め込みモデル読み込みモジュール - ChromaDBに依存せずSentenceTransformerを作成
+（ワーカープロセスからも利用する）
+
+推論バックエンドは環境変数 RAG_EMBEDDING_BACKEND で選択する:
+  - torch: fp32（既定）
+  - int8:  torchの動的量子化（Linear層をint8化）
+  - onnx:  onnxruntime（sentence-transformersのONNXバックエンド、optimum/onnxruntimeが必要）
+"""
+
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# 埋め込みモデル名
+EMBEDDING_MODEL_NAME = 'intfloat/multilingual-e5-small'
+FALLBACK_MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# 推論バックエンド
+EMBEDDING_BACKENDS = ('torch', 'int8', 'onnx')
+EMBEDDING_BACKEND = os.getenv('RAG_EMBEDDING_BACKEND', 'torch')
+
+# パリティチェック用のサンプル文
+PARITY_SAMPLE_TEXTS = [
+    "営業戦略の見直しについて、来期の売上目標と重点顧客を整理する。",
+    "サーバー移行プロジェクトの進捗報告：データベースの切り替えは完了済み。",
+    "チケットABC-123：ログイン画面でエラーが発生する不具合の調査。",
+    "新入社員研修のスケジュールと担当者一覧",
+    "Quarterly review of marketing KPIs and campaign performance.",
+    "議事録：製品ロードマップの優先順位付けと次回リリース範囲の確認",
+    "経費精算の手順。領収書をアップロードし、上長の承認を得ること。",
+    "採用面接の評価基準について人事部と合意した内容",
+]
+
+def cache_model_name(model) -> str:
+    """埋め込みキャッシュのキーに使うモデル識別名（fp32以外はバックエンド名を付与）"""
+    model_name = getattr(model, 'embedding_model_name', EMBEDDING_MODEL_NAME)
+    backend = getattr(model, 'embedding_backend', 'torch')
+    return model_name if backend == 'torch' else f"{model_name}@{backend}"
+
+def _apply_backend(model_name: str, model, backend: str, device: str):
+    """fp32モデルを指定バックエンドに変換（onnxはモデルを読み直す）"""
+    if backend == 'int8':
+        import torch
+        # Linear層の重みをint8に量子化（活性は実行時に動的量子化）
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+    if backend == 'onnx':
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name, device=device, backend='onnx')
+
+    return model
+
+def create_sentence_transformer(model_name: Optional[str] = None, backend: Optional[str] = None):
+    """埋め込みモデルを安全に作成（全バージョン対応）
+
+    model_name を指定した場合はそのモデルだけを読み込み、軽量モデルへの
+    フォールバックは行わない（既存の埋め込みと次元・意味を揃えるため）。
+    backend を省略した場合は RAG_EMBEDDING_BACKEND の設定を使う。
+    """
+    backend = backend or EMBEDDING_BACKEND
+    if backend not in EMBEDDING_BACKENDS:
+        print(f"⚠️ 未対応のバックエンド '{backend}' - torchを使用")
+        backend = 'torch'
+
+    try:
+        from sentence_transformers import SentenceTransformer
+        import torch
+
+        print("埋め込みモデルを読み込み中...")
+
+        # デバイス設定
+        device = 'cpu'  # Streamlit Cloudでは安全にCPUを使用
+
+        requested_name = model_name
+
+        # モデル初期化（バージョン互換性考慮）
+        try:
+            # 最新バージョン用の初期化
+            model_name = requested_name or EMBEDDING_MODEL_NAME
+            model = SentenceTransformer(
+                model_name,
+                device=device,
+                trust_remote_code=False,
+                cache_folder=None
+            )
+        except Exception as e1:
+            print(f"⚠️ 新形式での初期化失敗: {e1}")
+            try:
+                # 従来形式での初期化
+                model_name = requested_name or EMBEDDING_MODEL_NAME
+                model = SentenceTransformer(model_name)
+                model = model.to(device)
+            except Exception as e2:
+                print(f"⚠️ 従来形式でも失敗: {e2}")
+                if requested_name:
+                    raise
+                # より軽量なモデルにフォールバック
+                print("🔄 軽量モデルにフォールバック...")
+                model_name = FALLBACK_MODEL_NAME
+                model = SentenceTransformer(model_name)
+                model = model.to(device)
+
+        # バックエンド変換（失敗時はfp32のまま続行）
+        if backend != 'torch':
+            try:
+                print(f"🔄 推論バックエンドを {backend} に変換中...")
+                model = _apply_backend(model_name, model, backend, device)
+            except Exception as e:
+                print(f"⚠️ バックエンド {backend} への変換失敗 - fp32で続行: {e}")
+                backend = 'torch'
+
+        # キャッシュキー用にモデル名とバックエンドを記録
+        model.embedding_model_name = model_name
+        model.embedding_backend = backend
+
+        print(f"✅ モデル読み込み完了（バックエンド: {backend}）")
+        return model
+
+    except ImportError as e:
+        print(f"❌ SentenceTransformersインポートエラー: {e}")
+        return None
+    except Exception as e:
+        print(f"❌ モデル読み込みエラー: {e}")
+        return None
+
+
+def check_backend_parity(reference_model, candidate_model,
+                         sample_texts: Optional[List[str]] = None) -> Dict:
+    """2つのモデルの埋め込みのコサイン一致度と速度を比較"""
+    sample_texts = sample_texts or PARITY_SAMPLE_TEXTS
+
+    def timed_encode(model):
+        started = time.perf_counter()
+        embeddings = model.encode(sample_texts, convert_to_numpy=True, normalize_embeddings=True,
+                                  show_progress_bar=False)
+        return np.asarray(embeddings, dtype=np.float32), time.perf_counter() - started
+
+    reference, reference_seconds = timed_encode(reference_model)
+    candidate, candidate_seconds = timed_encode(candidate_model)
+
+    cosines = np.sum(reference * candidate, axis=1)
+    return {
+        "samples": len(sample_texts),
+        "mean_cosine": float(np.mean(cosines)),
+        "min_cosine": float(np.min(cosines)),
+        "reference_seconds": reference_seconds,
+        "candidate_seconds": candidate_seconds,
+        "speedup": reference_seconds / candidate_seconds if candidate_seconds else 0.0
+    }
+
+def run_parity_check(backend: str, model_name: str = EMBEDDING_MODEL_NAME,
+                     sample_texts: Optional[List[str]] = None) -> Optional[Dict]:
+    """fp32モデルと指定バックエンドのモデルを読み込んでパリティチェックを実行"""
+    reference = create_sentence_transformer(model_name, backend='torch')
+    candidate = create_sentence_transformer(model_name, backend=backend)
+    if reference is None or candidate is None:
+        print("❌ モデルを読み込めませんでした")
+        return None
+
+    if getattr(candidate, 'embedding_backend', 'torch') != backend:
+        print(f"❌ バックエンド {backend} を利用できません")
+        return None
+
+    report = check_backend_parity(reference, candidate, sample_texts)
+    print(f"\n📊 === パリティチェック: fp32 vs {backend} ===")
+    print(f"サンプル数: {report['samples']}件")
+    print(f"平均コサイン類似度: {report['mean_cosine']:.4f}")
+    print(f"最小コサイン類似度: {report['min_cosine']:.4f}")
+    print(f"速度: fp32 {report['reference_seconds']:.2f}秒 / {backend} {report['candidate_seconds']:.2f}秒 "
+          f"（{report['speedup']:.1f}倍）")
+    return report
+
+if __name__ == "__main__":
+    # 使い方: python src/embedding_model.py int8
+    import sys
+    run_parity_check(sys.argv[1] if len(sys.argv) > 1 else 'int8')
@@ -0,0 +1,159 @@
+"""
+埋め込みワーカープールモジュール - 複数プロセスでSentenceTransformerを並列実行
+各ワーカーはモデルを1回だけ読み込み、torchのスレッド数を固定して動作する
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# ワーカープロセス内で保持するモデル
+_worker_model = None
+
+
+def _init_worker(model_name: str, num_threads: int, backend: str = 'torch'):
+    """ワーカー初期化: スレッド数を固定してからモデルを読み込む"""
+    global _worker_model
+
+    # torchのインポート前に設定しないとOpenMPのスレッド数に反映されない
+    os.environ['OMP_NUM_THREADS'] = str(num_threads)
+    os.environ['MKL_NUM_THREADS'] = str(num_threads)
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+
+    import torch
+    torch.set_num_threads(num_threads)
+
+    from embedding_model import create_sentence_transformer
+    _worker_model = create_sentence_transformer(model_name, backend=backend)
+
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    """ワーカー内で1バッチをエンコード"""
+    if _worker_model is None:
+        raise RuntimeError("ワーカーの埋め込みモデルが読み込まれていません")
+
+    embeddings = _worker_model.encode(
+        texts,
+        batch_size=len(texts),
+        show_progress_bar=False,
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    )
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def default_threads_per_worker(num_workers: int) -> int:
+    """コア数をワーカー数で割ったスレッド数（最低1）"""
+    return max(1, (os.cpu_count() or 1) // max(num_workers, 1))
+
+
+class ProcessPoolEncoder:
+    """プロセスプールでバッチを並列エンコードするエンコーダー
+
+    バッチ分割は planner（EmbeddingEncoder）に任せ、投入中のバッチ数を
+    max_pending で制限する（完了を待ってから次を投入するバックプレッシャー）。
+    """
+
+    def __init__(self, planner, model_name: str, num_workers: int,
+                 threads_per_worker: Optional[int] = None, max_pending: Optional[int] = None,
+                 backend: str = 'torch'):
+        self.planner = planner
+        self.model_name = model_name
+        self.backend = backend
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker or default_threads_per_worker(num_workers)
+        self.max_pending = max_pending or num_workers * 2
+        self._executor = None
+        self._broken = False
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """プールを遅延作成（fork後のtorchは不安定なためspawnを使う）"""
+        if self._broken:
+            raise BrokenProcessPool("ワーカープールは停止済みです")
+        if self._executor is None:
+            print(f"🚀 埋め込みワーカープール起動: {self.num_workers}プロセス × {self.threads_per_worker}スレッド")
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.model_name, self.threads_per_worker, self.backend)
+            )
+        return self._executor
+
+    def encode(self, texts: List[str],
+               on_batch: Optional[Callable[[List[int], np.ndarray], None]] = None,
+               token_counts: Optional[List[int]] = None
+               ) -> Tuple[Dict[int, np.ndarray], Dict[int, Exception]]:
+        """EmbeddingEncoder.encode と同じ形式で結果を返す"""
+        embeddings = {}
+        failures = {}
+
+        batches = self.planner.plan(texts, token_counts)
+
+        completed = 0
+        pending = {}
+
+        def collect(futures):
+            nonlocal completed
+            for future in futures:
+                indices = pending.pop(future)
+                completed += 1
+                try:
+                    try:
+                        batch_embeddings = future.result()
+                    except BrokenProcessPool:
+                        # ワーカーが異常終了した場合はこのプロセスでエンコード
+                        batch_embeddings = self._encode_locally([texts[i] for i in indices])
+                    for index, embedding in zip(indices, batch_embeddings):
+                        embeddings[index] = embedding
+                    if on_batch:
+                        on_batch(indices, batch_embeddings)
+                    print(f"✅ バッチ {completed}/{len(batches)} 完了（{len(indices)}件）")
+                except Exception as e:
+                    print(f"❌ バッチ処理エラー: {e}")
+                    for index in indices:
+                        failures[index] = e
+
+        for indices in batches:
+            if len(pending) >= self.max_pending:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                collect(done)
+            try:
+                future = self._get_executor().submit(_encode_in_worker, [texts[i] for i in indices])
+            except BrokenProcessPool:
+                future = self._local_future([texts[i] for i in indices])
+            pending[future] = indices
+
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            collect(done)
+
+        return embeddings, failures
+
+    def _encode_locally(self, batch_texts: List[str]) -> np.ndarray:
+        """プールが使えなくなった場合にこのプロセスのモデルでエンコード"""
+        if self._executor is not None:
+            print("⚠️ ワーカープールが停止しました - このプロセスでエンコードを続行")
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            self._broken = True
+        return self.planner.encode_batch(batch_texts)
+
+    def _local_future(self, batch_texts: List[str]) -> Future:
+        """このプロセスでエンコードした結果を完了済みFutureとして返す"""
+        future = Future()
+        try:
+            future.set_result(self._encode_locally(batch_texts))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self):
+        """ワーカープロセスを終了"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -1,7 +1,7 @@
 import sys
 import os
+import itertools
 import streamlit as st
-import gc
 import time
 
 # 絶対パスでsrcディレクトリを追加
@@ -9,8 +9,47 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 src_path = os.path.join(current_dir, '..', 'src') if 'src' not in current_dir else current_dir
 sys.path.insert(0, src_path)
 
+def new_tally():
+    """取得した文書の集計（全件をメモリに保持せずに結果表示に使う）"""
+    return {
+        'total': 0,
+        'chars': 0,
+        'sources': {},
+        'types': {},
+        'notion_types': {},
+        'gdrive_categories': {},
+        'gdrive_priorities': {}
+    }
+
+def tally_documents(documents, tally):
+    """文書をそのまま流しながらソース別・タイプ別の件数と文字数を集計
+    
+    add_documents の読み込みスレッドで実行されるため、ここではStreamlitを呼ばない。
+    """
+    for doc in documents:
+        source = doc.get('source', '不明')
+        doc_type = doc.get('type', '不明')
+        
+        tally['total'] += 1
+        tally['chars'] += len(doc.get('content', ''))
+        tally['sources'][source] = tally['sources'].get(source, 0) + 1
+        tally['types'][doc_type] = tally['types'].get(doc_type, 0) + 1
+        
+        if source == 'notion':
+            tally['notion_types'][doc_type] = tally['notion_types'].get(doc_type, 0) + 1
+        elif source == 'gdrive':
+            category = doc.get('category', '不明')
+            priority = doc.get('priority', '不明')
+            tally['gdrive_categories'][category] = tally['gdrive_categories'].get(category, 0) + 1
+            tally['gdrive_priorities'][priority] = tally['gdrive_priorities'].get(priority, 0) + 1
+        
+        yield doc
+
 def run_data_integration():
-    """最適化版データ統合（実用性と可用性のバランス）"""
+    """最適化版データ統合（実用性と可用性のバランス）
+    
+    各ソースの文書はリストに溜めず、取得しながらウィンドウ単位でベクトル化・書き込みする。
+    """
     
     # 統合開始表示
     st.info("⚖️ 最適化データ統合を開始...")
@@ -20,9 +59,11 @@ def run_data_integration():
     # パフォーマンス監視
     start_time = time.time()
     
+    # 取得元ごとの文書イテラブル（ベクトル統合時に順に取り出す）と集計
+    sources = []
+    tally = new_tally()
+    
     try:
-        documents = []
-        
         # === 最適化設定 ===
         NOTION_OPTIMIZED = 150    # 300 → 150 (50%削減)
         GDRIVE_OPTIMIZED = 100    # 200 → 100 (50%削減)
@@ -43,34 +84,18 @@ def run_data_integration():
                 notion = NotionProcessor()
                 st.success("📝 NotionProcessor インスタンス作成成功")
                 
-                # 最適化取得実行
-                notion_docs = notion.get_all_pages()
-                st.info(f"📝 Notion最適化取得結果: {len(notion_docs) if notion_docs else 0}件")
-                
-                if notion_docs:
-                    documents.extend(notion_docs)
-                    st.success(f"✅ Notion最適化取得成功: {len(notion_docs)}件")
-                    
-                    # 詳細内訳表示
-                    with st.expander("📊 Notion取得詳細"):
-                        notion_types = {}
-                        for doc in notion_docs:
-                            doc_type = doc.get('type', '不明')
-                            notion_types[doc_type] = notion_types.get(doc_type, 0) + 1
-                        
-                        for doc_type, count in notion_types.items():
-                            st.write(f"- {doc_type}: {count}件")
+                if notion.client:
+                    # 取得はベクトル統合時に1件ずつ行う（全件をメモリに溜めない）
+                    sources.append(notion.iter_documents())
+                    st.info("📝 Notion取得を登録しました（統合時に順次取得）")
                 else:
-                    st.warning("⚠️ Notionデータが空です")
+                    st.warning("⚠️ Notionクライアントを初期化できませんでした")
             else:
                 st.error("❌ NOTION_TOKENが設定されていません")
                 
         except Exception as e:
             st.error(f"❌ Notion取得エラー: {e}")
         
-        # メモリクリーンアップ
-        gc.collect()
-        
         # 2. Google Drive最適化処理
         status_text.text("📂 Google Drive最適化取得中...")
         progress_bar.progress(50)
@@ -117,40 +142,13 @@ def run_data_integration():
                             test_files = test_result.get('files', [])
                             st.success(f"✅ 接続テスト成功: {len(test_files)}件のファイルにアクセス可能")
                             
-                            # 最適化版ファイル取得実行
-                            st.info("📂 最適化版ファイル取得中（100件上限・効率重視）...")
-                            gdrive_docs = gdrive.get_all_files()
-                            st.info(f"📂 Google Drive最適化取得結果: {len(gdrive_docs) if gdrive_docs else 0}件")
+                            # ファイル取得はベクトル統合時に行う（Notionの書き込み後に取得）
+                            # get_all_files は100件上限のリストを返すため、保持するのはこの取得分のみ
+                            def iter_gdrive_files(gdrive=gdrive):
+                                yield from gdrive.get_all_files() or []
                             
-                            if gdrive_docs:
-                                documents.extend(gdrive_docs)
-                                st.success(f"✅ Google Drive最適化取得成功: {len(gdrive_docs)}件")
-                                
-                                # 詳細内訳表示
-                                with st.expander("📋 Google Drive取得詳細"):
-                                    gdrive_categories = {}
-                                    gdrive_priorities = {}
-                                    
-                                    for doc in gdrive_docs:
-                                        category = doc.get('category', '不明')
-                                        priority = doc.get('priority', '不明')
-                                        
-                                        gdrive_categories[category] = gdrive_categories.get(category, 0) + 1
-                                        gdrive_priorities[priority] = gdrive_priorities.get(priority, 0) + 1
-                                    
-                                    st.write("**カテゴリ別:**")
-                                    for category, count in gdrive_categories.items():
-                                        st.write(f"- {category}: {count}件")
-                                    
-                                    st.write("**重要度別:**")
-                                    for priority, count in gdrive_priorities.items():
-                                        st.write(f"- {priority}: {count}件")
-                            else:
-                                st.warning("⚠️ Google Driveデータが空です")
-                                st.info("💡 考えられる原因:")
-                                st.write("- Service Accountにファイルが共有されていない")
-                                st.write("- 対象ファイルがない、または形式が非対応")
-                                st.write("- アクセス権限が不足している")
+                            sources.append(iter_gdrive_files())
+                            st.info("📂 最適化版ファイル取得を登録しました（100件上限・統合時に取得）")
                                 
                         except Exception as api_error:
                             st.error(f"❌ Google Drive API呼び出しエラー: {api_error}")
@@ -176,9 +174,6 @@ def run_data_integration():
         except Exception as e:
             st.error(f"❌ Google Drive取得エラー: {e}")
         
-        # メモリクリーンアップ
-        gc.collect()
-        
         # 3. Discord処理（スキップ）
         status_text.text("💬 Discord処理をスキップ中...")
         progress_bar.progress(70)
@@ -188,41 +183,40 @@ def run_data_integration():
         status_text.text("🔄 最適化ベクトル統合中...")
         progress_bar.progress(90)
         
-        st.info(f"🔄 最適化統合処理: 合計{len(documents)}件のデータを処理中...")
-        
-        if documents:
+        if sources:
             from vector_db_processor import VectorDBProcessor
             vector_db = VectorDBProcessor()
             
             if vector_db.collection:
-                # バッチ処理で負荷軽減
+                # 取得しながらウィンドウ単位でエンコード・書き込み
                 batch_size = 10
-                total_batches = (len(documents) + batch_size - 1) // batch_size
                 
-                st.info(f"🔄 {len(documents)}件を{batch_size}件ずつ{total_batches}バッチで処理中...")
+                st.info(f"🔄 取得した文書を{batch_size}件ずつ順次処理中...")
+                
+                # 旧形式IDで重複登録された行を削除
+                removed_count = vector_db.remove_legacy_documents()
+                if removed_count:
+                    st.info(f"🧹 旧形式IDの重複文書を削除: {removed_count}件")
                 
                 # 統合前のカウント
                 before_count = vector_db.collection.count()
                 st.info(f"📊 統合前のDB件数: {before_count}件")
                 
-                for i in range(0, len(documents), batch_size):
-                    batch = documents[i:i + batch_size]
-                    
-                    try:
-                        vector_db.add_documents(batch)
-                        
-                        # 進捗表示
-                        batch_num = i // batch_size + 1
-                        st.info(f"📊 バッチ{batch_num}/{total_batches}完了 ({len(batch)}件処理)")
-                        
-                        # 3バッチごとにメモリクリーンアップ
-                        if batch_num % 3 == 0:
-                            gc.collect()
-                            time.sleep(0.1)  # 負荷軽減
-                        
-                    except Exception as batch_error:
-                        st.warning(f"⚠️ バッチ{batch_num}処理エラー: {batch_error}")
-                        continue
+                def report_progress(batch_num, document_count, chunk_count):
+                    st.info(f"📊 バッチ{batch_num}完了 ({document_count}件処理・累計{tally['total']}件取得)")
+                
+                try:
+                    documents = tally_documents(itertools.chain.from_iterable(sources), tally)
+                    vector_db.add_documents(documents, window_size=batch_size, on_window=report_progress)
+                except Exception as batch_error:
+                    st.warning(f"⚠️ ベクトル統合処理エラー: {batch_error}")
+                
+                show_source_details(tally)
+                if not tally['total']:
+                    progress_bar.progress(100)
+                    status_text.text("❌ 統合データなし")
+                    show_no_data_diagnostics()
+                    return False
                 
                 # 最終確認
                 after_count = vector_db.collection.count()
@@ -238,7 +232,7 @@ def run_data_integration():
                 st.success(f"⏰ 処理時間: {elapsed_time:.1f}秒")
                 
                 # 最適化結果詳細
-                display_optimization_results(documents, elapsed_time)
+                display_optimization_results(tally, elapsed_time)
                 
                 return True
             else:
@@ -247,22 +241,7 @@ def run_data_integration():
         else:
             progress_bar.progress(100)
             status_text.text("❌ 統合データなし")
-            
-            st.warning("⚠️ 統合するデータが見つかりませんでした")
-            st.error("❌ 全てのサービスでデータが0件でした")
-            
-            # 診断情報
-            with st.expander("🔍 診断情報"):
-                st.write("**考えられる原因:**")
-                st.write("1. **Notion**: アクセス権限、ページが存在しない")
-                st.write("2. **Google Drive**: Service Account未共有、ファイルが存在しない")
-                st.write("3. **認証**: API認証情報の問題")
-                
-                st.write("**対策:**")
-                st.write("1. 各サービスの個別テストを実行")
-                st.write("2. 認証情報の再確認")
-                st.write("3. ファイル共有設定の確認")
-            
+            show_no_data_diagnostics()
             return False
             
     except Exception as e:
@@ -272,7 +251,7 @@ def run_data_integration():
         # エラー分析
         with st.expander("🔍 エラー分析"):
             st.write(f"**実行時間**: {elapsed_time:.1f}秒")
-            st.write(f"**処理済み件数**: {len(documents) if 'documents' in locals() else 0}件")
+            st.write(f"**処理済み件数**: {tally['total']}件")
             st.write(f"**エラータイプ**: {type(e).__name__}")
             
             if elapsed_time > 300:  # 5分超過
@@ -284,40 +263,70 @@ def run_data_integration():
         
         return False
 
-def display_optimization_results(documents, elapsed_time):
-    """最適化結果表示"""
+def show_source_details(tally):
+    """ソースごとの取得結果と内訳を表示"""
+    notion_count = tally['sources'].get('notion', 0)
+    if notion_count:
+        st.success(f"✅ Notion最適化取得成功: {notion_count}件")
+        with st.expander("📊 Notion取得詳細"):
+            for doc_type, count in tally['notion_types'].items():
+                st.write(f"- {doc_type}: {count}件")
+    
+    gdrive_count = tally['sources'].get('gdrive', 0)
+    if gdrive_count:
+        st.success(f"✅ Google Drive最適化取得成功: {gdrive_count}件")
+        with st.expander("📋 Google Drive取得詳細"):
+            st.write("**カテゴリ別:**")
+            for category, count in tally['gdrive_categories'].items():
+                st.write(f"- {category}: {count}件")
+            
+            st.write("**重要度別:**")
+            for priority, count in tally['gdrive_priorities'].items():
+                st.write(f"- {priority}: {count}件")
+
+def show_no_data_diagnostics():
+    """全ソースで0件だった場合の診断情報"""
+    st.warning("⚠️ 統合するデータが見つかりませんでした")
+    st.error("❌ 全てのサービスでデータが0件でした")
+    
+    # 診断情報
+    with st.expander("🔍 診断情報"):
+        st.write("**考えられる原因:**")
+        st.write("1. **Notion**: アクセス権限、ページが存在しない")
+        st.write("2. **Google Drive**: Service Account未共有、ファイルが存在しない")
+        st.write("3. **認証**: API認証情報の問題")
+        
+        st.write("**対策:**")
+        st.write("1. 各サービスの個別テストを実行")
+        st.write("2. 認証情報の再確認")
+        st.write("3. ファイル共有設定の確認")
+
+def display_optimization_results(tally, elapsed_time):
+    """最適化結果表示（tally_documents の集計から）"""
+    
+    document_count = tally['total']
     
     with st.expander("📊 最適化統合結果詳細"):
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            st.metric("総文書数", len(documents))
+            st.metric("総文書数", document_count)
             st.metric("処理時間", f"{elapsed_time:.1f}秒")
         
         with col2:
             # ソース別統計
-            sources = {}
-            types = {}
-            
-            for doc in documents:
-                source = doc.get('source', '不明')
-                doc_type = doc.get('type', '不明')
-                
-                sources[source] = sources.get(source, 0) + 1
-                types[doc_type] = types.get(doc_type, 0) + 1
-            
             st.write("**ソース別:**")
-            for source, count in sources.items():
+            for source, count in tally['sources'].items():
                 st.write(f"- {source}: {count}件")
             
             st.write("**タイプ別:**")
-            for doc_type, count in types.items():
+            for doc_type, count in tally['types'].items():
                 st.write(f"- {doc_type}: {count}件")
         
         with col3:
             # 品質指標
-            total_chars = sum(len(doc.get('content', '')) for doc in documents)
-            avg_chars = total_chars / len(documents) if documents else 0
+            total_chars = tally['chars']
+            avg_chars = total_chars / document_count if document_count else 0
             
             st.metric("総文字数", f"{total_chars:,}")
             st.metric("平均文字数", f"{avg_chars:.0f}")
@@ -332,18 +341,17 @@ def display_optimization_results(documents, elapsed_time):
             st.warning("🐌 処理時間長め - 要最適化")
         
         # 実用性指標
-        if len(documents) >= 200:
+        if document_count >= 200:
             st.success("📊 十分なデータ量 - 高い実用性")
-        elif len(documents) >= 100:
+        elif document_count >= 100:
             st.info("📊 適度なデータ量 - 実用的")
         else:
             st.warning("📊 データ量少なめ - 基本的実用性")
         
         # 推奨事項
         st.write("**推奨事項:**")
-        st.write(f"- **現在のデータ量**: {len(documents)}件は最適バランス")
+        st.write(f"- **現在のデータ量**: {document_count}件は最適バランス")
         st.write(f"- **処理時間**: {elapsed_time:.1f}秒で効率的")
-        st.write(f"- **メモリ使用量**: 約{len(documents)*2}MB (推定)")
 
 def safe_integration():
     """下位互換性のための関数"""
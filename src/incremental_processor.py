@@ -8,17 +8,26 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from vector_db_processor import VectorDBProcessor
 import json
-import time
 from datetime import datetime
 
+def iter_documents_file(data_file):
+    """文書ファイルを1件ずつ読み込む（.jsonl は1行ずつ、旧形式の .json は一括読み込み）"""
+    with open(data_file, 'r', encoding='utf-8') as f:
+        if data_file.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
 def load_collected_data():
-    """収集済みデータを読み込み"""
+    """収集済みデータを (文書のイテレーター, 件数) で返す（文書は読み込みながら生成）"""
     try:
         # 最新の統計ファイルを探す
         stats_files = [f for f in os.listdir('./data/results/') if f.startswith('collection_stats_')]
         if not stats_files:
             print("❌ 統計ファイルが見つかりません")
-            return None
+            return None, 0
             
         latest_stats = sorted(stats_files)[-1]
         stats_path = f'./data/results/{latest_stats}'
@@ -26,53 +35,45 @@ def load_collected_data():
         with open(stats_path, 'r', encoding='utf-8') as f:
             stats = json.load(f)
             
-        # 対応するデータファイルを読み込み
+        # 対応するデータファイル（JSON Lines、なければ旧形式のJSON）
         timestamp = latest_stats.replace('collection_stats_', '').replace('.json', '')
-        data_file = f'./data/results/all_documents_{timestamp}.json'
+        data_file = f'./data/results/all_documents_{timestamp}.jsonl'
+        if not os.path.exists(data_file):
+            data_file = f'./data/results/all_documents_{timestamp}.json'
         
         if not os.path.exists(data_file):
             print(f"❌ データファイルが見つかりません: {data_file}")
-            return None
-            
-        with open(data_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            
-        print(f"✅ データ読み込み完了: {len(data)}件")
-        return data
+            return None, 0
+        
+        total = stats.get('total_count', 0)
+        print(f"✅ データファイル: {data_file}（{total}件）")
+        return iter_documents_file(data_file), total
         
     except Exception as e:
         print(f"❌ データ読み込みエラー: {e}")
-        return None
+        return None, 0
 
-def process_in_batches(data, batch_size=20):
-    """バッチ処理でデータを保存"""
-    if not data:
+def process_in_batches(data, total, batch_size=20):
+    """バッチ処理でデータを保存（data は任意のイテラブル、total は進捗表示用の件数）"""
+    if data is None or not total:
         print("❌ 処理するデータがありません")
         return False
         
     try:
         processor = VectorDBProcessor()
+        processor.remove_legacy_documents()
+        processor.retry_quarantined()
         
-        total_batches = (len(data) + batch_size - 1) // batch_size
-        print(f"📊 {len(data)}件のデータを{batch_size}件ずつ{total_batches}バッチで処理します")
+        total_batches = (total + batch_size - 1) // batch_size
+        print(f"📊 {total}件のデータを{batch_size}件ずつ{total_batches}バッチで処理します")
         
-        for i in range(0, len(data), batch_size):
-            batch = data[i:i + batch_size]
-            batch_num = (i // batch_size) + 1
-            
-            print(f"\n📦 バッチ {batch_num}/{total_batches} 処理中... ({len(batch)}件)")
-            
-            # バッチ処理
-            processor.add_documents(batch)
-            
-            print(f"✅ バッチ {batch_num} 完了")
-            
-            # メモリ解放のための短い休憩
-            time.sleep(1)
-            
-            # 進捗確認
-            current_count = processor.collection.count()
-            print(f"📊 現在のDB文書数: {current_count}件")
+        def report_progress(batch_num, document_count, chunk_count):
+            print(f"✅ バッチ {batch_num}/{total_batches} 完了 ({document_count}件・{chunk_count}チャンク)")
+        
+        # ファイルから読みながらウィンドウ単位でエンコード・書き込み（メモリは件数に依存しない）
+        processor.add_documents(data, window_size=batch_size, on_window=report_progress)
+        
+        processor.close_worker_pool()
         
         final_count = processor.collection.count()
         print(f"\n🎉 全データの統合完了！")
@@ -89,12 +90,12 @@ def main():
     print("=" * 50)
     
     # データ読み込み
-    data = load_collected_data()
-    if not data:
+    data, total = load_collected_data()
+    if data is None:
         return
     
     # バッチ処理で統合
-    success = process_in_batches(data, batch_size=15)  # さらに小さなバッチ
+    success = process_in_batches(data, total, batch_size=15)  # さらに小さなバッチ
     
     if success:
         print("\n✅ データ統合が正常に完了しました！")
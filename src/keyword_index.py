@@ -0,0 +1,301 @@
+"""
+キーワード索引モジュール - 文字バイグラム転置インデックスによるBM25検索（SQLite永続化）
+SQLite FTS5（trigram）によるフレーズ・ID検索も提供
+"""
+
+import math
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# BM25パラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 英数字は単語単位、それ以外（日本語など）は文字バイグラムで索引化
+_WORD_PATTERN = re.compile(r'[a-z0-9]+|[^\W\da-z_]+')
+
+_SQL_CHUNK_SIZE = 500
+
+# 検索対象を絞り込む行IDを入れる一時テーブル（接続ごと）
+_ALLOWED_TABLE_SQL = "CREATE TEMP TABLE IF NOT EXISTS allowed_ids (doc_id TEXT PRIMARY KEY)"
+
+
+def _load_allowed_ids(conn: sqlite3.Connection, allowed_ids: Iterable[str]):
+    """検索対象の行IDを一時テーブルに読み込む（呼び出し側でロックを保持すること）"""
+    conn.execute("DELETE FROM temp.allowed_ids")
+    conn.executemany("INSERT OR IGNORE INTO temp.allowed_ids (doc_id) VALUES (?)",
+                     ((doc_id,) for doc_id in allowed_ids))
+
+
+def tokenize_bigrams(text: str) -> List[str]:
+    """テキストを索引語に分割（英数字は単語、日本語は文字バイグラム）"""
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    terms = []
+    for run in _WORD_PATTERN.findall(text):
+        if run.isascii() or len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+class BigramIndex:
+    """文字バイグラム転置インデックス（BM25スコアリング）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS docs (
+                doc_id TEXT PRIMARY KEY,
+                length INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+            """
+        )
+        self._conn.execute(_ALLOWED_TABLE_SQL)
+        self._conn.commit()
+
+    def count(self) -> int:
+        """索引済み文書数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def upsert(self, rows: Iterable[Tuple[str, str]]):
+        """(doc_id, text) の組を索引に登録（既存の索引は置き換え）"""
+        rows = list(rows)
+        if not rows:
+            return
+
+        with self._lock:
+            self._delete_locked([doc_id for doc_id, _ in rows])
+
+            doc_rows = []
+            posting_rows = []
+            for doc_id, text in rows:
+                terms = tokenize_bigrams(text)
+                doc_rows.append((doc_id, len(terms)))
+                posting_rows.extend((term, doc_id, tf) for term, tf in Counter(terms).items())
+
+            self._conn.executemany("INSERT INTO docs (doc_id, length) VALUES (?, ?)", doc_rows)
+            self._conn.executemany("INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)", posting_rows)
+            self._conn.commit()
+
+    def delete(self, doc_ids: List[str]):
+        """文書を索引から削除"""
+        if not doc_ids:
+            return
+        with self._lock:
+            self._delete_locked(doc_ids)
+            self._conn.commit()
+
+    def _delete_locked(self, doc_ids: List[str]):
+        for i in range(0, len(doc_ids), _SQL_CHUNK_SIZE):
+            chunk = doc_ids[i:i + _SQL_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            self._conn.execute(f"DELETE FROM postings WHERE doc_id IN ({placeholders})", chunk)
+            self._conn.execute(f"DELETE FROM docs WHERE doc_id IN ({placeholders})", chunk)
+
+    def clear(self):
+        """索引を全削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM docs")
+            self._conn.commit()
+
+    def search(self, query: str, n_results: int = 20,
+               allowed_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """BM25で検索し (doc_id, score) をスコア降順で返す
+
+        allowed_ids を指定した場合はその行だけを採点する（IDF・平均長は索引全体で計算）。
+        """
+        query_terms = list(dict.fromkeys(tokenize_bigrams(query)))
+        if not query_terms:
+            return []
+        if allowed_ids is not None:
+            allowed_ids = list(allowed_ids)
+            if not allowed_ids:
+                return []
+
+        with self._lock:
+            total_docs, total_length = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs"
+            ).fetchone()
+            if total_docs == 0:
+                return []
+
+            placeholders = ','.join('?' * len(query_terms))
+            if allowed_ids is None:
+                rows = self._conn.execute(
+                    f"SELECT p.term, p.doc_id, p.tf, d.length FROM postings p "
+                    f"JOIN docs d ON d.doc_id = p.doc_id WHERE p.term IN ({placeholders})",
+                    query_terms
+                ).fetchall()
+                document_frequency = Counter(term for term, _, _, _ in rows)
+            else:
+                document_frequency = Counter(dict(self._conn.execute(
+                    f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term",
+                    query_terms
+                ).fetchall()))
+                _load_allowed_ids(self._conn, allowed_ids)
+                rows = self._conn.execute(
+                    f"SELECT p.term, p.doc_id, p.tf, d.length FROM temp.allowed_ids a "
+                    f"JOIN postings p ON p.doc_id = a.doc_id JOIN docs d ON d.doc_id = p.doc_id "
+                    f"WHERE p.term IN ({placeholders})",
+                    query_terms
+                ).fetchall()
+                self._conn.execute("DELETE FROM temp.allowed_ids")
+
+        avg_length = total_length / total_docs if total_docs else 0.0
+
+        scores: Dict[str, float] = {}
+        for term, doc_id, tf, length in rows:
+            df = document_frequency[term]
+            idf = math.log((total_docs - df + 0.5) / (df + 0.5) + 1.0)
+            norm = 1.0 - BM25_B + BM25_B * (length / avg_length if avg_length else 0.0)
+            scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1.0) / (tf + BM25_K1 * norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:n_results]
+
+    def close(self):
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
+
+
+# トライグラムトークナイザーで一致できる最小文字数
+FTS_MIN_TERM_LENGTH = 3
+
+# bm25() の列重み（doc_id, title, content）
+FTS_COLUMN_WEIGHTS = (0.0, 2.0, 1.0)
+
+
+def build_fts_query(query: str) -> str:
+    """検索語をFTS5のフレーズ検索式に変換（3文字未満の語は除外、空白区切りはAND）"""
+    terms = unicodedata.normalize('NFKC', str(query)).split()
+    phrases = []
+    for term in terms:
+        if len(term) >= FTS_MIN_TERM_LENGTH:
+            phrases.append('"' + term.replace('"', '""') + '"')
+    return ' '.join(phrases)
+
+
+class FTS5Index:
+    """SQLite FTS5（trigramトークナイザー）による完全一致・部分一致検索"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # trigramトークナイザーはSQLite 3.34以降が必要（古い場合は例外）
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5("
+            "doc_id UNINDEXED, title, content, tokenize='trigram')"
+        )
+        self._conn.execute(_ALLOWED_TABLE_SQL)
+        self._conn.commit()
+
+    def count(self) -> int:
+        """索引済み文書数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM fts").fetchone()[0]
+
+    def upsert(self, rows: Iterable[Tuple[str, str, str]]):
+        """(doc_id, title, text) の組を索引に登録（既存の索引は置き換え）"""
+        rows = [(doc_id, unicodedata.normalize('NFKC', title), unicodedata.normalize('NFKC', text))
+                for doc_id, title, text in rows]
+        if not rows:
+            return
+
+        with self._lock:
+            self._delete_locked([doc_id for doc_id, _, _ in rows])
+            self._conn.executemany("INSERT INTO fts (doc_id, title, content) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def delete(self, doc_ids: List[str]):
+        """文書を索引から削除"""
+        if not doc_ids:
+            return
+        with self._lock:
+            self._delete_locked(doc_ids)
+            self._conn.commit()
+
+    def _delete_locked(self, doc_ids: List[str]):
+        for i in range(0, len(doc_ids), _SQL_CHUNK_SIZE):
+            chunk = doc_ids[i:i + _SQL_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            self._conn.execute(f"DELETE FROM fts WHERE doc_id IN ({placeholders})", chunk)
+
+    def clear(self):
+        """索引を全削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM fts")
+            self._conn.commit()
+
+    def search(self, query: str, n_results: int = 20,
+               allowed_ids: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """フレーズ検索し (doc_id, score) をスコア降順で返す（検索式が作れなければ空）
+
+        allowed_ids を指定した場合はその行の中から上位を返す。
+        """
+        fts_query = build_fts_query(query)
+        if not fts_query:
+            return []
+        if allowed_ids is not None:
+            allowed_ids = list(allowed_ids)
+            if not allowed_ids:
+                return []
+
+        weights = ', '.join(str(weight) for weight in FTS_COLUMN_WEIGHTS)
+        with self._lock:
+            if allowed_ids is None:
+                rows = self._conn.execute(
+                    f"SELECT doc_id, bm25(fts, {weights}) AS rank FROM fts "
+                    f"WHERE fts MATCH ? ORDER BY rank LIMIT ?",
+                    (fts_query, n_results)
+                ).fetchall()
+            else:
+                _load_allowed_ids(self._conn, allowed_ids)
+                rows = self._conn.execute(
+                    f"SELECT doc_id, bm25(fts, {weights}) AS rank FROM fts "
+                    f"WHERE fts MATCH ? AND doc_id IN (SELECT doc_id FROM temp.allowed_ids) "
+                    f"ORDER BY rank LIMIT ?",
+                    (fts_query, n_results)
+                ).fetchall()
+                self._conn.execute("DELETE FROM temp.allowed_ids")
+
+        # bm25() は小さいほど良いので符号を反転
+        return [(doc_id, -rank) for doc_id, rank in rows]
+
+    def close(self):
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
@@ -6,8 +6,9 @@
 import os
 import json
 import time
+import itertools
 from datetime import datetime
-from typing import List, Dict
+from typing import Iterable, Iterator, List, Dict
 
 from dotenv import load_dotenv
 
@@ -75,19 +76,22 @@ class MainProcessor:
     
     def collect_notion_data(self) -> List[Dict]:
         """Notionデータを収集"""
+        pages = list(self.iter_notion_data())
+        print(f"✅ Notion: {len(pages)} ページを収集しました")
+        return pages
+    
+    def iter_notion_data(self) -> Iterator[Dict]:
+        """Notionデータを1件ずつ生成（全件をメモリに溜めない）"""
         if not NOTION_AVAILABLE:
             print("⚠️ Notion processor が利用できません")
-            return []
+            return
         
         try:
             print("\n🔄 Notionデータの収集開始...")
             processor = NotionProcessor(notion_token=os.getenv("NOTION_TOKEN"))
-            pages = processor.process_all_content()
-            print(f"✅ Notion: {len(pages)} ページを収集しました")
-            return pages
+            yield from processor.iter_documents()
         except Exception as e:
             print(f"❌ Notionデータ収集エラー: {e}")
-            return []
     
     def collect_gdrive_data(self) -> List[Dict]:
         """Google Driveデータを収集"""
@@ -163,38 +167,59 @@ class MainProcessor:
             return []
     
     def process_all_data(self, discord_server_id: int = None) -> Dict:
-        """全てのデータソースからデータを収集・処理"""
+        """全てのデータソースからデータを収集・処理
+        
+        各ソースの文書はリストに溜めず、取得しながらベクトルデータベースへ書き込み、
+        同時にJSON Lines形式の文書ファイルへ1行ずつ保存する。
+        """
         print("🚀 全データソースからの収集を開始します...")
         
-        all_documents = []
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        docs_file = f"{self.results_dir}/all_documents_{timestamp}.jsonl"
         collection_stats = {
             'notion_count': 0,
             'gdrive_count': 0, 
             'discord_count': 0,
             'total_count': 0,
+            'vector_db_chunks': 0,
             'start_time': datetime.now().isoformat()
         }
         
-        # Notionデータ収集
-        notion_data = self.collect_notion_data()
-        if notion_data:
-            all_documents.extend(notion_data)
-            collection_stats['notion_count'] = len(notion_data)
+        # ソースは順に取り出す（Google Drive・Discordは前のソースの書き込み後に取得）
+        sources = [
+            ('notion_count', self.iter_notion_data()),
+            ('gdrive_count', self._iter_lazy(self.collect_gdrive_data)),
+        ]
+        if discord_server_id:
+            sources.append(('discord_count', self._iter_lazy(self.collect_discord_data, discord_server_id)))
         
-        # Google Driveデータ収集
-        gdrive_data = self.collect_gdrive_data()
-        if gdrive_data:
-            all_documents.extend(gdrive_data)
-            collection_stats['gdrive_count'] = len(gdrive_data)
+        documents = itertools.chain.from_iterable(
+            self._count_documents(source, collection_stats, key) for key, source in sources
+        )
         
-        # Discordデータ収集
-        if discord_server_id:
-            discord_data = self.collect_discord_data(discord_server_id)
-            if discord_data:
-                all_documents.extend(discord_data)
-                collection_stats['discord_count'] = len(discord_data)
+        try:
+            with open(docs_file, 'w', encoding='utf-8') as f:
+                documents = self._write_documents(documents, f)
+                
+                # ベクトルデータベースに保存
+                if self.vector_db:
+                    print(f"\n💾 収集しながらベクトルデータベースに保存中...")
+                    self.vector_db.add_documents(documents)
+                    # 取り出した件数ではなく実際に書き込めたチャンク数で判定
+                    collection_stats['vector_db_chunks'] = self.vector_db.last_ingest['chunks']
+                    collection_stats['vector_db_success'] = collection_stats['vector_db_chunks'] > 0
+                else:
+                    print("⚠️ ベクトルデータベースが利用できません - ファイルにのみ保存します")
+                    for _ in documents:
+                        pass
+                    collection_stats['vector_db_success'] = False
+        except Exception as e:
+            print(f"❌ 文書の収集・保存エラー: {e}")
+            collection_stats['vector_db_success'] = False
         
-        collection_stats['total_count'] = len(all_documents)
+        if not collection_stats['total_count']:
+            print("⚠️ 保存するデータがありません")
+            collection_stats['vector_db_success'] = False
         collection_stats['end_time'] = datetime.now().isoformat()
         
         print(f"\n📊 データ収集完了:")
@@ -203,41 +228,41 @@ class MainProcessor:
         print(f"   Discord: {collection_stats['discord_count']} 件")
         print(f"   合計: {collection_stats['total_count']} 件")
         
-        # ベクトルデータベースに保存
-        if self.vector_db and all_documents:
-            print(f"\n💾 ベクトルデータベースに保存中...")
-            success = self.vector_db.add_documents(all_documents)
-            collection_stats['vector_db_success'] = success
-        else:
-            print("⚠️ ベクトルデータベースが利用できないか、データがありません")
-            collection_stats['vector_db_success'] = False
-        
         # 結果を保存
-        self.save_results(all_documents, collection_stats)
+        self.save_results(collection_stats, timestamp)
+        print(f"   文書: {docs_file}")
         
         return {
-            'documents': all_documents,
+            'documents_file': docs_file,
             'stats': collection_stats
         }
     
-    def save_results(self, documents: List[Dict], stats: Dict):
-        """結果をファイルに保存"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
+    def _iter_lazy(self, collect, *args) -> Iterator[Dict]:
+        """取り出し開始時に collect を呼んでその結果を生成"""
+        yield from collect(*args) or []
+    
+    def _count_documents(self, documents: Iterable[Dict], stats: Dict, key: str) -> Iterator[Dict]:
+        """文書を流しながらソース別・合計件数を数える"""
+        for doc in documents:
+            stats[key] += 1
+            stats['total_count'] += 1
+            yield doc
+    
+    def _write_documents(self, documents: Iterable[Dict], f) -> Iterator[Dict]:
+        """文書を流しながらJSON Lines形式で1行ずつ書き出す"""
+        for doc in documents:
+            f.write(json.dumps(doc, ensure_ascii=False, default=str) + "\n")
+            yield doc
+    
+    def save_results(self, stats: Dict, timestamp: str):
+        """統計情報をファイルに保存（文書は process_all_data で all_documents_{timestamp}.jsonl に保存済み）"""
         try:
-            # 統計情報を保存
             stats_file = f"{self.results_dir}/collection_stats_{timestamp}.json"
             with open(stats_file, 'w', encoding='utf-8') as f:
                 json.dump(stats, f, ensure_ascii=False, indent=2)
             
-            # 全文書データを保存
-            docs_file = f"{self.results_dir}/all_documents_{timestamp}.json"
-            with open(docs_file, 'w', encoding='utf-8') as f:
-                json.dump(documents, f, ensure_ascii=False, indent=2)
-            
             print(f"💾 結果を保存しました:")
             print(f"   統計: {stats_file}")
-            print(f"   文書: {docs_file}")
             
         except Exception as e:
             print(f"❌ 結果保存エラー: {e}")
@@ -3,34 +3,116 @@ Notion データ処理モジュール - 最適化版（実用性と可用性の
 """
 
 import streamlit as st
-from typing import List, Dict, Optional
+import hashlib
+import itertools
+import json
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, List, Dict, Optional, Tuple
 from notion_client import Client
-import gc
 import time
+from datetime import datetime, timedelta, timezone
+
+from rate_limiter import call_with_rate_limit, get_shared_limiter
+
+# === API呼び出し設定 ===
+NOTION_REQUESTS_PER_SECOND = 3.0   # Notion APIの平均レート上限（インテグレーションごと）
+NOTION_BURST = 3                   # 連続で送れるリクエスト数
+NOTION_MAX_WORKERS = 4             # ページ・データベースを並行取得するスレッド数
+NOTION_SEARCH_PAGE_SIZE = 100      # 検索1回あたりの取得件数（API上限）
+
+# === 取得上限（0で無制限、環境変数で上書き可能） ===
+NOTION_MAX_PAGES = int(os.getenv('NOTION_MAX_PAGES', '120'))
+NOTION_MAX_DATABASES = int(os.getenv('NOTION_MAX_DATABASES', '30'))
+NOTION_CONTENT_LIMIT = int(os.getenv('NOTION_CONTENT_LIMIT', '20000'))  # 1文書あたり文字制限
+NOTION_BLOCK_LIMIT = 1000          # 1ページあたりの取得ブロック数上限
+
+# === データベース行の取得設定 ===
+NOTION_EXPORT_DATABASE_ROWS = True # データベースの各行を個別の文書として取得するか
+NOTION_MAX_DATABASE_ROWS = int(os.getenv('NOTION_MAX_DATABASE_ROWS', '0'))  # 1データベースあたりの行数上限（0で無制限）
+NOTION_QUERY_PAGE_SIZE = 100       # databases.query 1回あたりの取得件数（API上限）
+NOTION_PROPERTY_METADATA_PREFIX = "prop_"  # 行のプロパティをフィルタ用メタデータにする際のキー接頭辞
+NOTION_PROPERTY_METADATA_MAX_CHARS = 200   # メタデータに入れる文字列値の上限
+
+# === ブロックツリー取得設定 ===
+NOTION_BLOCK_WORKERS = 3           # 1ページ内で子ブロックを並行取得するスレッド数
+NOTION_BLOCK_PAGE_SIZE = 100       # 子ブロック取得1回あたりの件数（API上限）
+NOTION_MAX_BLOCK_DEPTH = 8         # 子ブロックをたどる深さの上限
+
+# 本文を持つブロック種別（rich_text から抽出）と行頭の記号
+RICH_TEXT_BLOCK_PREFIXES = {
+    'paragraph': '',
+    'heading_1': '# ',
+    'heading_2': '## ',
+    'heading_3': '### ',
+    'bulleted_list_item': '- ',
+    'numbered_list_item': '1. ',
+    'toggle': '▸ ',
+    'quote': '> ',
+    'callout': '',
+    'code': '',
+    'template': '',
+}
+# キャプションとURLを持つ埋め込み系ブロック
+MEDIA_BLOCK_TYPES = ('image', 'video', 'file', 'pdf', 'audio')
+LINK_BLOCK_TYPES = ('bookmark', 'embed', 'link_preview')
+# 別文書として取得するため子ブロックをたどらない種別
+SEPARATE_DOCUMENT_BLOCK_TYPES = ('child_page', 'child_database')
+
+# === 差分同期設定 ===
+# ワークスペース（トークン）ごとに、前回同期した最新の last_edited_time を保存する
+NOTION_DATA_DIR = "./data/notion"
+NOTION_SYNC_STATE_FILE = "sync_state.json"
 
 class NotionProcessor:
-    def __init__(self):
-        """Notion プロセッサーを初期化"""
+    def __init__(self, notion_token: Optional[str] = None, max_workers: int = NOTION_MAX_WORKERS,
+                 max_pages: int = NOTION_MAX_PAGES, max_databases: int = NOTION_MAX_DATABASES):
+        """Notion プロセッサーを初期化（トークン省略時はStreamlit Secretsから取得）"""
         self.client = None
-        self.setup_client()
+        self.max_workers = max_workers
+        self.max_pages = max_pages
+        self.max_databases = max_databases
+        # 同じプロセス内の全スレッド・全インスタンスでレート上限を共有
+        self.limiter = get_shared_limiter('notion', NOTION_REQUESTS_PER_SECOND, NOTION_BURST)
+        self.sync_state_path = os.path.join(NOTION_DATA_DIR, NOTION_SYNC_STATE_FILE)
+        self.workspace_key = None
+        self._pending_watermarks = {}
+        self._database_titles: Dict[str, str] = {}
+        self._database_titles_lock = threading.Lock()
+        self.setup_client(notion_token)
     
-    def setup_client(self):
+    def setup_client(self, notion_token: Optional[str] = None):
         """Notion クライアントを設定"""
         try:
-            notion_token = st.secrets.get("NOTION_TOKEN")
+            notion_token = notion_token or st.secrets.get("NOTION_TOKEN")
             if not notion_token:
                 print("❌ NOTION_TOKENが設定されていません")
                 return
             
             self.client = Client(auth=notion_token)
+            # 同期状態のキー（トークンそのものは保存しない）
+            self.workspace_key = hashlib.sha256(notion_token.encode('utf-8')).hexdigest()[:16]
             print("✅ Notionクライアント初期化完了")
             
         except Exception as e:
             print(f"❌ Notion初期化エラー: {e}")
             self.client = None
     
-    def get_all_pages(self) -> List[Dict]:
-        """最適化版ページ取得（150件上限・軽量処理）"""
+    def _request(self, func, *args, **kwargs):
+        """レート制限付きでAPIを呼び出す（429はRetry-Afterに従って再試行）"""
+        return call_with_rate_limit(self.limiter, func, *args, **kwargs)
+    
+    def _map_concurrently(self, func, items: List) -> List:
+        """items を並行処理し、入力順の結果リストを返す（API呼び出しはレート制限で調整）"""
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="notion-fetch") as executor:
+            return list(executor.map(func, items))
+    
+    def get_all_pages(self, max_pages: Optional[int] = None,
+                      max_databases: Optional[int] = None) -> List[Dict]:
+        """最適化版ページ取得（上限は引数・インスタンス設定・環境変数の順で決定、0で無制限）"""
         if not self.client:
             print("❌ Notionクライアントが初期化されていません")
             return []
@@ -38,26 +120,7 @@ class NotionProcessor:
         try:
             print("🔍 Notion最適化処理を開始...")
             
-            all_documents = []
-            
-            # === 最適化設定 ===
-            MAX_PAGES = 120           # ページ上限
-            MAX_DATABASES = 30        # データベース上限
-            CONTENT_LIMIT = 2000      # 1文書あたり文字制限
-            BLOCK_LIMIT = 15          # ブロック取得制限
-            
-            # Phase 1: 最適化ページ取得
-            print("📄 最適化ページ取得を開始...")
-            pages = self.get_pages_optimized(MAX_PAGES, CONTENT_LIMIT, BLOCK_LIMIT)
-            all_documents.extend(pages)
-            
-            # メモリクリーンアップ
-            gc.collect()
-            
-            # Phase 2: 最適化データベース取得
-            print("🗂️ 最適化データベース取得を開始...")
-            databases = self.get_databases_optimized(MAX_DATABASES, CONTENT_LIMIT)
-            all_documents.extend(databases)
+            all_documents = list(self.iter_documents(max_pages, max_databases))
             
             print(f"🎉 Notion最適化処理完了: {len(all_documents)} 件のドキュメント")
             
@@ -70,135 +133,560 @@ class NotionProcessor:
             print(f"❌ Notion最適化処理エラー: {e}")
             return []
     
-    def get_pages_optimized(self, max_pages: int, content_limit: int, block_limit: int) -> List[Dict]:
-        """最適化ページ取得"""
-        pages = []
+    def iter_documents(self, max_pages: Optional[int] = None,
+                       max_databases: Optional[int] = None) -> Iterator[Dict]:
+        """ページ→データベースの順に文書を1件ずつ生成（add_documents にそのまま渡せる）"""
+        if not self.client:
+            print("❌ Notionクライアントが初期化されていません")
+            return
         
-        try:
-            # 最新ページ優先で効率取得
-            results = self.client.search(
-                **{
-                    "page_size": min(max_pages, 100),
-                    "sort": {
-                        "direction": "descending",
-                        "timestamp": "last_edited_time"
-                    },
-                    "filter": {
-                        "property": "object",
-                        "value": "page"
-                    }
-                }
-            )
-            
-            processed_count = 0
-            
-            for page in results.get('results', []):
-                if processed_count >= max_pages:
-                    break
-                
+        # Phase 1: 最適化ページ取得
+        print("📄 最適化ページ取得を開始...")
+        yield from self.iter_pages(max_pages)
+        
+        # Phase 2: 最適化データベース取得
+        print("🗂️ 最適化データベース取得を開始...")
+        yield from self.iter_databases(max_databases)
+    
+    def iter_changed_documents(self) -> Iterator[Dict]:
+        """前回の同期以降に更新されたページ・データベースだけを文書化して生成（取得上限なし）
+
+        検索は更新日時の新しい順なので、前回の最新更新日時より古い結果に達した時点で
+        ページングを打ち切る。初回は全件を取得する。最後まで取得できた種別だけ
+        新しい最新更新日時を保留し、投入が成功した後に commit_sync() で保存する。
+        取得に失敗したページ・データベースは文書にせず（既存の行を残す）、保留する
+        最新更新日時をそのうち最も古いものの更新日時までに抑えて次回に再取得する。
+        データベースの行はページ検索で拾う（行の編集はその行ページの更新日時に反映される）ため、
+        変更されたデータベースの行は取得し直さない。
+        """
+        if not self.client:
+            print("❌ Notionクライアントが初期化されていません")
+            return
+        
+        watermarks = self.load_watermarks()
+        self._pending_watermarks = {}
+        
+        # 取得エラーは例外として受け取る（エラー文を本文として登録しない）
+        targets = [
+            ("page", "ページ",
+             lambda page: self._build_changed_page_document(page, strict=True)),
+            ("database", "データベース",
+             lambda db: self._build_database_document(db, NOTION_CONTENT_LIMIT, strict=True)),
+        ]
+        for object_type, label, build_document in targets:
+            since = watermarks.get(object_type)
+            synced_ids = set(watermarks.get(f"{object_type}_ids", [])) if since else set()
+            seen = {"newest": since}
+            failed_times = []
+            built_times = {}
+            print(f"🔄 {label}の差分取得を開始（前回: {since or 'なし - 全件取得'}）")
+            
+            def record_failure(item: Dict, error: Exception, label=label, failed_times=failed_times):
+                print(f"⚠️ {label}取得失敗（次回再取得）: {item.get('id', '')} - {error}")
+                failed_times.append(item.get('last_edited_time', '') or item.get('last_edited', ''))
+            
+            def build_or_record(item: Dict, build_document=build_document, record_failure=record_failure,
+                                built_times=built_times):
                 try:
-                    # 軽量コンテンツ抽出
-                    content = self.extract_page_content_lightweight(
-                        page['id'], 
-                        content_limit, 
-                        block_limit
-                    )
-                    
-                    if content and len(content.strip()) > 20:
-                        document = {
-                            'id': f"notion_page_{page['id']}",
-                            'title': self.get_page_title_safe(page),
-                            'content': content[:content_limit],
-                            'source': 'notion',
-                            'type': 'page',
-                            'url': page.get('url', ''),
-                            'last_edited': page.get('last_edited_time', ''),
-                            'parent_type': self.get_parent_type_safe(page)
-                        }
-                        pages.append(document)
-                        processed_count += 1
-                        
-                        # 進捗表示（10件ごと）
-                        if processed_count % 10 == 0:
-                            print(f"📄 ページ処理進捗: {processed_count}/{max_pages}件")
-                
+                    document = build_document(item)
                 except Exception as e:
-                    print(f"⚠️ ページ処理スキップ: {e}")
-                    continue
+                    record_failure(item, e)
+                    return None
+                built_times[item.get('id', '')] = item.get('last_edited_time', '')
+                return document
+            
+            try:
+                changed = self._iter_changed_since(self.iter_search(object_type), since, seen, synced_ids)
+                yield from self._iter_built(changed, build_or_record, 0, label)
+            except Exception as e:
+                # 途中で失敗した種別は最新更新日時を進めない（次回に同じ範囲を再取得）
+                print(f"❌ {label}差分取得エラー: {e}")
+                continue
+            
+            watermark = seen["newest"]
+            if failed_times:
+                # 更新日時が不明な失敗があれば進めない、それ以外は最も古い失敗の時刻まで
+                # （同時刻のものは再取得されるため、失敗したものは次回も対象になる）
+                watermark = since if not all(failed_times) else min(failed_times)
+            if watermark:
+                self._pending_watermarks[object_type] = watermark
+                self._pending_watermarks[f"{object_type}_ids"] = self._boundary_ids(
+                    watermark, built_times, synced_ids if watermark == since else set())
+    
+    def _build_changed_page_document(self, page: Dict, strict: bool = False) -> Optional[Dict]:
+        """差分同期のページ検索結果を文書化（行の書き出しが有効ならデータベースの行は行文書にする）
+        
+        検索はデータベースの行もページとして返す。変更のないデータベースの行の更新は
+        ページ検索でしか拾えないため、行文書と同じIDで書き出して重複を避ける。
+        """
+        if NOTION_EXPORT_DATABASE_ROWS and self.is_database_row(page):
+            db_id = page['parent']['database_id']
+            return self._build_database_row_document(page, db_id, self.get_database_title(db_id, strict),
+                                                     NOTION_CONTENT_LIMIT)
+        return self._build_page_document(page, NOTION_CONTENT_LIMIT, NOTION_BLOCK_LIMIT, strict=strict)
+    
+    def is_database_row(self, page: Dict) -> bool:
+        """検索結果のページがデータベースの行か"""
+        return (page.get('parent') or {}).get('type') == 'database_id'
+    
+    def get_database_title(self, db_id: str, strict: bool = False) -> str:
+        """データベースのタイトル（データベースごとに1回だけ取得してキャッシュ）"""
+        with self._database_titles_lock:
+            if db_id in self._database_titles:
+                return self._database_titles[db_id]
+        try:
+            title = self.get_database_title_safe(self._request(self.client.databases.retrieve, db_id))
+        except Exception as e:
+            if strict:
+                raise
+            print(f"⚠️ データベースタイトル取得エラー: {e}")
+            return ""
+        with self._database_titles_lock:
+            self._database_titles[db_id] = title
+        return title
+    
+    def _iter_changed_since(self, results: Iterator[Dict], since: Optional[str],
+                            seen: Dict, synced_ids: Optional[set] = None) -> Iterator[Dict]:
+        """更新日時の新しい順の検索結果を since より古いものに達するまで生成
+
+        last_edited_time は分単位に丸められるため、since と同時刻のものは再取得する。
+        ただし synced_ids（前回 since の時刻で取得済みと確定したもの）は除く。
+        """
+        for result in results:
+            edited = result.get('last_edited_time', '')
+            if since and edited and edited < since:
+                return
+            if edited and (not seen["newest"] or edited > seen["newest"]):
+                seen["newest"] = edited
+            if synced_ids and edited == since and result.get('id') in synced_ids:
+                continue
+            yield result
+    
+    def _boundary_ids(self, watermark: str, built_times: Dict[str, str], carried: set) -> List[str]:
+        """最新更新日時ちょうどに更新され、取得済みと確定したIDを返す（次回の再取得を省く）
+
+        その分がまだ終わっていなければ同じ分内に再度更新される可能性があるため返さない。
+        時計のずれを考慮して1分の余裕を持たせる。
+        """
+        settled_before = (datetime.now(timezone.utc) - timedelta(minutes=1)).strftime('%Y-%m-%dT%H:%M')
+        if watermark[:16] >= settled_before:
+            return []
+        ids = set(carried)
+        ids.update(item_id for item_id, edited in built_times.items() if edited == watermark)
+        return sorted(ids)
+    
+    def load_watermarks(self) -> Dict[str, str]:
+        """このワークスペースの種別ごとの最新更新日時を読み込む"""
+        try:
+            with open(self.sync_state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            return state.get(self.workspace_key, {})
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"⚠️ 同期状態の読み込みエラー: {e}")
+            return {}
+    
+    def commit_sync(self) -> bool:
+        """iter_changed_documents() で保留した最新更新日時を保存（投入成功後に呼ぶ）"""
+        if not self.workspace_key or not self._pending_watermarks:
+            return False
+        
+        try:
+            try:
+                with open(self.sync_state_path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+            except FileNotFoundError:
+                state = {}
+            
+            state.setdefault(self.workspace_key, {}).update(self._pending_watermarks)
+            
+            os.makedirs(os.path.dirname(self.sync_state_path), exist_ok=True)
+            temp_path = self.sync_state_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.sync_state_path)
+            
+            print(f"💾 Notion同期状態を保存: {self._pending_watermarks}")
+            self._pending_watermarks = {}
+            return True
+        except Exception as e:
+            print(f"❌ 同期状態の保存エラー: {e}")
+            return False
+    
+    def reset_sync(self):
+        """このワークスペースの同期状態を削除（次回は全件取得）"""
+        self._pending_watermarks = {}
+        try:
+            with open(self.sync_state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.pop(self.workspace_key, None) is not None:
+                with open(self.sync_state_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f, ensure_ascii=False, indent=2)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"⚠️ 同期状態の削除エラー: {e}")
+    
+    def iter_search(self, object_type: str, sort_by_last_edited: bool = True) -> Iterator[Dict]:
+        """検索結果を next_cursor でたどりながら1件ずつ生成（必要な分だけAPIを呼ぶ）"""
+        params = {
+            "filter": {
+                "property": "object",
+                "value": object_type
+            },
+            "page_size": NOTION_SEARCH_PAGE_SIZE
+        }
+        if sort_by_last_edited:
+            params["sort"] = {
+                "direction": "descending",
+                "timestamp": "last_edited_time"
+            }
+        
+        cursor = None
+        while True:
+            if cursor:
+                params["start_cursor"] = cursor
+            response = self._request(self.client.search, **params)
             
-            print(f"✅ ページ取得完了: {len(pages)}件")
-            return pages
+            yield from response.get('results', [])
             
+            cursor = response.get('next_cursor')
+            if not response.get('has_more') or not cursor:
+                return
+    
+    def _iter_built(self, results: Iterator[Dict], build, limit: int, label: str) -> Iterator[Dict]:
+        """検索結果を検索1ページ分ずつ並行して文書化し、上限に達するまで入力順に生成"""
+        produced = 0
+        while not limit or produced < limit:
+            # 上限が近い場合は残り件数分だけ取り出す（不要なブロック取得を避ける）
+            batch_size = NOTION_SEARCH_PAGE_SIZE if not limit else min(NOTION_SEARCH_PAGE_SIZE, limit - produced)
+            batch = list(itertools.islice(results, batch_size))
+            if not batch:
+                break
+            
+            for document in self._map_concurrently(build, batch):
+                if document:
+                    produced += 1
+                    yield document
+                    
+                    # 進捗表示（10件ごと）
+                    if produced % 10 == 0:
+                        print(f"📄 {label}処理進捗: {produced}件" + (f"/{limit}件" if limit else ""))
+        
+        print(f"✅ {label}取得完了: {produced}件")
+    
+    def iter_pages(self, max_pages: Optional[int] = None, content_limit: int = NOTION_CONTENT_LIMIT,
+                   block_limit: int = NOTION_BLOCK_LIMIT,
+                   skip_database_rows: bool = NOTION_EXPORT_DATABASE_ROWS) -> Iterator[Dict]:
+        """ページを更新日時の新しい順に文書化して生成（max_pages=0で全件）
+        
+        skip_database_rows なら検索結果に含まれるデータベースの行を除く
+        （iter_databases が行文書として書き出すため）。
+        """
+        max_pages = self.max_pages if max_pages is None else max_pages
+        
+        def build_document(page: Dict) -> Optional[Dict]:
+            return self._build_page_document(page, content_limit, block_limit)
+        
+        pages = self.iter_search("page")
+        if skip_database_rows:
+            pages = (page for page in pages if not self.is_database_row(page))
+        
+        try:
+            yield from self._iter_built(pages, build_document, max_pages, "ページ")
         except Exception as e:
             print(f"❌ ページ取得エラー: {e}")
-            return []
     
-    def get_databases_optimized(self, max_databases: int, content_limit: int) -> List[Dict]:
-        """最適化データベース取得"""
-        databases = []
+    def iter_databases(self, max_databases: Optional[int] = None,
+                       content_limit: int = NOTION_CONTENT_LIMIT,
+                       include_rows: bool = NOTION_EXPORT_DATABASE_ROWS,
+                       max_rows: int = NOTION_MAX_DATABASE_ROWS) -> Iterator[Dict]:
+        """データベースを文書化して生成（max_databases=0で全件、include_rows なら各行も続けて生成）"""
+        max_databases = self.max_databases if max_databases is None else max_databases
+        
+        def build_document(db: Dict) -> Optional[Dict]:
+            return self._build_database_document(db, content_limit)
         
         try:
-            # データベース検索
-            results = self.client.search(
-                **{
-                    "filter": {
-                        "property": "object",
-                        "value": "database"
-                    },
-                    "page_size": min(max_databases, 50)
-                }
-            )
+            documents = self._iter_built(self.iter_search("database", sort_by_last_edited=False),
+                                         build_document, max_databases, "データベース")
+            if include_rows:
+                documents = self._with_database_rows(documents, content_limit, max_rows)
+            yield from documents
+        except Exception as e:
+            print(f"❌ データベース取得エラー: {e}")
+    
+    def _with_database_rows(self, documents: Iterator[Dict], content_limit: int,
+                            max_rows: int) -> Iterator[Dict]:
+        """データベース文書の直後にその行の文書を生成"""
+        for document in documents:
+            yield document
+            database_id = document.get('metadata', {}).get('database_id')
+            if not database_id:
+                continue
+            with self._database_titles_lock:
+                self._database_titles[database_id] = document.get('title', '')
+            yield from self.iter_database_rows(database_id, document.get('title', ''),
+                                               content_limit, max_rows)
+    
+    def iter_database_query(self, db_id: str) -> Iterator[Dict]:
+        """databases.query を next_cursor でたどりながら行を1件ずつ生成（必要な分だけAPIを呼ぶ）"""
+        params = {"database_id": db_id, "page_size": NOTION_QUERY_PAGE_SIZE}
+        
+        while True:
+            response = self._request(self.client.databases.query, **params)
             
-            processed_count = 0
+            yield from response.get('results', [])
             
-            for db in results.get('results', []):
-                if processed_count >= max_databases:
+            cursor = response.get('next_cursor')
+            if not response.get('has_more') or not cursor:
+                return
+            params["start_cursor"] = cursor
+    
+    def iter_database_rows(self, db_id: str, database_title: str = "",
+                           content_limit: int = NOTION_CONTENT_LIMIT,
+                           max_rows: int = NOTION_MAX_DATABASE_ROWS) -> Iterator[Dict]:
+        """データベースの各行を個別の文書として生成（max_rows=0で全件）
+        
+        行は取得1ページ（NOTION_QUERY_PAGE_SIZE件）ずつ文書化するため、大きなデータベースでも
+        全行をメモリに保持しない。プロパティのスカラー値は 'metadata' に入れて検索フィルタに使える。
+        """
+        produced = 0
+        try:
+            for row in self.iter_database_query(db_id):
+                if max_rows and produced >= max_rows:
                     break
                 
-                try:
-                    # 軽量データベース内容抽出
-                    content = self.extract_database_content_lightweight(
-                        db['id'], 
-                        content_limit
-                    )
+                document = self._build_database_row_document(row, db_id, database_title, content_limit)
+                if document:
+                    produced += 1
+                    yield document
                     
-                    if content and len(content.strip()) > 10:
-                        document = {
-                            'id': f"notion_db_{db['id']}",
-                            'title': self.get_database_title_safe(db),
-                            'content': content[:content_limit],
-                            'source': 'notion',
-                            'type': 'database',
-                            'url': db.get('url', ''),
-                            'last_edited': db.get('last_edited_time', ''),
-                            'properties_count': len(db.get('properties', {}))
-                        }
-                        databases.append(document)
-                        processed_count += 1
-                
-                except Exception as e:
-                    print(f"⚠️ データベース処理スキップ: {e}")
+                    # 進捗表示（100行ごと）
+                    if produced % 100 == 0:
+                        print(f"🗂️ {database_title or db_id}: {produced}行処理")
+        except Exception as e:
+            print(f"⚠️ データベース行取得エラー（{database_title or db_id}）: {e}")
+        
+        if produced:
+            print(f"✅ {database_title or db_id}: {produced}行取得")
+    
+    def _build_database_row_document(self, row: Dict, db_id: str, database_title: str,
+                                     content_limit: int) -> Optional[Dict]:
+        """データベースの行（ページ）をプロパティ一覧の文書に変換（内容がなければNone）"""
+        try:
+            title = ""
+            lines = []
+            metadata = {'database_id': db_id, 'database_title': database_title}
+            
+            for name, prop in row.get('properties', {}).items():
+                if prop.get('type') == 'title':
+                    title = self.render_property_value(prop)
                     continue
+                
+                value = self.render_property_value(prop)
+                if value:
+                    lines.append(f"{name}: {value}")
+                
+                filter_value = self.property_filter_value(prop)
+                if filter_value is not None:
+                    metadata[f"{NOTION_PROPERTY_METADATA_PREFIX}{name}"] = filter_value
+            
+            if not title and not lines:
+                return None
+            
+            header = [f"データベース: {database_title}"] if database_title else []
+            header.append(f"タイトル: {title or '無題'}")
+            content = '\n'.join(header + lines)
+            
+            return {
+                'id': f"notion_row_{row['id']}",
+                'title': title or f"行_{row['id'][:8]}",
+                'content': content[:content_limit],
+                'source': 'notion',
+                'type': 'database_row',
+                'url': row.get('url', ''),
+                'last_edited': row.get('last_edited_time', ''),
+                'parent_type': 'database_id',
+                'metadata': metadata
+            }
+        
+        except Exception as e:
+            print(f"⚠️ データベース行処理スキップ: {e}")
+        return None
+    
+    def render_property_value(self, prop: Dict) -> str:
+        """プロパティ値を簡潔なテキストに変換（全プロパティ型に対応、値がなければ空文字）"""
+        try:
+            prop_type = prop.get('type', '')
+            value = prop.get(prop_type)
+            if value is None:
+                return ""
+            
+            if prop_type in ('title', 'rich_text'):
+                return self.rich_text_to_plain(value)
+            if prop_type == 'number':
+                return f"{value:g}" if isinstance(value, float) else str(value)
+            if prop_type in ('select', 'status'):
+                return value.get('name', '')
+            if prop_type == 'multi_select':
+                return ", ".join(option.get('name', '') for option in value if option.get('name'))
+            if prop_type == 'date':
+                return self._render_date(value)
+            if prop_type == 'checkbox':
+                return "はい" if value else "いいえ"
+            if prop_type in ('url', 'email', 'phone_number', 'created_time', 'last_edited_time'):
+                return str(value)
+            if prop_type == 'people':
+                return ", ".join(self._render_user(user) for user in value if self._render_user(user))
+            if prop_type in ('created_by', 'last_edited_by'):
+                return self._render_user(value)
+            if prop_type == 'files':
+                return ", ".join(item.get('name', '') for item in value if item.get('name'))
+            if prop_type == 'relation':
+                return f"{len(value)}件の関連" if value else ""
+            if prop_type == 'formula':
+                return self.render_property_value(value)
+            if prop_type == 'rollup':
+                if value.get('type') == 'array':
+                    parts = [self.render_property_value(item) for item in value.get('array', [])]
+                    return ", ".join(part for part in parts if part)
+                return self.render_property_value(value)
+            if prop_type == 'unique_id':
+                prefix = value.get('prefix')
+                number = value.get('number')
+                if number is None:
+                    return ""
+                return f"{prefix}-{number}" if prefix else str(number)
+            if prop_type == 'verification':
+                return value.get('state', '')
+            if prop_type in ('string', 'boolean'):
+                # formula・rollup の結果値
+                return ("はい" if value else "いいえ") if prop_type == 'boolean' else str(value)
             
-            print(f"✅ データベース取得完了: {len(databases)}件")
-            return databases
+            return ""
             
-        except Exception as e:
-            print(f"❌ データベース取得エラー: {e}")
-            return []
+        except Exception:
+            return ""
     
-    def extract_page_content_lightweight(self, page_id: str, content_limit: int, block_limit: int) -> str:
-        """軽量ページコンテンツ抽出"""
+    def property_filter_value(self, prop: Dict):
+        """フィルタ用メタデータにするスカラー値（str/int/float/bool、対象外はNone）
+        
+        長文になり得る title・rich_text と、ID一覧の relation は本文側にのみ含める。
+        """
         try:
-            # ページ詳細取得
-            page_detail = self.client.pages.retrieve(page_id)
+            prop_type = prop.get('type', '')
+            value = prop.get(prop_type)
+            if value is None or prop_type in ('title', 'rich_text', 'relation'):
+                return None
+            
+            if prop_type in ('number', 'checkbox'):
+                return value
+            if prop_type == 'date':
+                return value.get('start') or None
+            if prop_type == 'formula':
+                return self.property_filter_value(value)
+            if prop_type == 'rollup' and value.get('type') in ('number', 'date'):
+                return self.property_filter_value(value)
+            if prop_type == 'boolean':
+                return bool(value)
+            
+            text = self.render_property_value(prop)
+            return text[:NOTION_PROPERTY_METADATA_MAX_CHARS] if text else None
             
-            # 制限されたブロック取得
-            blocks_response = self.client.blocks.children.list(
-                block_id=page_id,
-                page_size=block_limit  # ブロック数制限
+        except Exception:
+            return None
+    
+    def _render_date(self, date: Dict) -> str:
+        """日付プロパティ（期間の場合は開始 → 終了）"""
+        start = date.get('start') or ''
+        end = date.get('end')
+        return f"{start} → {end}" if start and end else start
+    
+    def _render_user(self, user: Dict) -> str:
+        """ユーザー名（名前が取得できない場合はメールアドレス）"""
+        return user.get('name') or (user.get('person') or {}).get('email', '')
+    
+    def get_pages_optimized(self, max_pages: int, content_limit: int, block_limit: int) -> List[Dict]:
+        """最適化ページ取得"""
+        return list(self.iter_pages(max_pages, content_limit, block_limit))
+    
+    def get_databases_optimized(self, max_databases: int, content_limit: int) -> List[Dict]:
+        """最適化データベース取得"""
+        return list(self.iter_databases(max_databases, content_limit))
+    
+    def _build_page_document(self, page: Dict, content_limit: int, block_limit: int,
+                             strict: bool = False) -> Optional[Dict]:
+        """検索結果のページを文書に変換（本文が短すぎる・取得失敗ならNone、strict=True なら失敗は例外）"""
+        try:
+            # 軽量コンテンツ抽出（検索結果のページ情報を使い、pages.retrieveは省略）
+            content = self.extract_page_content_lightweight(
+                page['id'], 
+                content_limit, 
+                block_limit,
+                page=page,
+                strict=strict
+            )
+            
+            if content and len(content.strip()) > 20:
+                return {
+                    'id': f"notion_page_{page['id']}",
+                    'title': self.get_page_title_safe(page),
+                    'content': content[:content_limit],
+                    'source': 'notion',
+                    'type': 'page',
+                    'url': page.get('url', ''),
+                    'last_edited': page.get('last_edited_time', ''),
+                    'parent_type': self.get_parent_type_safe(page)
+                }
+        
+        except Exception as e:
+            if strict:
+                raise
+            print(f"⚠️ ページ処理スキップ: {e}")
+        return None
+    
+    def _build_database_document(self, db: Dict, content_limit: int,
+                                 strict: bool = False) -> Optional[Dict]:
+        """検索結果のデータベースを文書に変換（内容が短すぎる・取得失敗ならNone、strict=True なら失敗は例外）"""
+        try:
+            # 軽量データベース内容抽出
+            content = self.extract_database_content_lightweight(
+                db['id'], 
+                content_limit,
+                database=db,
+                strict=strict
             )
-            blocks = blocks_response.get('results', [])
+            
+            if content and len(content.strip()) > 10:
+                return {
+                    'id': f"notion_db_{db['id']}",
+                    'title': self.get_database_title_safe(db),
+                    'content': content[:content_limit],
+                    'source': 'notion',
+                    'type': 'database',
+                    'url': db.get('url', ''),
+                    'last_edited': db.get('last_edited_time', ''),
+                    'properties_count': len(db.get('properties', {})),
+                    'metadata': {'database_id': db['id']}
+                }
+        
+        except Exception as e:
+            if strict:
+                raise
+            print(f"⚠️ データベース処理スキップ: {e}")
+        return None
+    
+    def extract_page_content_lightweight(self, page_id: str, content_limit: int, block_limit: int,
+                                         page: Optional[Dict] = None, strict: bool = False) -> str:
+        """ページコンテンツ抽出（子ブロックを再帰的にたどる。page を渡した場合はページ詳細の取得を省略）
+        
+        strict=True なら取得エラーをエラー文の本文にせず例外として送出する。
+        """
+        try:
+            # ページ詳細取得
+            page_detail = page or self._request(self.client.pages.retrieve, page_id)
             
             content_parts = []
             total_chars = 0
@@ -209,35 +697,118 @@ class NotionProcessor:
                 content_parts.append(f"タイトル: {title}")
                 total_chars += len(title) + 10
             
-            # ブロック内容抽出（軽量版）
-            for block in blocks:
+            # ブロックツリーを文書順に展開（入れ子は字下げ）
+            blocks = self.walk_block_tree(page_id, content_limit - total_chars, block_limit, strict=strict)
+            for depth, block in blocks:
                 if total_chars >= content_limit:
                     break
                 
                 block_text = self.extract_block_text_simple(block)
                 if block_text and len(block_text.strip()) > 0:
-                    content_parts.append(block_text)
-                    total_chars += len(block_text)
+                    line = "  " * depth + block_text
+                    content_parts.append(line)
+                    total_chars += len(line) + 1
             
-            result = '\n\n'.join(content_parts)
+            result = '\n'.join(content_parts)
             return result[:content_limit]
             
         except Exception as e:
+            if strict:
+                raise
             print(f"❌ ページコンテンツ抽出エラー: {e}")
             return f"ページ内容取得エラー: {str(e)[:200]}"
     
-    def extract_database_content_lightweight(self, db_id: str, content_limit: int) -> str:
-        """軽量データベースコンテンツ抽出"""
+    def walk_block_tree(self, root_id: str, content_limit: int, block_limit: int = NOTION_BLOCK_LIMIT,
+                        max_depth: int = NOTION_MAX_BLOCK_DEPTH,
+                        max_workers: int = NOTION_BLOCK_WORKERS, strict: bool = False) -> List[Tuple[int, Dict]]:
+        """ブロックツリーを取得し (深さ, ブロック) を文書順のリストで返す
+        
+        has_children のブロックは取得でき次第、子の取得を投入するため、兄弟の枝は
+        max_workers 件まで並行に取得される（API呼び出しは共有のレート制限に従う）。
+        所要時間はおおよそ最も深い枝の往復回数で決まる。取得済みの本文が content_limit
+        に達するか、ブロック数が block_limit に達した時点で新しい取得を止める。
+        strict=True なら子ブロックの取得エラーで残りの取得を止めて例外を送出する
+        （一部の枝が欠けた本文を返さない）。
+        """
+        children_of: Dict[str, List[Dict]] = {}
+        stop = threading.Event()
+        collected_chars = 0
+        block_count = 0
+        
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="notion-blocks") as executor:
+            pending = {executor.submit(self._fetch_block_children, root_id, stop): (root_id, 0)}
+            while pending:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in done:
+                    parent_id, depth = pending.pop(future)
+                    if future.cancelled():
+                        continue
+                    try:
+                        children = future.result()
+                    except Exception as e:
+                        if strict:
+                            stop.set()
+                            for other in pending:
+                                other.cancel()
+                            raise
+                        print(f"⚠️ 子ブロック取得スキップ: {e}")
+                        continue
+                    
+                    children_of[parent_id] = children
+                    block_count += len(children)
+                    collected_chars += sum(len(self.extract_block_text_simple(child)) for child in children)
+                    if collected_chars >= content_limit or (block_limit and block_count >= block_limit):
+                        stop.set()
+                    if stop.is_set():
+                        continue
+                    
+                    for child in children:
+                        if (child.get('has_children') and depth + 1 < max_depth
+                                and child.get('type') not in SEPARATE_DOCUMENT_BLOCK_TYPES):
+                            child_future = executor.submit(self._fetch_block_children, child['id'], stop)
+                            pending[child_future] = (child['id'], depth + 1)
+                
+                # 予算に達したら未着手の取得を取り消す（実行中のものは次のカーソルで止まる）
+                if stop.is_set():
+                    for future in pending:
+                        future.cancel()
+        
+        ordered = []
+        
+        def visit(parent_id: str, depth: int):
+            for block in children_of.get(parent_id, []):
+                ordered.append((depth, block))
+                if block.get('id') in children_of:
+                    visit(block['id'], depth + 1)
+        
+        visit(root_id, 0)
+        return ordered
+    
+    def _fetch_block_children(self, block_id: str, stop: threading.Event) -> List[Dict]:
+        """子ブロックを next_cursor でたどって全件取得（stop が立ったら打ち切り）"""
+        children = []
+        params = {"block_id": block_id, "page_size": NOTION_BLOCK_PAGE_SIZE}
+        while not stop.is_set():
+            response = self._request(self.client.blocks.children.list, **params)
+            children.extend(response.get('results', []))
+            
+            cursor = response.get('next_cursor')
+            if not response.get('has_more') or not cursor:
+                break
+            params["start_cursor"] = cursor
+        return children
+    
+    def extract_database_content_lightweight(self, db_id: str, content_limit: int,
+                                             database: Optional[Dict] = None, strict: bool = False) -> str:
+        """軽量データベースコンテンツ抽出（タイトルとプロパティ定義のみ、strict=True なら取得エラーを例外として送出）
+
+        行は個別の文書として書き出すため、行の一覧は取得しない。
+        database（検索結果のデータベース）を渡した場合はデータベース詳細の取得を省略する。
+        """
         try:
-            # データベース詳細取得
-            database = self.client.databases.retrieve(db_id)
-            
-            # データベース内のページ取得（制限）
-            pages_response = self.client.databases.query(
-                database_id=db_id,
-                page_size=10  # ページ数制限
-            )
-            pages = pages_response.get('results', [])
+            # データベース詳細取得（検索結果にプロパティ定義が含まれていれば再取得しない）
+            if not database or 'properties' not in database:
+                database = self._request(self.client.databases.retrieve, db_id)
             
             content_parts = []
             
@@ -246,55 +817,89 @@ class NotionProcessor:
             if db_title:
                 content_parts.append(f"データベース: {db_title}")
             
-            # プロパティ情報（簡略版）
-            properties = database.get('properties', {})
-            if properties:
-                prop_names = list(properties.keys())[:5]  # 最初の5個のみ
-                content_parts.append(f"プロパティ: {', '.join(prop_names)}")
-            
-            # ページタイトル（簡略版）
-            for page in pages[:5]:  # 最大5ページ
-                try:
-                    page_title = self.get_page_title_safe(page)
-                    if page_title and len(page_title.strip()) > 0:
-                        content_parts.append(f"- {page_title}")
-                except:
-                    continue
+            description = self.rich_text_to_plain(database.get('description', []) or [])
+            if description:
+                content_parts.append(f"説明: {description}")
+            
+            # プロパティ定義（名前・型・選択肢）
+            for name, prop in database.get('properties', {}).items():
+                prop_type = prop.get('type', '')
+                option_names = []
+                if prop_type in ('select', 'multi_select', 'status'):
+                    options = (prop.get(prop_type) or {}).get('options', [])
+                    option_names = [option.get('name', '') for option in options if option.get('name')]
+                line = f"- {name}（{prop_type}）"
+                if option_names:
+                    line += f": {', '.join(option_names)}"
+                content_parts.append(line)
             
             result = '\n'.join(content_parts)
             return result[:content_limit]
             
         except Exception as e:
+            if strict:
+                raise
             print(f"❌ データベースコンテンツ抽出エラー: {e}")
             return f"データベース内容取得エラー: {str(e)[:200]}"
     
     def extract_block_text_simple(self, block: Dict) -> str:
-        """簡易ブロックテキスト抽出"""
+        """ブロックテキスト抽出（子ブロックは含まない）"""
         try:
             block_type = block.get('type', '')
-            block_data = block.get(block_type, {})
-            
-            # 主要なテキスト系ブロックのみ処理
-            text_types = ['paragraph', 'heading_1', 'heading_2', 'heading_3', 'bulleted_list_item']
-            
-            if block_type in text_types:
-                rich_text = block_data.get('rich_text', [])
-                if rich_text:
-                    text_parts = []
-                    for text_obj in rich_text:
-                        if text_obj.get('type') == 'text':
-                            content = text_obj.get('text', {}).get('content', '')
-                            if content:
-                                text_parts.append(content)
-                    
-                    if text_parts:
-                        return ''.join(text_parts).strip()
+            block_data = block.get(block_type, {}) or {}
+            
+            if block_type in RICH_TEXT_BLOCK_PREFIXES:
+                text = self.rich_text_to_plain(block_data.get('rich_text', []))
+                if block_type == 'callout' and text:
+                    icon = (block_data.get('icon') or {}).get('emoji', '')
+                    return f"{icon} {text}".strip()
+                return f"{RICH_TEXT_BLOCK_PREFIXES[block_type]}{text}" if text else ""
+            
+            if block_type == 'to_do':
+                text = self.rich_text_to_plain(block_data.get('rich_text', []))
+                mark = "[x]" if block_data.get('checked') else "[ ]"
+                return f"{mark} {text}" if text else ""
+            
+            if block_type == 'table_row':
+                cells = [self.rich_text_to_plain(cell) for cell in block_data.get('cells', [])]
+                return " | ".join(cells) if any(cells) else ""
+            
+            if block_type == 'equation':
+                return block_data.get('expression', '').strip()
+            
+            if block_type in ('child_page', 'child_database'):
+                title = block_data.get('title', '').strip()
+                return f"[{title}]" if title else ""
+            
+            if block_type in MEDIA_BLOCK_TYPES or block_type in LINK_BLOCK_TYPES:
+                caption = self.rich_text_to_plain(block_data.get('caption', []))
+                url = block_data.get('url', '')
+                if not url and block_type in MEDIA_BLOCK_TYPES:
+                    url = (block_data.get(block_data.get('type', ''), {}) or {}).get('url', '')
+                # ファイルの署名付きURLは期限切れになるためキャプションだけを残す
+                if block_type in MEDIA_BLOCK_TYPES and block_data.get('type') == 'file':
+                    url = ''
+                return " ".join(part for part in (caption, url) if part)
             
             return ""
             
         except Exception:
             return ""
     
+    def rich_text_to_plain(self, rich_text: List[Dict]) -> str:
+        """rich_text 配列を平文に変換（メンション・数式も plain_text で含める）"""
+        try:
+            parts = []
+            for text_obj in rich_text or []:
+                content = text_obj.get('plain_text')
+                if content is None and text_obj.get('type') == 'text':
+                    content = text_obj.get('text', {}).get('content', '')
+                if content:
+                    parts.append(content)
+            return ''.join(parts).strip()
+        except Exception:
+            return ""
+    
     def get_page_title_safe(self, page: Dict) -> str:
         """安全なページタイトル取得"""
         try:
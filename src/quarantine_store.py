@@ -0,0 +1,118 @@
+"""
+隔離ストアモジュール - エンコードに失敗した文書をエラー内容とともに保存し、後で再投入する（SQLite永続化）
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+_SQL_CHUNK_SIZE = 500
+
+
+class QuarantineStore:
+    """失敗した文書の隔離・再試行キュー（同じ文書が再度失敗すると試行回数を加算）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS quarantine (
+                doc_id TEXT PRIMARY KEY,
+                document TEXT NOT NULL,
+                error TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 1,
+                first_failed_at INTEGER NOT NULL,
+                last_failed_at INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def add(self, rows: Iterable[Tuple[str, Dict, str]]):
+        """(doc_id, 文書, エラー内容) を隔離（既存なら文書とエラーを更新し試行回数を加算）"""
+        now = int(time.time())
+        rows = [(doc_id, json.dumps(document, ensure_ascii=False, default=str), error, now, now)
+                for doc_id, document, error in rows]
+        if not rows:
+            return
+
+        with self._lock:
+            self._conn.executemany(
+                """
+                INSERT INTO quarantine (doc_id, document, error, attempts, first_failed_at, last_failed_at)
+                VALUES (?, ?, ?, 1, ?, ?)
+                ON CONFLICT (doc_id) DO UPDATE SET
+                    document = excluded.document,
+                    error = excluded.error,
+                    attempts = attempts + 1,
+                    last_failed_at = excluded.last_failed_at
+                """,
+                rows
+            )
+            self._conn.commit()
+
+    def remove(self, doc_ids: List[str]):
+        """投入に成功した文書を隔離から外す"""
+        if not doc_ids:
+            return
+
+        with self._lock:
+            for i in range(0, len(doc_ids), _SQL_CHUNK_SIZE):
+                chunk = doc_ids[i:i + _SQL_CHUNK_SIZE]
+                placeholders = ','.join('?' * len(chunk))
+                self._conn.execute(f"DELETE FROM quarantine WHERE doc_id IN ({placeholders})", chunk)
+            self._conn.commit()
+
+    def get_documents(self, limit: int = 100, max_attempts: int = 0) -> List[Dict]:
+        """再試行する文書を古い順に取得（max_attempts > 0 なら試行回数がそれ未満のものだけ）"""
+        with self._lock:
+            if max_attempts > 0:
+                rows = self._conn.execute(
+                    "SELECT document FROM quarantine WHERE attempts < ? ORDER BY last_failed_at LIMIT ?",
+                    (max_attempts, limit)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT document FROM quarantine ORDER BY last_failed_at LIMIT ?", (limit,)
+                ).fetchall()
+        return [json.loads(document) for (document,) in rows]
+
+    def get_errors(self, limit: int = 100) -> List[Dict]:
+        """隔離中の文書IDとエラー内容の一覧"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id, error, attempts, last_failed_at FROM quarantine "
+                "ORDER BY last_failed_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [
+            {"id": doc_id, "error": error, "attempts": attempts, "last_failed_at": last_failed_at}
+            for doc_id, error, attempts, last_failed_at in rows
+        ]
+
+    def count(self) -> int:
+        """隔離中の文書数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM quarantine").fetchone()[0]
+
+    def clear(self):
+        """隔離中の文書を全削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM quarantine")
+            self._conn.commit()
+
+    def close(self):
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
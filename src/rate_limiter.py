@@ -0,0 +1,115 @@
+"""
+レート制限モジュール - トークンバケットでAPI呼び出し間隔を制御し、429応答のRetry-Afterに従って再試行
+（複数スレッド・複数インスタンスから同じバケットを共有する）
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# 429以外で再試行するHTTPステータス（一時的なサーバーエラー）
+RETRYABLE_STATUSES = (500, 502, 503, 504)
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 30.0
+
+
+class TokenBucket:
+    """毎秒 rate 個補充され、最大 capacity 個まで貯まるトークンバケット"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        """トークンが貯まるまで待ってから消費する"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return
+                    wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """全呼び出し元を指定秒数止め、再開時はバケットを空から始める（429応答時）"""
+        with self._lock:
+            resume_at = time.monotonic() + seconds
+            if resume_at > self._paused_until:
+                self._paused_until = resume_at
+                self._tokens = 0.0
+                self._updated = resume_at
+
+
+_registry_lock = threading.Lock()
+_shared_limiters: Dict[str, TokenBucket] = {}
+
+
+def get_shared_limiter(key: str, rate: float, capacity: Optional[float] = None) -> TokenBucket:
+    """キーごとにプロセス内で1つのバケットを共有"""
+    with _registry_lock:
+        limiter = _shared_limiters.get(key)
+        if limiter is None:
+            limiter = TokenBucket(rate, capacity)
+            _shared_limiters[key] = limiter
+        return limiter
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """例外に付随するHTTPレスポンスのRetry-Afterヘッダー（秒）を取得"""
+    headers = getattr(error, 'headers', None)
+    if headers is None:
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        value = headers.get('retry-after') or headers.get('Retry-After')
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def get_status(error: Exception) -> Optional[int]:
+    """例外に付随するHTTPステータスコードを取得"""
+    status = getattr(error, 'status', None)
+    if status is None:
+        response = getattr(error, 'response', None)
+        status = getattr(response, 'status_code', None)
+    return status
+
+
+def call_with_rate_limit(limiter: TokenBucket, func: Callable, *args,
+                         max_retries: int = DEFAULT_MAX_RETRIES, **kwargs):
+    """バケットからトークンを取ってから呼び出し、429・一時的エラーは待って再試行"""
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            status = get_status(e)
+            if attempt >= max_retries or (status != 429 and status not in RETRYABLE_STATUSES):
+                raise
+
+            backoff = min(MAX_BACKOFF_SECONDS, DEFAULT_BACKOFF_SECONDS * (2 ** attempt))
+            if status == 429:
+                # 429は全スレッド共通で止める（Retry-Afterがなければ指数バックオフ）
+                wait = get_retry_after(e) or backoff
+                print(f"⏳ レート制限（429）- {wait:.1f}秒待機して再試行")
+                limiter.pause(wait)
+            else:
+                print(f"⏳ 一時的なエラー（{status}）- {backoff:.1f}秒待機して再試行")
+                time.sleep(backoff)
+            attempt += 1
@@ -8,28 +8,85 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from vector_db_processor import VectorDBProcessor
 
-def main():
-    print("🔍 RAGシステム検索ツール")
-    print("=" * 50)
+def print_results(results):
+    """検索結果を表示"""
+    print(f"\n✅ {len(results)}件の結果が見つかりました:")
+    print("=" * 60)
     
-    # システム初期化
+    for i, result in enumerate(results, 1):
+        content = result['content']
+        if len(content) > 300:
+            content = content[:300] + "..."
+        
+        metadata = result.get('metadata', {})
+        source = metadata.get('source', '不明')
+        title = metadata.get('title', '無題')
+        distance = result.get('distance', 0)
+        
+        # 関連度を100点満点で計算（距離が小さいほど高い関連度）
+        relevance = max(0, 100 - distance * 5)
+        
+        print(f"\n【結果 {i}】")
+        print(f"📄 タイトル: {title}")
+        print(f"📁 ソース: {source}")
+        print(f"🎯 関連度: {relevance:.1f}/100")
+        print(f"📝 内容: {content}")
+        print("-" * 40)
+
+def run_batch(processor, query_file: str, n_results: int = 3):
+    """クエリファイル（1行1クエリ）を一括検索"""
+    try:
+        with open(query_file, 'r', encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()]
+    except Exception as e:
+        print(f"❌ クエリファイル読み込みエラー: {e}")
+        return
+    
+    print(f"📦 {len(queries)}件のクエリを一括検索します")
+    all_results = processor.search_many(queries, n_results=n_results)
+    
+    for query, results in zip(queries, all_results):
+        print(f"\n🔍 クエリ: '{query}'")
+        if results:
+            print_results(results)
+        else:
+            print("❌ 検索結果が見つかりませんでした")
+
+def init_processor():
+    """検索システムを初期化（データがなければNone）"""
     try:
         processor = VectorDBProcessor()
         print("✅ 検索システムを初期化しました")
         
         # データベース統計表示
-        collection = processor.collection
-        count = collection.count()
+        count = processor.get_stats()['total_documents']
         print(f"📊 検索可能ドキュメント数: {count}")
         
         if count == 0:
             print("❌ データが見つかりません。先にデータ統合を実行してください。")
-            return
+            return None
         elif count <= 2:
             print("⚠️  テストデータのみです。実データの統合が必要な可能性があります。")
+        
+        return processor
             
     except Exception as e:
         print(f"❌ システム初期化エラー: {e}")
+        return None
+
+def main():
+    print("🔍 RAGシステム検索ツール")
+    print("=" * 50)
+    
+    # システム初期化
+    processor = init_processor()
+    if not processor:
+        return
+    
+    # バッチモード: python search_tool.py --batch queries.txt [件数]
+    if len(sys.argv) >= 3 and sys.argv[1] == '--batch':
+        n_results = int(sys.argv[3]) if len(sys.argv) >= 4 else 3
+        run_batch(processor, sys.argv[2], n_results)
         return
     
     print("\n🔍 検索を開始します")
@@ -52,38 +109,13 @@ def main():
             
             # 検索実行
             print(f"\n🔍 検索中: '{query}'")
-            search_result = processor.search_documents(query, n_results=3)
+            results = processor.search(query, n_results=3)
             
-            if not search_result or not search_result.get('results'):
+            if not results:
                 print("❌ 検索結果が見つかりませんでした")
                 continue
             
-            # 結果表示
-            results = search_result['results']
-            total_results = search_result.get('total_results', len(results))
-            
-            print(f"\n✅ {total_results}件の結果が見つかりました:")
-            print("=" * 60)
-            
-            for i, result in enumerate(results, 1):
-                content = result['content']
-                if len(content) > 300:
-                    content = content[:300] + "..."
-                
-                metadata = result.get('metadata', {})
-                source = metadata.get('source', '不明')
-                title = metadata.get('title', '無題')
-                distance = result.get('distance', 0)
-                
-                # 関連度を100点満点で計算（距離が小さいほど高い関連度）
-                relevance = max(0, 100 - distance * 5)
-                
-                print(f"\n【結果 {i}】")
-                print(f"📄 タイトル: {title}")
-                print(f"📁 ソース: {source}")
-                print(f"🎯 関連度: {relevance:.1f}/100")
-                print(f"📝 内容: {content}")
-                print("-" * 40)
+            print_results(results)
             
         except KeyboardInterrupt:
             print("\n\n👋 検索を終了します")
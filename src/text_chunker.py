@@ -0,0 +1,157 @@
+"""
+テキスト分割モジュール - 日本語の文境界とモデルのトークン上限を考慮したチャンク分割
+"""
+
+import re
+from typing import Callable, List, Optional, Tuple
+
+# 文末記号（日本語・英語）と改行で分割（区切り文字は直前の文に含める）
+SENTENCE_BOUNDARY = re.compile(r'[^。！？!?\n]*(?:[。！？!?]+|\n+|$)')
+
+# チャンクの既定サイズ（トークン数）
+DEFAULT_MAX_TOKENS = 480
+DEFAULT_OVERLAP_TOKENS = 64
+
+# トークナイザーに一度に渡す文の数（max_chunks に達したら以降は数えない）
+COUNT_BLOCK_SENTENCES = 64
+
+
+def estimate_token_counts(texts: List[str]) -> List[int]:
+    """トークナイザーが使えない場合の概算（日本語は1文字≒1トークン以下）"""
+    return [len(text) for text in texts]
+
+
+def split_sentences(text: str) -> List[str]:
+    """テキストを文単位に分割（。！？と改行を境界とする）"""
+    sentences = []
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        sentence = match.group(0)
+        if sentence.strip():
+            sentences.append(sentence)
+    return sentences
+
+
+def _split_long_sentence(sentence: str, token_count: int, max_tokens: int) -> List[str]:
+    """上限を超える文を文字数比で分割"""
+    # トークン/文字の比率から1片あたりの文字数を見積もる（1割の余裕を持たせる）
+    piece_chars = max(1, int(len(sentence) * max_tokens / max(token_count, 1) * 0.9))
+    return [sentence[i:i + piece_chars] for i in range(0, len(sentence), piece_chars)]
+
+
+def chunk_text(text: str,
+               max_tokens: int = DEFAULT_MAX_TOKENS,
+               overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+               count_tokens: Optional[Callable[[List[str]], List[int]]] = None,
+               max_chunks: Optional[int] = None,
+               split_tokens: Optional[Callable[[str, int], List[str]]] = None) -> List[str]:
+    """テキストを文境界でチャンクに分割
+
+    各チャンクは max_tokens 以下に収め、直前のチャンク末尾の文を
+    overlap_tokens 分だけ次のチャンクの先頭に重複させる。
+    count_tokens は文のリストを受け取りトークン数のリストを返す関数。
+    """
+    chunks, _, _ = chunk_text_with_stats(text, max_tokens, overlap_tokens, count_tokens,
+                                         max_chunks, split_tokens)
+    return chunks
+
+
+def chunk_text_with_stats(text: str,
+                          max_tokens: int = DEFAULT_MAX_TOKENS,
+                          overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                          count_tokens: Optional[Callable[[List[str]], List[int]]] = None,
+                          max_chunks: Optional[int] = None,
+                          split_tokens: Optional[Callable[[str, int], List[str]]] = None
+                          ) -> Tuple[List[str], int, int]:
+    """chunk_text と同じ分割を行い (チャンク, 総トークン数, 切り捨てたトークン数) を返す
+
+    split_tokens は上限を超える1文を max_tokens 以下の片に分ける関数
+    （トークナイザーのオフセットで切る想定）。省略時や失敗時は文字数比で分割する。
+    切り捨てトークン数は max_chunks に達してどのチャンクにも入らなかった分。
+    """
+    chunks, _, total_tokens, dropped_tokens = chunk_text_with_token_counts(
+        text, max_tokens, overlap_tokens, count_tokens, max_chunks, split_tokens)
+    return chunks, total_tokens, dropped_tokens
+
+
+def _iter_units(sentences: List[str], max_tokens: int,
+                count_tokens: Callable[[List[str]], List[int]],
+                split_tokens: Optional[Callable[[str, int], List[str]]]):
+    """文をブロック単位で数えながら (片, トークン数) を順に返す（上限を超える文は分割）"""
+    for start in range(0, len(sentences), COUNT_BLOCK_SENTENCES):
+        block = sentences[start:start + COUNT_BLOCK_SENTENCES]
+        for sentence, token_count in zip(block, count_tokens(block)):
+            if token_count > max_tokens:
+                pieces = None
+                if split_tokens:
+                    try:
+                        pieces = split_tokens(sentence, max_tokens)
+                    except Exception:
+                        pieces = None
+                pieces = pieces or _split_long_sentence(sentence, token_count, max_tokens)
+                yield from zip(pieces, count_tokens(pieces))
+            else:
+                yield sentence, token_count
+
+
+def chunk_text_with_token_counts(text: str,
+                                 max_tokens: int = DEFAULT_MAX_TOKENS,
+                                 overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                                 count_tokens: Optional[Callable[[List[str]], List[int]]] = None,
+                                 max_chunks: Optional[int] = None,
+                                 split_tokens: Optional[Callable[[str, int], List[str]]] = None
+                                 ) -> Tuple[List[str], List[int], int, int]:
+    """(チャンク, チャンクごとのトークン数, 総トークン数, 切り捨てたトークン数) を返す
+
+    文のトークン数はブロック単位で必要な分だけ数え、max_chunks に達した時点で打ち切る。
+    残りのトークン数は数え済みの部分のトークン/文字比から見積もるため、
+    総トークン数と切り捨てトークン数は上限に達した文書では概算になる。
+    チャンクごとのトークン数は構成する文の合計（エンコード時のバッチ計画に使う）。
+    """
+    count_tokens = count_tokens or estimate_token_counts
+
+    sentences = split_sentences(text)
+    if not sentences:
+        return [], [], 0, 0
+
+    total_chars = sum(len(sentence) for sentence in sentences)
+    counted_chars = 0
+    counted_tokens = 0
+
+    chunks = []
+    chunk_tokens = []
+    current = []
+    current_tokens = 0
+
+    for unit in _iter_units(sentences, max_tokens, count_tokens, split_tokens):
+        if current and current_tokens + unit[1] > max_tokens:
+            chunks.append(''.join(part for part, _ in current).strip())
+            chunk_tokens.append(current_tokens)
+            if max_chunks and len(chunks) >= max_chunks:
+                # 未計数の残りは数え済みの部分のトークン/文字比で見積もる
+                remaining_chars = total_chars - counted_chars - len(unit[0])
+                ratio = counted_tokens / max(counted_chars, 1)
+                dropped_tokens = unit[1] + int(round(max(remaining_chars, 0) * ratio))
+                return chunks, chunk_tokens, counted_tokens + dropped_tokens, dropped_tokens
+
+            # 末尾の文をオーバーラップとして次のチャンクへ引き継ぐ
+            overlap = []
+            overlap_total = 0
+            for part in reversed(current):
+                if overlap_total + part[1] > overlap_tokens or overlap_total + part[1] + unit[1] > max_tokens:
+                    break
+                overlap.insert(0, part)
+                overlap_total += part[1]
+
+            current = overlap
+            current_tokens = overlap_total
+
+        current.append(unit)
+        current_tokens += unit[1]
+        counted_chars += len(unit[0])
+        counted_tokens += unit[1]
+
+    if current:
+        chunks.append(''.join(part for part, _ in current).strip())
+        chunk_tokens.append(current_tokens)
+
+    return chunks, chunk_tokens, counted_tokens, 0
@@ -15,163 +15,1005 @@ def fix_sqlite3():
 fix_sqlite3()
 
 import chromadb
-from typing import List, Dict, Any
-import json
+from typing import List, Dict, Any, Callable, Iterable, Optional
+import hashlib
+import itertools
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import numpy as np
 
-def create_sentence_transformer():
-    """埋め込みモデルを安全に作成（全バージョン対応）"""
+from embedding_cache import EmbeddingCache, QueryEmbeddingCache, content_hash
+from embedding_encoder import EmbeddingEncoder
+from embedding_model import EMBEDDING_MODEL_NAME, cache_model_name, create_sentence_transformer
+from embedding_worker_pool import ProcessPoolEncoder
+from document_catalog import DocumentCatalog
+from keyword_index import BigramIndex, FTS5Index
+from quarantine_store import QuarantineStore
+from vector_stores import VECTOR_STORE_CLASSES
+from text_chunker import chunk_text_with_token_counts, estimate_token_counts
+
+# 埋め込みキャッシュのファイル名（db_path配下に作成）
+EMBEDDING_CACHE_FILE = "embedding_cache.sqlite3"
+
+# キーワード索引のファイル名（db_path配下に作成）
+KEYWORD_INDEX_FILE = "keyword_index.sqlite3"
+FTS_INDEX_FILE = "fts_index.sqlite3"
+
+# 文書カタログ（ソース別・タイプ別件数）のファイル名
+CATALOG_FILE = "document_catalog.sqlite3"
+
+# エンコードに失敗した文書の隔離ストアのファイル名
+QUARANTINE_FILE = "quarantine.sqlite3"
+
+# ベクトル検索に使うストア（hnsw: Chromaのみ、float32: メモリマップ配列での厳密検索、
+# float16/int8/binary: 圧縮メモリマップ配列で候補を出して再ランキング）
+# 環境変数 RAG_VECTOR_STORE で指定可能。ストアは db_path/vector_store/{種別} に作成し、
+# 作成済みのストアはすべて書き込みに追従させる（検索ごとに strategy で切り替え可能）
+# ストアでの検索はChromaの埋め込みを読まないため、検索だけのプロセスではHNSW索引を
+# メモリに読み込まない（書き込むプロセスではChromaがupsert時にHNSW索引を読み込む）
+VECTOR_STORE = os.getenv('RAG_VECTOR_STORE', 'hnsw')
+VECTOR_STORE_DIR = "vector_store"
+RERANK_CANDIDATES = 200         # 圧縮ストアから取り出す候補の最小数
+RERANK_OVERSAMPLE = 4           # 再ランキング前に取り出す候補の倍率
+
+# 更新日時として参照する文書フィールド（先に見つかったものを使う）
+TIMESTAMP_FIELDS = ('last_edited', 'modified_time', 'last_edited_time', 'created_time', 'timestamp')
+
+# 行メタデータとして予約されているキー（文書側の追加メタデータで上書きしない）
+RESERVED_METADATA_KEYS = ('source', 'title', 'type', 'content_hash', 'parent_id',
+                          'chunk_index', 'chunk_count', 'url', 'updated_ts',
+                          'tokens_total', 'tokens_dropped')
+
+# チャンク分割設定
+CHUNK_MAX_TOKENS = 480          # 1チャンクあたりのトークン上限（モデル上限以下に調整）
+CHUNK_OVERLAP_TOKENS = 64       # 隣接チャンク間の重複トークン数
+MAX_CHUNKS_PER_DOCUMENT = 64    # 1文書あたりのチャンク上限
+CHUNK_OVERSAMPLE = 3            # 文書単位に集約する前に多めに取得する倍率
+CHUNK_ID_SEPARATOR = "#chunk"   # チャンク行ID: {親文書ID}#chunk{連番}
+
+# エンコード設定（パディング込みのトークン数で1バッチの大きさを決める）
+ENCODE_TOKEN_BUDGET = 8192
+ENCODE_MAX_BATCH_SIZE = 64
+
+# マルチプロセスエンコード設定（ワーカー数0で無効、環境変数 RAG_ENCODE_WORKERS で指定可能）
+ENCODE_WORKERS = int(os.getenv('RAG_ENCODE_WORKERS', '0'))
+WORKER_POOL_MIN_TEXTS = 256     # これ未満の件数はプロセス起動コストに見合わないので単一プロセスで処理
+
+# ストリーミング投入設定（この件数ずつ取り出してエンコード・書き込みする）
+INGEST_WINDOW_SIZE = 128
+INGEST_PREFETCH_WINDOWS = 1     # 書き込み中に先読みしておくウィンドウ数
+# ワーカープール使用時のウィンドウの最小文書数（1ウィンドウで WORKER_POOL_MIN_TEXTS 件以上の
+# チャンクを渡し、全ワーカーにバッチが行き渡るようにする）
+INGEST_POOL_WINDOW_SIZE = WORKER_POOL_MIN_TEXTS
+
+# ハイブリッド検索設定
+RRF_K = 60                      # Reciprocal Rank Fusionの定数
+HYBRID_CANDIDATES = 50          # 各検索から融合前に取得する文書数
+
+# 旧バージョンが生成していた不安定なID（doc_{連番}_{hash()}）
+LEGACY_ID_PATTERN = re.compile(r'^doc_\d+_\d+$')
+
+def _create_chroma_collection(db_path: str):
+    """ChromaDBクライアントとコレクションを作成（失敗時はインメモリにフォールバック）"""
     try:
-        from sentence_transformers import SentenceTransformer
-        import torch
-        
-        print("埋め込みモデルを読み込み中...")
-        
-        # デバイス設定
-        device = 'cpu'  # Streamlit Cloudでは安全にCPUを使用
-        
-        # モデル初期化（バージョン互換性考慮）
+        print("ChromaDBクライアントを初期化中...")
+        client = chromadb.PersistentClient(path=db_path)
+        collection = client.get_or_create_collection(
+            name="company_docs",
+            metadata={"hnsw:space": "cosine"}
+        )
+        print("✅ ChromaDBクライアント初期化成功")
+        return client, collection
+    except Exception as e:
+        print(f"❌ ChromaDB永続化初期化エラー: {e}")
         try:
-            # 最新バージョン用の初期化
-            model = SentenceTransformer(
-                'intfloat/multilingual-e5-small',
-                device=device,
-                trust_remote_code=False,
-                cache_folder=None
+            print("🔄 インメモリモードにフォールバック中...")
+            client = chromadb.Client()
+            collection = client.get_or_create_collection(
+                name="company_docs",
+                metadata={"hnsw:space": "cosine"}
             )
-        except Exception as e1:
-            print(f"⚠️ 新形式での初期化失敗: {e1}")
-            try:
-                # 従来形式での初期化
-                model = SentenceTransformer('intfloat/multilingual-e5-small')
-                model = model.to(device)
-            except Exception as e2:
-                print(f"⚠️ 従来形式でも失敗: {e2}")
-                # より軽量なモデルにフォールバック
-                print("🔄 軽量モデルにフォールバック...")
-                model = SentenceTransformer('all-MiniLM-L6-v2')
-                model = model.to(device)
-        
-        print("✅ モデル読み込み完了")
+            print("✅ インメモリモード初期化成功")
+            return client, collection
+        except Exception as e2:
+            print(f"❌ フォールバック失敗: {e2}")
+            return None, None
+
+# === プロセス共有リソース ===
+# Streamlitの再実行・セッション・タブ間で同じモデルとコレクションを使い回す
+_registry_lock = threading.Lock()
+_shared_models = {}
+_shared_collections = {}
+_shared_embedding_caches = {}
+_shared_keyword_indexes = {}
+_shared_fts_indexes = {}
+_shared_catalogs = {}
+_shared_quarantines = {}
+_shared_vector_stores = {}
+
+# ハイブリッド検索で密ベクトル検索とキーワード検索を並行実行するためのスレッドプール
+_search_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="rag-search")
+
+def get_shared_model():
+    """埋め込みモデルをプロセス内で1回だけ読み込んで共有"""
+    with _registry_lock:
+        model = _shared_models.get('default')
+        if model is None:
+            model = create_sentence_transformer()
+            # 読み込み失敗は共有しない（次回呼び出しで再試行）
+            if model is not None:
+                _shared_models['default'] = model
         return model
-        
-    except ImportError as e:
-        print(f"❌ SentenceTransformersインポートエラー: {e}")
-        return None
-    except Exception as e:
-        print(f"❌ モデル読み込みエラー: {e}")
+
+def get_shared_collection(db_path: str):
+    """ChromaDBクライアントとコレクションをdb_pathごとに共有"""
+    key = os.path.abspath(db_path)
+    with _registry_lock:
+        shared = _shared_collections.get(key)
+        if shared is None:
+            shared = _create_chroma_collection(db_path)
+            if shared[1] is not None:
+                _shared_collections[key] = shared
+        return shared
+
+def get_shared_embedding_cache(cache_path: str):
+    """埋め込みキャッシュをファイルごとに共有（失敗時はNone）"""
+    key = os.path.abspath(cache_path)
+    with _registry_lock:
+        cache = _shared_embedding_caches.get(key)
+        if cache is None:
+            try:
+                cache = EmbeddingCache(cache_path)
+                _shared_embedding_caches[key] = cache
+                print(f"✅ 埋め込みキャッシュ初期化成功: {cache.get_stats()['entries']}件")
+            except Exception as e:
+                print(f"⚠️ 埋め込みキャッシュ初期化エラー - キャッシュなしで続行: {e}")
+                cache = None
+        return cache
+
+def _get_shared_index(shared: Dict, factory, index_path: str, label: str):
+    """索引をファイルごとに共有（作成失敗時はNone）"""
+    key = os.path.abspath(index_path)
+    with _registry_lock:
+        index = shared.get(key)
+        if index is None:
+            try:
+                index = factory(index_path)
+                shared[key] = index
+            except Exception as e:
+                print(f"⚠️ {label}初期化エラー - 索引なしで続行: {e}")
+                index = None
+        return index
+
+def get_shared_keyword_index(index_path: str):
+    """バイグラムBM25索引をファイルごとに共有"""
+    return _get_shared_index(_shared_keyword_indexes, BigramIndex, index_path, "キーワード索引")
+
+def get_shared_fts_index(index_path: str):
+    """FTS5索引をファイルごとに共有（SQLiteがtrigram非対応ならNone）"""
+    return _get_shared_index(_shared_fts_indexes, FTS5Index, index_path, "FTS5索引")
+
+def get_shared_catalog(catalog_path: str):
+    """文書カタログをファイルごとに共有"""
+    return _get_shared_index(_shared_catalogs, DocumentCatalog, catalog_path, "文書カタログ")
+
+def get_shared_quarantine(quarantine_path: str):
+    """隔離ストアをファイルごとに共有"""
+    return _get_shared_index(_shared_quarantines, QuarantineStore, quarantine_path, "隔離ストア")
+
+def get_shared_vector_store(kind: str, store_dir: str):
+    """ベクトルストアをディレクトリごとに共有"""
+    return _get_shared_index(_shared_vector_stores, VECTOR_STORE_CLASSES[kind], store_dir, "ベクトルストア")
+
+def parse_timestamp(value: Any) -> int:
+    """ISO形式の日時文字列をUNIX秒に変換（解釈できなければ0）"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not value:
+        return 0
+    try:
+        return int(datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp())
+    except ValueError:
+        return 0
+
+def to_timestamp(value: Any) -> int:
+    """datetime・ISO文字列・UNIX秒のいずれかをUNIX秒に変換"""
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return parse_timestamp(value)
+
+def build_where_filter(source: Optional[str] = None, doc_type: Optional[str] = None,
+                       date_from: Any = None, date_to: Any = None) -> Optional[Dict]:
+    """ソース・タイプ・更新日時の範囲からChromaのwhere条件を組み立てる（条件なしはNone）"""
+    conditions = []
+    if source:
+        conditions.append({'source': source})
+    if doc_type:
+        conditions.append({'type': doc_type})
+    if date_from:
+        conditions.append({'updated_ts': {'$gte': to_timestamp(date_from)}})
+    if date_to:
+        conditions.append({'updated_ts': {'$lte': to_timestamp(date_to)}})
+    
+    if not conditions:
         return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {'$and': conditions}
+
+def get_document_timestamp(doc: Dict[str, Any]) -> int:
+    """文書の更新日時（UNIX秒）を取得"""
+    for field in TIMESTAMP_FIELDS:
+        timestamp = parse_timestamp(get_document_field(doc, field))
+        if timestamp:
+            return timestamp
+    return 0
+
+def get_extra_metadata(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """文書の 'metadata' に含まれるスカラー値をフィルタ用メタデータとして取り出す"""
+    extras = {}
+    for key, value in (doc.get('metadata') or {}).items():
+        if key in RESERVED_METADATA_KEYS or value is None:
+            continue
+        if isinstance(value, (str, int, float, bool)):
+            extras[str(key)] = value
+    return extras
+
+def group_chunk_hits(documents: List[str], metadatas: List[Dict], distances: List[float],
+                     ids: List[str]) -> List[Dict]:
+    """チャンク単位の検索結果を親文書ごとにまとめる
+    
+    距離は最も近いチャンクの値、内容はヒットしたチャンクを文書内の順序で連結する。
+    """
+    grouped = {}
+    for chunk_id, content, metadata, distance in zip(ids, documents, metadatas, distances):
+        metadata = metadata or {}
+        parent_id = metadata.get('parent_id', chunk_id)
+        
+        group = grouped.get(parent_id)
+        if group is None:
+            group = grouped[parent_id] = {
+                'metadata': metadata,
+                'distance': distance,
+                'passages': [],
+                'chunk_ids': []
+            }
+        elif distance < group['distance']:
+            group['metadata'] = metadata
+            group['distance'] = distance
+        group['passages'].append((metadata.get('chunk_index', 0), content))
+        group['chunk_ids'].append((metadata.get('chunk_index', 0), chunk_id))
+    
+    formatted_results = []
+    for parent_id, group in grouped.items():
+        passages = [content for _, content in sorted(group['passages'], key=lambda p: p[0])]
+        formatted_results.append({
+            'id': parent_id,
+            'chunk_ids': [chunk_id for _, chunk_id in sorted(group['chunk_ids'], key=lambda c: c[0])],
+            'content': '\n…\n'.join(passages),
+            'metadata': group['metadata'],
+            'distance': group['distance'],
+            'matched_chunks': len(passages)
+        })
+    
+    formatted_results.sort(key=lambda r: r['distance'])
+    return formatted_results
+
+def get_document_field(doc: Dict[str, Any], key: str, default: Any = '') -> Any:
+    """文書のフィールドを取得（トップレベル → metadata の順で参照）"""
+    value = doc.get(key)
+    if value in (None, ''):
+        value = (doc.get('metadata') or {}).get(key)
+    return default if value in (None, '') else value
+
+def make_document_id(doc: Dict[str, Any]) -> str:
+    """ソース上の識別子から安定した文書IDを生成
+    
+    Notionページ・Google Driveファイルは各プロセッサーが付与する 'id'
+    （notion_page_xxx / gdrive_xxx）、Discordはチャンネル/メッセージIDを使う。
+    識別子がない文書はソース・タイトル・内容のハッシュから生成する。
+    """
+    source = str(get_document_field(doc, 'source'))
+    
+    channel_id = get_document_field(doc, 'channel_id')
+    message_id = get_document_field(doc, 'message_id')
+    if channel_id and message_id:
+        return f"discord_{channel_id}_{message_id}"
+    
+    source_id = str(get_document_field(doc, 'id'))
+    if source_id:
+        # ソース名が付いていないID（Discordのチャンネルなど）はソース名で名前空間を分ける
+        prefixes = ('notion_', 'gdrive_', 'discord_')
+        if source and not source_id.startswith(prefixes):
+            return f"{source}_{source_id}"
+        return source_id
+    
+    title = str(get_document_field(doc, 'title'))
+    digest = hashlib.sha256(
+        '\x1f'.join([source, title, str(doc.get('content', ''))]).encode('utf-8')
+    ).hexdigest()[:32]
+    return f"{source or 'doc'}_{digest}"
 
 class VectorDBProcessor:
-    def __init__(self, db_path: str = "./chroma_db"):
+    def __init__(self, db_path: str = "./chroma_db", query_cache_size: int = 256,
+                 persist_query_cache: bool = False, encode_workers: Optional[int] = None,
+                 vector_store: Optional[str] = None):
         self.db_path = db_path
+        self.vector_store_kind = vector_store or VECTOR_STORE
+        self.encode_workers = ENCODE_WORKERS if encode_workers is None else encode_workers
+        self.worker_pool = None
+        self._ingesting = False
+        # 直近のadd_documents()の結果（取り出した文書数・ウィンドウ数・書き込んだチャンク数）
+        self.last_ingest = {'documents': 0, 'windows': 0, 'chunks': 0}
         self.client = None
         self.collection = None
         self.model = None
+        self.model_name = None
+        self.embedding_cache = None
+        self.query_cache = None
+        self.encoder = None
+        self.keyword_index = None
+        self.fts_index = None
+        self.catalog = None
+        self.quarantine = None
+        self.vector_store = None
+        self.vector_stores = {}
         
         # ChromaDB初期化
         self._init_chromadb()
         
+        # キーワード索引初期化（埋め込みモデルがなくても検索できるようにする）
+        if self.collection:
+            self._init_keyword_index()
+            self._init_catalog()
+            self.quarantine = get_shared_quarantine(os.path.join(self.db_path, QUARANTINE_FILE))
+            self._init_vector_store()
+        
         # 埋め込みモデル初期化
         if self.collection:
-            self.model = create_sentence_transformer()
+            self.model = get_shared_model()
+            if self.model:
+                # キャッシュのキー（fp32以外のバックエンドは別の埋め込みとして扱う）
+                self.model_name = cache_model_name(self.model)
+                self._init_embedding_cache()
+                self.encoder = EmbeddingEncoder(
+                    self.model,
+                    count_tokens=self._count_tokens,
+                    token_budget=ENCODE_TOKEN_BUDGET,
+                    max_batch_size=ENCODE_MAX_BATCH_SIZE
+                )
+                self.query_cache = QueryEmbeddingCache(
+                    max_size=query_cache_size,
+                    persistent_cache=self.embedding_cache if persist_query_cache else None
+                )
     
-    def _init_chromadb(self):
-        """ChromaDBクライアントを初期化"""
+    def _init_embedding_cache(self):
+        """埋め込みキャッシュを初期化（失敗時はキャッシュなしで続行）"""
+        cache_path = os.path.join(self.db_path, EMBEDDING_CACHE_FILE)
+        self.embedding_cache = get_shared_embedding_cache(cache_path)
+    
+    def _init_keyword_index(self):
+        """キーワード索引を初期化し、コレクションとずれていれば再構築"""
+        self.keyword_index = get_shared_keyword_index(os.path.join(self.db_path, KEYWORD_INDEX_FILE))
+        self.fts_index = get_shared_fts_index(os.path.join(self.db_path, FTS_INDEX_FILE))
+        
         try:
-            print("ChromaDBクライアントを初期化中...")
-            self.client = chromadb.PersistentClient(path=self.db_path)
-            self.collection = self.client.get_or_create_collection(
-                name="company_docs",
-                metadata={"hnsw:space": "cosine"}
-            )
-            print("✅ ChromaDBクライアント初期化成功")
+            collection_count = self.collection.count()
+            for index in (self.keyword_index, self.fts_index):
+                if index and index.count() != collection_count:
+                    self.rebuild_keyword_index()
+                    break
         except Exception as e:
-            print(f"❌ ChromaDB永続化初期化エラー: {e}")
-            try:
-                print("🔄 インメモリモードにフォールバック中...")
-                self.client = chromadb.Client()
-                self.collection = self.client.get_or_create_collection(
-                    name="company_docs",
-                    metadata={"hnsw:space": "cosine"}
+            print(f"⚠️ キーワード索引の同期確認エラー: {e}")
+    
+    def rebuild_keyword_index(self, page_size: int = 500):
+        """コレクションの全行からキーワード索引（バイグラム・FTS5）を作り直す"""
+        if not self.collection:
+            return
+        
+        print("🔄 キーワード索引を再構築中...")
+        for index in (self.keyword_index, self.fts_index):
+            if index:
+                index.clear()
+        
+        offset = 0
+        while True:
+            page = self.collection.get(limit=page_size, offset=offset, include=['documents', 'metadatas'])
+            if not page['ids']:
+                break
+            self._index_rows(page['ids'], page['documents'], page['metadatas'])
+            offset += len(page['ids'])
+        
+        print(f"✅ キーワード索引再構築完了: {offset}件")
+    
+    def _init_catalog(self):
+        """文書カタログを初期化（既存コレクションに対してカタログが空なら構築）"""
+        self.catalog = get_shared_catalog(os.path.join(self.db_path, CATALOG_FILE))
+        
+        try:
+            if self.catalog and self.catalog.count() == 0 and self.collection.count() > 0:
+                self.rebuild_catalog()
+        except Exception as e:
+            print(f"⚠️ 文書カタログの同期確認エラー: {e}")
+    
+    def rebuild_catalog(self, page_size: int = 500):
+        """コレクションの行メタデータから文書カタログを作り直す"""
+        if not self.collection or not self.catalog:
+            return
+        
+        print("🔄 文書カタログを再構築中...")
+        documents = {}
+        offset = 0
+        while True:
+            page = self.collection.get(limit=page_size, offset=offset, include=['metadatas'])
+            if not page['ids']:
+                break
+            for row_id, metadata in zip(page['ids'], page['metadatas']):
+                metadata = metadata or {}
+                parent_id = metadata.get('parent_id', row_id)
+                documents[parent_id] = (
+                    parent_id,
+                    str(metadata.get('source', '')),
+                    str(metadata.get('type', '')),
+                    '',
+                    int(metadata.get('chunk_count', 1)),
+                    int(metadata.get('updated_ts', 0))
                 )
-                print("✅ インメモリモード初期化成功")
-            except Exception as e2:
-                print(f"❌ フォールバック失敗: {e2}")
-                self.client = None
-                self.collection = None
-    
-    def add_documents(self, documents: List[Dict[str, Any]]):
-        """文書をベクトルデータベースに追加"""
+            offset += len(page['ids'])
+        
+        self.catalog.clear()
+        self.catalog.upsert(documents.values())
+        print(f"✅ 文書カタログ再構築完了: {len(documents)}件")
+    
+    def _init_vector_store(self):
+        """設定されたベクトルストアと作成済みのストアを開く（コレクションとずれていれば再構築）"""
+        kind = self.vector_store_kind
+        if kind != 'hnsw' and kind not in VECTOR_STORE_CLASSES:
+            print(f"⚠️ 未対応のベクトルストア '{kind}' - HNSWを使用")
+            kind = self.vector_store_kind = 'hnsw'
+        
+        # 以前に作成されたストアも開いて書き込みに追従させる
+        store_root = os.path.join(self.db_path, VECTOR_STORE_DIR)
+        existing = os.listdir(store_root) if os.path.isdir(store_root) else []
+        for store_kind in VECTOR_STORE_CLASSES:
+            if store_kind == kind or store_kind in existing:
+                self._open_vector_store(store_kind)
+        
+        self.vector_store = self.vector_stores.get(kind)
+        if kind != 'hnsw' and self.vector_store is None:
+            self.vector_store_kind = 'hnsw'
+    
+    def _open_vector_store(self, kind: str):
+        """ベクトルストアを開き、件数がコレクションと異なれば再構築（失敗時はNone）"""
+        store = get_shared_vector_store(kind, os.path.join(self.db_path, VECTOR_STORE_DIR, kind))
+        if not store:
+            return None
+        
+        self.vector_stores[kind] = store
+        try:
+            if store.needs_rebuild or store.count() != self.collection.count():
+                self.rebuild_vector_store(kind)
+        except Exception as e:
+            print(f"⚠️ ベクトルストアの同期確認エラー: {e}")
+        return store
+    
+    def _get_vector_store(self, strategy: Optional[str] = None):
+        """検索方式に対応するベクトルストア（None は設定値、'hnsw' はストアなし）"""
+        if strategy is None:
+            return self.vector_store
+        if strategy == 'hnsw':
+            return None
+        if strategy not in VECTOR_STORE_CLASSES:
+            raise ValueError(f"未対応の検索方式: {strategy}")
+        return self.vector_stores.get(strategy) or self._open_vector_store(strategy)
+    
+    def rebuild_vector_store(self, kind: Optional[str] = None, page_size: int = 500):
+        """コレクションの全行の埋め込みからベクトルストアを作り直す（kind省略時は開いている全ストア）"""
         if not self.collection:
-            print("❌ ChromaDBが初期化されていません")
             return
         
+        stores = {kind: self.vector_stores[kind]} if kind else dict(self.vector_stores)
+        for store_kind, store in stores.items():
+            print(f"🔄 ベクトルストア（{store_kind}）を再構築中...")
+            store.clear()
+            
+            offset = 0
+            while True:
+                page = self.collection.get(limit=page_size, offset=offset, include=['embeddings'])
+                if not page['ids']:
+                    break
+                store.upsert(page['ids'], page['embeddings'])
+                offset += len(page['ids'])
+            
+            print(f"✅ ベクトルストア再構築完了: {offset}件（{store.memory_bytes() / 1024 / 1024:.1f}MB）")
+    
+    def _index_rows(self, ids: List[str], texts: List[str], metadatas: List[Dict]):
+        """行をキーワード索引に登録"""
+        if self.keyword_index:
+            self.keyword_index.upsert(zip(ids, texts))
+        if self.fts_index:
+            titles = [str((metadata or {}).get('title', '')) for metadata in metadatas]
+            self.fts_index.upsert(zip(ids, titles, texts))
+    
+    def _unindex_rows(self, ids: List[str]):
+        """行をキーワード索引・ベクトルストアから削除"""
+        for index in (self.keyword_index, self.fts_index, *self.vector_stores.values()):
+            if index:
+                index.delete(ids)
+    
+    def _init_chromadb(self):
+        """ChromaDBクライアントを初期化（プロセス内で共有）"""
+        self.client, self.collection = get_shared_collection(self.db_path)
+    
+    def add_documents(self, documents: Iterable[Dict[str, Any]],
+                      window_size: int = INGEST_WINDOW_SIZE,
+                      on_window: Optional[Callable[[int, int, int], None]] = None) -> int:
+        """文書をベクトルデータベースに追加（同一IDの文書は置き換え）
+
+        リストに限らず任意のイテラブル・ジェネレーターを受け付け、window_size 件ずつ
+        取り出してエンコード・書き込みする。取り出しはバックグラウンドスレッドで
+        INGEST_PREFETCH_WINDOWS 個先までに制限するため、メモリ使用量は総件数に依存しない。
+        on_window はウィンドウ完了ごとに (ウィンドウ番号, 文書数, チャンク数) で呼ばれる。
+        戻り値は処理した文書数。実際に書き込めたチャンク数は last_ingest['chunks'] で参照できる
+        （モデルが使えない場合などは文書を取り出しても0になる）。
+        
+        ワーカープールが有効な場合はウィンドウを INGEST_POOL_WINDOW_SIZE 件以上に広げ、
+        プールは投入の間起動したままにする（この呼び出しで起動したプールは最後に終了）。
+        """
+        if self.encode_workers > 0:
+            window_size = max(window_size, INGEST_POOL_WINDOW_SIZE)
+        owns_worker_pool = self.worker_pool is None
+        self._ingesting = True
+        
+        windows = queue.Queue(maxsize=INGEST_PREFETCH_WINDOWS)
+        stop = threading.Event()
+        
+        def produce():
+            iterator = iter(documents)
+            try:
+                while not stop.is_set():
+                    window = list(itertools.islice(iterator, window_size))
+                    if not window:
+                        break
+                    windows.put((window, None))
+            except Exception as e:
+                windows.put((None, e))
+            windows.put(None)
+        
+        producer = threading.Thread(target=produce, name="rag-ingest-reader", daemon=True)
+        producer.start()
+        
+        total_documents = 0
+        written_chunks = 0
+        window_number = 0
+        try:
+            while True:
+                item = windows.get()
+                if item is None:
+                    break
+                
+                window, error = item
+                if error is not None:
+                    raise error
+                
+                window_number += 1
+                chunk_count = self.upsert_documents(window)
+                total_documents += len(window)
+                written_chunks += chunk_count
+                if on_window:
+                    on_window(window_number, len(window), chunk_count)
+        finally:
+            # 途中で失敗しても読み込みスレッドを止める
+            stop.set()
+            while producer.is_alive():
+                try:
+                    windows.get_nowait()
+                except queue.Empty:
+                    producer.join(timeout=0.05)
+            self._ingesting = False
+            if owns_worker_pool:
+                self.close_worker_pool()
+            self.last_ingest = {'documents': total_documents, 'windows': window_number, 'chunks': written_chunks}
+        
+        if window_number > 1:
+            print(f"✅ 合計{total_documents}件の文書を{window_number}ウィンドウで投入しました（{written_chunks}チャンク書き込み）")
+        return total_documents
+    
+    def upsert_documents(self, documents: List[Dict[str, Any]]) -> int:
+        """文書をチャンク分割して安定IDでupsert（既存行は内容を置き換え、新規行は追加）
+
+        戻り値は書き込んだチャンク数（失敗時は0）。
+        """
+        if not self.collection:
+            print("❌ ChromaDBが初期化されていません")
+            return 0
+        
         if not self.model:
             print("❌ 埋め込みモデルが利用できません")
-            return
+            return 0
         
         try:
+            # 同一バッチ内の重複IDは後勝ち（Chromaは重複IDを受け付けない）
+            unique_docs = {}
+            for doc in documents:
+                unique_docs[make_document_id(doc)] = doc
+            
+            if not unique_docs:
+                return 0
+            
+            ids = []
             texts = []
+            text_tokens = []
             metadatas = []
-            ids = []
             
-            for i, doc in enumerate(documents):
-                content = str(doc.get('content', ''))[:8000]  # 長すぎるコンテンツを制限
-                texts.append(content)
-                metadatas.append({
-                    'source': str(doc.get('source', '')),
-                    'title': str(doc.get('title', '')),
-                    'type': str(doc.get('type', ''))
-                })
-                ids.append(f"doc_{i}_{abs(hash(content))}")
+            catalog_rows = []
+            truncated_docs = 0
+            dropped_tokens = 0
             
-            print(f"📝 {len(texts)}件の文書をベクトル化中...")
+            for parent_id, doc in unique_docs.items():
+                content = str(doc.get('content', ''))
+                chunks, chunk_tokens, tokens_total, tokens_dropped = self._chunk_document(content)
+                if tokens_dropped:
+                    truncated_docs += 1
+                    dropped_tokens += tokens_dropped
+                
+                doc_metadata = get_extra_metadata(doc)
+                doc_metadata.update({
+                    'source': str(get_document_field(doc, 'source')),
+                    'title': str(get_document_field(doc, 'title')),
+                    'type': str(get_document_field(doc, 'type')),
+                    'url': str(get_document_field(doc, 'url')),
+                    'updated_ts': get_document_timestamp(doc),
+                    'parent_id': parent_id,
+                    'chunk_count': len(chunks),
+                    'tokens_total': tokens_total,
+                    'tokens_dropped': tokens_dropped
+                })
+                
+                for chunk_index, chunk in enumerate(chunks):
+                    ids.append(f"{parent_id}{CHUNK_ID_SEPARATOR}{chunk_index}")
+                    texts.append(chunk)
+                    text_tokens.append(chunk_tokens[chunk_index])
+                    metadatas.append(dict(
+                        doc_metadata,
+                        content_hash=content_hash(chunk),
+                        chunk_index=chunk_index
+                    ))
+                
+                if chunks:
+                    catalog_rows.append((
+                        parent_id,
+                        doc_metadata['source'],
+                        doc_metadata['type'],
+                        content_hash(content),
+                        len(chunks),
+                        doc_metadata['updated_ts']
+                    ))
             
-            # バッチ処理でメモリ使用量を制限
-            batch_size = 16
-            all_embeddings = []
+            print(f"📝 {len(unique_docs)}件の文書（{len(texts)}チャンク）をベクトル化中...")
+            if truncated_docs:
+                print(f"⚠️ チャンク上限により{truncated_docs}件の文書で計{dropped_tokens}トークンを切り捨て")
             
-            for i in range(0, len(texts), batch_size):
-                batch_texts = texts[i:i + batch_size]
-                try:
-                    # エンコーディング実行
-                    batch_embeddings = self.model.encode(
-                        batch_texts,
-                        show_progress_bar=False,
-                        convert_to_numpy=True,
-                        normalize_embeddings=True
+            failed_docs = {}
+            if texts:
+                all_embeddings, failed = self._embed_documents(texts, text_tokens)
+                
+                # 1チャンクでも失敗した文書は書き込まず隔離（既存の行はそのまま残す）
+                for position, error in failed.items():
+                    failed_docs.setdefault(metadatas[position]['parent_id'], error)
+                if failed_docs:
+                    self._quarantine_documents(unique_docs, failed_docs)
+                    keep = [i for i, metadata in enumerate(metadatas) if metadata['parent_id'] not in failed_docs]
+                    ids = [ids[i] for i in keep]
+                    texts = [texts[i] for i in keep]
+                    metadatas = [metadatas[i] for i in keep]
+                    all_embeddings = [all_embeddings[i] for i in keep]
+                    catalog_rows = [row for row in catalog_rows if row[0] not in failed_docs]
+                
+                if texts:
+                    # ChromaDBにupsert
+                    self.collection.upsert(
+                        embeddings=all_embeddings,
+                        documents=texts,
+                        metadatas=metadatas,
+                        ids=ids
                     )
                     
-                    # numpy配列をリストに変換
-                    if isinstance(batch_embeddings, np.ndarray):
-                        batch_embeddings = batch_embeddings.tolist()
-                    
-                    all_embeddings.extend(batch_embeddings)
-                    print(f"✅ バッチ {i//batch_size + 1} 完了")
-                    
-                except Exception as e:
-                    print(f"❌ バッチ処理エラー: {e}")
-                    # ダミーベクトルで代替
-                    dummy_dim = 384  # 一般的な次元数
-                    dummy_vectors = [[0.0] * dummy_dim] * len(batch_texts)
-                    all_embeddings.extend(dummy_vectors)
-            
-            # ChromaDBに追加
-            self.collection.add(
-                embeddings=all_embeddings,
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids
-            )
+                    self._index_rows(ids, texts, metadatas)
+                    for store in self.vector_stores.values():
+                        store.upsert(ids, all_embeddings)
             
-            print(f"✅ {len(documents)}件の文書をChromaDBに追加しました")
+            written_ids = [doc_id for doc_id in unique_docs if doc_id not in failed_docs]
+            
+            # 文書が短くなった場合に残る古いチャンクを削除
+            if written_ids:
+                self._delete_stale_chunks(written_ids, set(ids))
+            
+            # カタログ更新（内容が空になった文書はカタログから外す）
+            if self.catalog:
+                self.catalog.upsert(catalog_rows)
+                cataloged = {row[0] for row in catalog_rows}
+                self.catalog.delete([doc_id for doc_id in written_ids if doc_id not in cataloged])
+            
+            # 以前隔離された文書が今回成功した場合は隔離を解除
+            if self.quarantine:
+                self.quarantine.remove(written_ids)
+            
+            print(f"✅ {len(written_ids)}件の文書（{len(texts)}チャンク）をChromaDBにupsertしました")
+            return len(texts)
             
         except Exception as e:
             print(f"❌ 文書追加エラー: {e}")
+            return 0
+    
+    def _quarantine_documents(self, documents: Dict[str, Dict[str, Any]], errors: Dict[str, str]):
+        """エンコードに失敗した文書をエラー内容とともに隔離ストアへ保存"""
+        print(f"⚠️ {len(errors)}件の文書をエンコードできませんでした - 隔離して続行")
+        for doc_id, error in errors.items():
+            print(f"   - {doc_id}: {error}")
+        
+        if self.quarantine:
+            try:
+                self.quarantine.add((doc_id, documents[doc_id], error) for doc_id, error in errors.items())
+            except Exception as e:
+                print(f"⚠️ 隔離ストア書き込みエラー: {e}")
+    
+    def retry_quarantined(self, limit: int = 100, max_attempts: int = 0) -> int:
+        """隔離中の文書を再投入し、投入できた文書数を返す"""
+        if not self.quarantine:
+            return 0
+        
+        documents = self.quarantine.get_documents(limit=limit, max_attempts=max_attempts)
+        if not documents:
+            return 0
+        
+        print(f"🔄 隔離中の文書を再投入: {len(documents)}件")
+        before = self.quarantine.count()
+        self.upsert_documents(documents)
+        recovered = before - self.quarantine.count()
+        print(f"✅ 再投入成功: {recovered}件 / 隔離中: {self.quarantine.count()}件")
+        return recovered
+    
+    def _chunk_document(self, content: str):
+        """文書をモデルのトークン上限に収まるチャンクへ分割
+
+        (チャンク, チャンクごとのトークン数, 総トークン数, 切り捨てたトークン数) を返す。
+        チャンクごとのトークン数はエンコード時のバッチ計画にそのまま使う。
+        """
+        max_seq_length = getattr(self.model, 'max_seq_length', None) or 512
+        # 特殊トークン（[CLS]/[SEP]）分を差し引く
+        max_tokens = min(CHUNK_MAX_TOKENS, max_seq_length - 2)
+        
+        return chunk_text_with_token_counts(
+            content,
+            max_tokens=max_tokens,
+            overlap_tokens=CHUNK_OVERLAP_TOKENS,
+            count_tokens=self._count_tokens,
+            max_chunks=MAX_CHUNKS_PER_DOCUMENT,
+            split_tokens=self._split_by_tokens
+        )
+    
+    def _split_by_tokens(self, sentence: str, max_tokens: int) -> Optional[List[str]]:
+        """長い文をトークナイザーのオフセットで max_tokens ごとに分割（使えなければNone）"""
+        tokenizer = getattr(self.model, 'tokenizer', None)
+        if tokenizer is None or not getattr(tokenizer, 'is_fast', False):
+            return None
+        
+        offsets = tokenizer(sentence, add_special_tokens=False, return_offsets_mapping=True)['offset_mapping']
+        if not offsets:
+            return None
+        
+        # 各片の先頭トークンの開始位置で切る（片の間の空白は前の片に含める）
+        starts = [offsets[i][0] for i in range(0, len(offsets), max_tokens)]
+        starts[0] = 0
+        starts.append(len(sentence))
+        return [sentence[start:end] for start, end in zip(starts, starts[1:]) if sentence[start:end]]
+    
+    def _count_tokens(self, texts: List[str]) -> List[int]:
+        """モデルのトークナイザーでトークン数を数える（使えなければ概算）"""
+        tokenizer = getattr(self.model, 'tokenizer', None)
+        if tokenizer is None or not texts:
+            return estimate_token_counts(texts)
+        
+        try:
+            encoded = tokenizer(texts, add_special_tokens=False)['input_ids']
+            return [len(token_ids) for token_ids in encoded]
+        except Exception:
+            return estimate_token_counts(texts)
+    
+    def _delete_stale_chunks(self, parent_ids: List[str], current_ids: set):
+        """今回のupsertに含まれない同じ親文書のチャンク・旧来の単一行を削除"""
+        stale_ids = [parent_id for parent_id in parent_ids if parent_id not in current_ids]
+        
+        existing = self.collection.get(
+            where={'parent_id': {'$in': parent_ids}},
+            include=[]
+        )
+        stale_ids.extend(chunk_id for chunk_id in existing['ids'] if chunk_id not in current_ids)
+        
+        # 旧バージョン（チャンク分割前）は親IDそのものを行IDとしていた
+        existing_rows = set(self.collection.get(ids=stale_ids, include=[])['ids']) if stale_ids else set()
+        if existing_rows:
+            self.collection.delete(ids=list(existing_rows))
+            self._unindex_rows(list(existing_rows))
     
-    def search(self, query: str, n_results: int = 20) -> List[Dict]:
-        """ベクトル検索実行"""
+    def remove_legacy_documents(self) -> int:
+        """旧形式のID（doc_{連番}_{hash()}）で登録された重複行を削除"""
+        if not self.collection:
+            return 0
+        
+        try:
+            all_ids = self.collection.get(include=[])['ids']
+            legacy_ids = [doc_id for doc_id in all_ids if LEGACY_ID_PATTERN.match(doc_id)]
+            
+            for i in range(0, len(legacy_ids), 500):
+                self.collection.delete(ids=legacy_ids[i:i + 500])
+            
+            self._unindex_rows(legacy_ids)
+            if self.catalog:
+                self.catalog.delete(legacy_ids)
+            
+            if legacy_ids:
+                print(f"🧹 旧形式IDの文書を削除しました: {len(legacy_ids)}件")
+            return len(legacy_ids)
+            
+        except Exception as e:
+            print(f"❌ 旧形式ID削除エラー: {e}")
+            return 0
+    
+    def _embed_documents(self, texts: List[str], token_counts: Optional[List[int]] = None):
+        """文書をベクトル化（キャッシュ済みの文書はエンコードをスキップ）
+
+        token_counts はチャンク分割時に数えたトークン数（あればバッチ計画で数え直さない）。
+
+        (入力順の埋め込みリスト, 失敗した入力位置 → エラー内容) を返す。
+        失敗したバッチは二分割を繰り返して原因のテキストだけを失敗とし、
+        失敗位置の埋め込みはNoneになる。
+        """
+        hashes = [content_hash(text) for text in texts]
+        
+        cached = {}
+        if self.embedding_cache:
+            try:
+                cached = self.embedding_cache.get_many(self.model_name, hashes)
+            except Exception as e:
+                print(f"⚠️ 埋め込みキャッシュ読み込みエラー: {e}")
+                cached = {}
+        
+        # キャッシュミスのみモデルに渡す（同一内容は1回だけエンコード）
+        miss_hashes = []
+        miss_texts = []
+        miss_tokens = []
+        seen = set(cached)
+        for position, (text, key) in enumerate(zip(texts, hashes)):
+            if key not in seen:
+                seen.add(key)
+                miss_hashes.append(key)
+                miss_texts.append(text)
+                if token_counts is not None:
+                    miss_tokens.append(token_counts[position])
+        
+        print(f"💾 キャッシュヒット: {len(texts) - len(miss_texts)}件 / エンコード対象: {len(miss_texts)}件")
+        
+        # トークン長でソートし、トークン予算でバッチを組んでエンコード
+        def cache_batch(indices, batch_embeddings):
+            if self.embedding_cache:
+                try:
+                    self.embedding_cache.put_many(
+                        self.model_name,
+                        {miss_hashes[i]: embedding for i, embedding in zip(indices, batch_embeddings)}
+                    )
+                except Exception as e:
+                    print(f"⚠️ 埋め込みキャッシュ書き込みエラー: {e}")
+        
+        encoded = {}
+        encoder = self._select_encoder(len(miss_texts))
+        if token_counts is None:
+            miss_tokens = None
+        embeddings, failures = encoder.encode(miss_texts, on_batch=cache_batch, token_counts=miss_tokens)
+        
+        timings = getattr(encoder, 'last_timings', None)
+        if miss_texts and timings and 'forward_seconds' in timings:
+            print(f"⏱️ エンコード {timings['total_seconds']:.1f}秒 "
+                  f"(トークナイズ {timings['tokenize_seconds']:.1f}秒 / フォワード {timings['forward_seconds']:.1f}秒 "
+                  f"/ 待ち {timings['wait_seconds']:.1f}秒)")
+        for i, embedding in embeddings.items():
+            encoded[miss_hashes[i]] = embedding
+        
+        # 失敗したバッチ（同じ例外を共有する）ごとに二分割して原因のテキストを特定
+        failed_batches = {}
+        for i, error in failures.items():
+            failed_batches.setdefault(id(error), []).append(i)
+        
+        errors = {}
+        for indices in failed_batches.values():
+            print(f"🔍 失敗したバッチ（{len(indices)}件）を分割して再エンコード中...")
+            recovered, still_failed = self.encoder.bisect_batch([miss_texts[i] for i in indices])
+            recovered_indices = [indices[j] for j in recovered]
+            if recovered_indices:
+                cache_batch(recovered_indices, [recovered[j] for j in recovered])
+            for j, embedding in recovered.items():
+                encoded[miss_hashes[indices[j]]] = embedding
+            for j, error in still_failed.items():
+                errors[miss_hashes[indices[j]]] = f"{type(error).__name__}: {error}"
+        
+        # numpy配列をリストに変換（入力順を維持、失敗はNone）
+        all_embeddings = []
+        failed = {}
+        for position, key in enumerate(hashes):
+            if key in cached:
+                all_embeddings.append(cached[key].tolist())
+            elif key in encoded:
+                all_embeddings.append(encoded[key].tolist())
+            else:
+                all_embeddings.append(None)
+                failed[position] = errors.get(key, "埋め込みを取得できませんでした")
+        
+        return all_embeddings, failed
+    
+    def _select_encoder(self, num_texts: int):
+        """件数が多くワーカー数が設定されていればプロセスプールを使う
+        
+        add_documents の投入中は起動コストを払い済みなので、プールが起動していれば
+        ワーカー数以上の件数でプールを使い続ける。
+        """
+        threshold = WORKER_POOL_MIN_TEXTS
+        if self._ingesting and self.worker_pool is not None:
+            threshold = self.encode_workers
+        if self.encode_workers > 0 and num_texts >= threshold:
+            if self.worker_pool is None:
+                self.worker_pool = ProcessPoolEncoder(
+                    self.encoder,
+                    model_name=getattr(self.model, 'embedding_model_name', EMBEDDING_MODEL_NAME),
+                    num_workers=self.encode_workers,
+                    backend=getattr(self.model, 'embedding_backend', 'torch')
+                )
+            return self.worker_pool
+        return self.encoder
+    
+    def close_worker_pool(self):
+        """エンコード用ワーカープロセスを終了"""
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+            self.worker_pool = None
+    
+    def _encode_query(self, query: str) -> List[float]:
+        """クエリをベクトル化（LRUキャッシュにあればモデルを呼ばない）"""
+        return self._encode_queries([query])[0]
+    
+    def _encode_queries(self, queries: List[str]) -> List[List[float]]:
+        """複数クエリをベクトル化（キャッシュにないものだけを1回のencodeでまとめて処理）"""
+        embeddings = [None] * len(queries)
+        missing = {}
+        
+        for i, query in enumerate(queries):
+            cached = self.query_cache.get(self.model_name, query) if self.query_cache else None
+            if cached is not None:
+                embeddings[i] = cached.tolist()
+            else:
+                missing.setdefault(query, []).append(i)
+        
+        if missing:
+            missing_queries = list(missing.keys())
+            encoded = self.model.encode(missing_queries, normalize_embeddings=True)
+            for query, query_embedding in zip(missing_queries, encoded):
+                query_embedding = np.asarray(query_embedding, dtype=np.float32)
+                if self.query_cache:
+                    self.query_cache.put(self.model_name, query, query_embedding)
+                for i in missing[query]:
+                    embeddings[i] = query_embedding.tolist()
+        
+        return embeddings
+    
+    def search(self, query: str, n_results: int = 20, where: Optional[Dict] = None,
+               strategy: Optional[str] = None) -> List[Dict]:
+        """ベクトル検索実行（where でソース・タイプ・更新日時を絞り込み、build_where_filter参照）
+        
+        strategy で検索方式を選ぶ（'hnsw'・ベクトルストア種別、省略時は RAG_VECTOR_STORE の設定）。
+        """
         if not self.collection:
             print("❌ ChromaDBが初期化されていません")
             return []
@@ -181,59 +1023,307 @@ class VectorDBProcessor:
             
             if self.model:
                 # ベクトル検索
-                query_embedding = self.model.encode([query], normalize_embeddings=True)[0]
-                if isinstance(query_embedding, np.ndarray):
-                    query_embedding = query_embedding.tolist()
+                query_embedding = self._encode_query(query)
                 
-                results = self.collection.query(
-                    query_embeddings=[query_embedding],
-                    n_results=max_results,
-                    include=['metadatas', 'documents', 'distances']
-                )
+                # 同じ文書の複数チャンクがヒットしても件数が足りるよう多めに取得
+                results = self._dense_query([query_embedding], max_results * CHUNK_OVERSAMPLE, where, strategy)
             else:
                 # キーワード検索フォールバック
                 print("⚠️ 埋め込みモデル利用不可 - キーワード検索を実行")
-                all_docs = self.collection.get()
-                matched_docs = []
-                
-                query_lower = query.lower()
-                for i, doc in enumerate(all_docs['documents']):
-                    if query_lower in doc.lower():
-                        matched_docs.append({
-                            'content': doc,
-                            'metadata': all_docs['metadatas'][i],
-                            'distance': 0.5
-                        })
-                
-                return matched_docs[:max_results]
+                return self.keyword_search(query, max_results, where=where)
             
-            # 結果を整形
-            formatted_results = []
-            if results['documents'] and len(results['documents']) > 0:
-                for i in range(len(results['documents'][0])):
-                    formatted_results.append({
-                        'content': results['documents'][0][i],
-                        'metadata': results['metadatas'][0][i],
-                        'distance': results['distances'][0][i]
-                    })
+            # チャンク単位のヒットを親文書ごとに集約
+            if not results['documents'] or len(results['documents']) == 0:
+                return []
             
-            return formatted_results
+            return group_chunk_hits(
+                results['documents'][0],
+                results['metadatas'][0],
+                results['distances'][0],
+                results['ids'][0]
+            )[:max_results]
             
         except Exception as e:
             print(f"❌ 検索エラー: {e}")
             return []
     
+    def search_many(self, queries: List[str], n_results: int = 20,
+                    where: Optional[Dict] = None, strategy: Optional[str] = None) -> List[List[Dict]]:
+        """複数クエリを一括でベクトル検索（1回のencodeと1回のChromaクエリで処理）
+        
+        戻り値はクエリと同じ順序の検索結果リスト（各要素は search() と同じ形式）。
+        """
+        if not queries:
+            return []
+        
+        if not self.collection:
+            print("❌ ChromaDBが初期化されていません")
+            return [[] for _ in queries]
+        
+        max_results = min(n_results, 50)
+        
+        if not self.model:
+            print("⚠️ 埋め込みモデル利用不可 - キーワード検索を実行")
+            return [self.keyword_search(query, max_results, where=where) for query in queries]
+        
+        try:
+            query_embeddings = self._encode_queries(list(queries))
+            
+            results = self._dense_query(query_embeddings, max_results * CHUNK_OVERSAMPLE, where, strategy)
+            
+            all_results = []
+            for i in range(len(queries)):
+                if not results['documents'] or i >= len(results['documents']):
+                    all_results.append([])
+                    continue
+                all_results.append(group_chunk_hits(
+                    results['documents'][i],
+                    results['metadatas'][i],
+                    results['distances'][i],
+                    results['ids'][i]
+                )[:max_results])
+            
+            return all_results
+            
+        except Exception as e:
+            print(f"❌ 一括検索エラー: {e}")
+            return [[] for _ in queries]
+    
+    def _dense_query(self, query_embeddings: List[List[float]], n_chunks: int,
+                     where: Optional[Dict] = None, strategy: Optional[str] = None) -> Dict:
+        """チャンク単位のベクトル検索（collection.query と同じ形式の結果を返す）
+        
+        ベクトルストアを使う検索方式ではストアで候補を出し、近似スコアのストアは
+        ストアの再ランキング用float32配列（候補行だけ読む）で再ランキングする。
+        Chromaからは文書とメタデータだけを取得し、埋め込みは読まない（埋め込みを読むと
+        ChromaがHNSW索引全体をメモリに読み込むため）。
+        """
+        store = self._get_vector_store(strategy)
+        if not store:
+            return self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=n_chunks,
+                where=where,
+                include=['metadatas', 'documents', 'distances']
+            )
+        
+        # メタデータ条件はChroma側で対象行を求めてストアの検索範囲に反映
+        allowed_ids = None
+        if where:
+            allowed_ids = self.collection.get(where=where, include=[])['ids']
+        
+        candidates = n_chunks if store.exact else max(n_chunks * RERANK_OVERSAMPLE, RERANK_CANDIDATES)
+        hits = store.search(query_embeddings, candidates, allowed_ids=allowed_ids)
+        
+        candidate_ids = list(dict.fromkeys(row_id for query_hits in hits for row_id, _ in query_hits))
+        rows = self.collection.get(ids=candidate_ids, include=['metadatas', 'documents']) if candidate_ids else {'ids': []}
+        positions = {row_id: i for i, row_id in enumerate(rows['ids'])}
+        
+        if not store.exact and candidate_ids:
+            vector_ids, matrix = store.get_vectors(candidate_ids)
+            vector_positions = {row_id: i for i, row_id in enumerate(vector_ids)}
+        
+        results = {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+        for query_embedding, query_hits in zip(query_embeddings, hits):
+            query_hits = [(row_id, score) for row_id, score in query_hits if row_id in positions]
+            if not store.exact:
+                query_hits = [(row_id, score) for row_id, score in query_hits if row_id in vector_positions]
+            if not store.exact and query_hits:
+                # 元の精度のベクトルでコサイン類似度を計算し直して並べ替え
+                hit_ids = [row_id for row_id, _ in query_hits]
+                exact_scores = matrix[[vector_positions[row_id] for row_id in hit_ids]] @ np.asarray(query_embedding, dtype=np.float32)
+                query_hits = sorted(zip(hit_ids, exact_scores.tolist()), key=lambda hit: hit[1], reverse=True)
+            query_hits = query_hits[:n_chunks]
+            
+            results['ids'].append([row_id for row_id, _ in query_hits])
+            results['documents'].append([rows['documents'][positions[row_id]] for row_id, _ in query_hits])
+            results['metadatas'].append([rows['metadatas'][positions[row_id]] for row_id, _ in query_hits])
+            results['distances'].append([1.0 - score for _, score in query_hits])
+        
+        return results
+    
+    def hybrid_search(self, query: str, n_results: int = 20, alpha: float = 0.5,
+                      where: Optional[Dict] = None, strategy: Optional[str] = None) -> List[Dict]:
+        """ベクトル検索とキーワード検索をReciprocal Rank Fusionで統合
+        
+        alpha はベクトル検索側の重み（1.0でベクトルのみ、0.0でキーワードのみ）。
+        結果の形式は search() と同じで、融合スコア 'score' が追加される。
+        """
+        if not self.collection:
+            print("❌ ChromaDBが初期化されていません")
+            return []
+        
+        if not self.model:
+            return self.keyword_search(query, n_results, where=where)
+        
+        try:
+            max_results = min(n_results, 50)
+            candidates = max(max_results, HYBRID_CANDIDATES)
+            
+            # 2つの検索を並行実行
+            dense_future = _search_executor.submit(self.search, query, candidates, where, strategy)
+            lexical_future = _search_executor.submit(self.keyword_search, query, candidates, where)
+            dense_results = dense_future.result()
+            lexical_results = lexical_future.result()
+            
+            fused = {}
+            for weight, results, rank_key in ((alpha, dense_results, 'dense_rank'),
+                                              (1.0 - alpha, lexical_results, 'lexical_rank')):
+                for rank, result in enumerate(results, start=1):
+                    entry = fused.get(result['id'])
+                    if entry is None:
+                        entry = fused[result['id']] = {
+                            'result': result,
+                            'score': 0.0,
+                            'dense_rank': None,
+                            'lexical_rank': None
+                        }
+                    entry['score'] += weight / (RRF_K + rank)
+                    entry[rank_key] = rank
+            
+            ranked = sorted(fused.values(), key=lambda e: e['score'], reverse=True)[:max_results]
+            
+            # キーワード検索のみでヒットした文書は距離をコサイン距離で計算し直す
+            lexical_only = [e['result'] for e in ranked if e['dense_rank'] is None]
+            self._fill_dense_distances(query, lexical_only, strategy)
+            
+            merged = []
+            for entry in ranked:
+                result = dict(entry['result'])
+                result['score'] = entry['score']
+                result['dense_rank'] = entry['dense_rank']
+                result['lexical_rank'] = entry['lexical_rank']
+                merged.append(result)
+            
+            return merged
+            
+        except Exception as e:
+            print(f"❌ ハイブリッド検索エラー: {e}")
+            return self.search(query, n_results, where=where, strategy=strategy)
+    
+    def _fill_dense_distances(self, query: str, results: List[Dict], strategy: Optional[str] = None):
+        """結果の距離を、ヒットしたチャンクとクエリの最小コサイン距離で置き換える
+        
+        ベクトルストアがあればストアのfloat32ベクトル（該当行だけ読む）を使う。
+        Chromaから埋め込みを読むとHNSW索引全体がメモリに載るため、ストアがない場合だけ使う。
+        """
+        chunk_ids = [chunk_id for result in results for chunk_id in result.get('chunk_ids', [])]
+        if not chunk_ids:
+            return
+        
+        query_embedding = np.asarray(self._encode_query(query), dtype=np.float32)
+        store = (self._get_vector_store(strategy) or self.vector_store
+                 or next(iter(self.vector_stores.values()), None))
+        if store:
+            vector_ids, matrix = store.get_vectors(chunk_ids)
+            scores = matrix @ query_embedding if vector_ids else []
+            similarities = dict(zip(vector_ids, (float(score) for score in scores)))
+        else:
+            rows = self.collection.get(ids=chunk_ids, include=['embeddings'])
+            similarities = {
+                chunk_id: float(np.dot(np.asarray(embedding, dtype=np.float32), query_embedding))
+                for chunk_id, embedding in zip(rows['ids'], rows['embeddings'])
+            }
+        
+        for result in results:
+            scores = [similarities[c] for c in result.get('chunk_ids', []) if c in similarities]
+            if scores:
+                result['distance'] = 1.0 - max(scores)
+    
+    def keyword_search(self, query: str, n_results: int = 20, where: Optional[Dict] = None) -> List[Dict]:
+        """キーワード検索（モデル不要）
+        
+        FTS5のフレーズ一致（チケットID・製品コードなど）を優先し、
+        3文字未満の語だけのクエリや一致がない場合はバイグラムBM25で検索する。
+        where を指定した場合は先にChroma側で条件に合う行IDを求め、
+        その行の中だけで順位付けする（全体の上位から後で絞ると取りこぼすため）。
+        結果の形式は search() と同じ。
+        """
+        if not self.collection:
+            return []
+        
+        try:
+            max_results = min(n_results, 50)
+            
+            allowed_ids = None
+            if where:
+                allowed_ids = self.collection.get(where=where, include=[])['ids']
+                if not allowed_ids:
+                    return []
+            
+            ranked = []
+            if self.fts_index:
+                ranked = self.fts_index.search(query, max_results * CHUNK_OVERSAMPLE, allowed_ids=allowed_ids)
+            if not ranked and self.keyword_index:
+                ranked = self.keyword_index.search(query, max_results * CHUNK_OVERSAMPLE, allowed_ids=allowed_ids)
+            
+            return self._rows_to_results(ranked)[:max_results]
+            
+        except Exception as e:
+            print(f"❌ キーワード検索エラー: {e}")
+            return []
+    
+    def _rows_to_results(self, ranked: List) -> List[Dict]:
+        """(行ID, スコア) のリストを親文書ごとにまとめた検索結果に変換"""
+        if not ranked:
+            return []
+        
+        rows = self.collection.get(
+            ids=[doc_id for doc_id, _ in ranked],
+            include=['documents', 'metadatas']
+        )
+        found = {
+            doc_id: (document, metadata)
+            for doc_id, document, metadata in zip(rows['ids'], rows['documents'], rows['metadatas'])
+        }
+        
+        hits = ([], [], [], [])
+        for doc_id, score in ranked:
+            if doc_id not in found:
+                continue
+            hits[0].append(found[doc_id][0])
+            hits[1].append(found[doc_id][1])
+            # スコアが高いほど距離が小さくなるよう変換（0〜1）
+            hits[2].append(1.0 / (1.0 + max(score, 0.0)))
+            hits[3].append(doc_id)
+        
+        return group_chunk_hits(*hits)
+    
+    def get_source_counts(self) -> Dict:
+        """ソース別・タイプ別の文書数をカタログから取得（検索を伴わない）"""
+        if not self.catalog:
+            return {"total": 0, "by_source": {}, "by_type": {}, "by_source_type": {}}
+        return self.catalog.get_counts()
+    
     def get_stats(self):
         """統計情報を取得"""
         if not self.collection:
             return {"total_documents": 0, "status": "error: not initialized"}
         
         try:
-            count = self.collection.count()
-            return {
-                "total_documents": count,
-                "status": "success" if count > 0 else "empty"
+            chunk_count = self.collection.count()
+            stats = {
+                "total_documents": chunk_count,
+                "total_chunks": chunk_count,
+                "status": "success" if chunk_count > 0 else "empty"
             }
+            if self.catalog:
+                counts = self.catalog.get_counts()
+                stats["total_documents"] = counts["total"]
+                stats["by_source"] = counts["by_source"]
+                stats["by_type"] = counts["by_type"]
+            if self.query_cache:
+                stats["query_cache"] = self.query_cache.get_stats()
+            if self.quarantine:
+                stats["quarantined"] = self.quarantine.count()
+            if self.vector_stores:
+                stats["vector_store"] = self.vector_store_kind
+                stats["vector_stores"] = {
+                    kind: {"vectors": store.count(), "memory_bytes": store.memory_bytes(),
+                           "rerank_bytes": store.rerank_bytes()}
+                    for kind, store in self.vector_stores.items()
+                }
+            return stats
         except Exception as e:
             return {
                 "total_documents": 0,
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+ベクトル検索ベンチマーク - ChromaのHNSW検索と各ベクトルストアを比較
+（全件総当たりの厳密な上位k件に対するrecall@k・レイテンシ・ベクトル配列のメモリ量）
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import random
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from vector_db_processor import RERANK_CANDIDATES, RERANK_OVERSAMPLE, VectorDBProcessor
+from vector_stores import VECTOR_STORE_CLASSES
+
+def sample_queries(processor: VectorDBProcessor, n_queries: int = 50, seed: int = 0) -> List[str]:
+    """登録済みチャンクの冒頭からクエリを作る（実際の検索語の代わり）"""
+    rows = processor.collection.get(include=['documents'])
+    documents = [document for document in rows['documents'] if document]
+    random.Random(seed).shuffle(documents)
+    return [document[:64] for document in documents[:n_queries]]
+
+def recall_at_k(results: List[List[str]], reference: List[List[str]], k: int) -> float:
+    """参照結果の上位k件のうち、結果の上位k件に含まれる割合の平均"""
+    recalls = []
+    for result_ids, reference_ids in zip(results, reference):
+        expected = set(reference_ids[:k])
+        if expected:
+            recalls.append(len(expected & set(result_ids[:k])) / len(expected))
+    return float(np.mean(recalls)) if recalls else 0.0
+
+def _timed_queries(query_fn, query_embeddings, k: int):
+    """1クエリずつ検索して (行IDのリスト, 各クエリの所要秒数) を返す"""
+    all_ids = []
+    seconds = []
+    for query_embedding in query_embeddings:
+        started = time.perf_counter()
+        results = query_fn([query_embedding], k)
+        seconds.append(time.perf_counter() - started)
+        all_ids.append(results['ids'][0] if results['ids'] else [])
+    return all_ids, seconds
+
+def _summary(seconds: List[float]) -> Dict:
+    return {
+        "mean_ms": float(np.mean(seconds)) * 1000,
+        "p95_ms": float(np.percentile(seconds, 95)) * 1000
+    }
+
+def exact_top_k(processor: VectorDBProcessor, query_embeddings, k: int, page_size: int = 500) -> List[List[str]]:
+    """コレクションの全埋め込みとの総当たりで厳密な上位k件の行IDを求める（正解データ）"""
+    ids = []
+    embeddings = []
+    offset = 0
+    while True:
+        page = processor.collection.get(limit=page_size, offset=offset, include=['embeddings'])
+        if not page['ids']:
+            break
+        ids.extend(page['ids'])
+        embeddings.extend(page['embeddings'])
+        offset += len(page['ids'])
+
+    scores = np.asarray(embeddings, dtype=np.float32) @ np.asarray(query_embeddings, dtype=np.float32).T
+    k = min(k, len(ids))
+    top_k = []
+    for column in scores.T:
+        top = np.argpartition(-column, k - 1)[:k]
+        top_k.append([ids[row] for row in top[np.argsort(-column[top])]])
+    return top_k
+
+def run_benchmark(processor: VectorDBProcessor, kinds: Optional[List[str]] = None,
+                  queries: Optional[List[str]] = None, k: int = 10) -> Dict:
+    """HNSWと各ベクトルストア（一時ディレクトリにコレクションから構築）を比較
+
+    recall は厳密な上位k件に対する再ランキング後の上位k件の割合、candidate_recall は
+    再ランキング前の候補集合に厳密な上位k件が含まれる割合（候補生成の取りこぼしの目安）。
+    mean_ms/p95_ms は文書・メタデータ取得込みの1クエリずつの検索、batch_ms は全クエリを
+    1回でまとめて検索した場合の1クエリあたり、scan_ms はストア内の走査だけの1クエリあたり。
+    """
+    kinds = kinds or list(VECTOR_STORE_CLASSES)
+    queries = queries or sample_queries(processor)
+    if not queries or not processor.model:
+        print("❌ クエリまたは埋め込みモデルがありません")
+        return {}
+
+    query_embeddings = processor._encode_queries(queries)
+    truth = exact_top_k(processor, query_embeddings, k)
+
+    def hnsw_query(embeddings, n_results):
+        return processor.collection.query(query_embeddings=embeddings, n_results=n_results, include=[])
+
+    def batch_ms(query_fn):
+        started = time.perf_counter()
+        query_fn(query_embeddings, k)
+        return (time.perf_counter() - started) / len(query_embeddings) * 1000
+
+    hnsw_ids, hnsw_seconds = _timed_queries(hnsw_query, query_embeddings, k)
+    report = {"queries": len(queries), "k": k,
+              "hnsw": dict(_summary(hnsw_seconds), recall=recall_at_k(hnsw_ids, truth, k),
+                           batch_ms=batch_ms(hnsw_query))}
+
+    original_stores = dict(processor.vector_stores)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for kind in kinds:
+            store = VECTOR_STORE_CLASSES[kind](os.path.join(temp_dir, kind))
+            try:
+                processor.vector_stores[kind] = store
+                processor.rebuild_vector_store(kind)
+
+                def store_query(embeddings, n_results):
+                    return processor._dense_query(embeddings, n_results, strategy=kind)
+
+                store_ids, store_seconds = _timed_queries(store_query, query_embeddings, k)
+                store_batch_ms = batch_ms(store_query)
+
+                candidates = k if store.exact else max(k * RERANK_OVERSAMPLE, RERANK_CANDIDATES)
+                started = time.perf_counter()
+                for query_embedding in query_embeddings:
+                    store.search([query_embedding], candidates)
+                scan_ms = (time.perf_counter() - started) / len(query_embeddings) * 1000
+                candidate_ids = [[row_id for row_id, _ in hits]
+                                 for hits in store.search(query_embeddings, candidates)]
+            finally:
+                processor.vector_stores.clear()
+                processor.vector_stores.update(original_stores)
+
+            report[kind] = dict(
+                _summary(store_seconds),
+                recall=recall_at_k(store_ids, truth, k),
+                candidate_recall=float(np.mean([len(set(expected) & set(found)) / len(expected)
+                                                for expected, found in zip(truth, candidate_ids) if expected])),
+                batch_ms=store_batch_ms,
+                scan_ms=scan_ms,
+                memory_bytes=store.memory_bytes()
+            )
+
+    print_report(report)
+    return report
+
+def print_report(report: Dict):
+    """ベンチマーク結果を表形式で表示"""
+    print(f"\n📊 === ベクトル検索ベンチマーク（{report['queries']}クエリ, k={report['k']}, 正解: 総当たり） ===")
+    print(f"{'方式':<10} {'recall@k':>9} {'候補recall':>10} {'平均(ms)':>10} {'p95(ms)':>10} "
+          f"{'一括(ms)':>10} {'走査(ms)':>10} {'メモリ(MB)':>11}")
+    for name, row in report.items():
+        if not isinstance(row, dict):
+            continue
+        memory = f"{row['memory_bytes'] / 1024 / 1024:.2f}" if 'memory_bytes' in row else "-"
+        candidate_recall = f"{row['candidate_recall']:.3f}" if 'candidate_recall' in row else "-"
+        scan = f"{row['scan_ms']:.3f}" if 'scan_ms' in row else "-"
+        print(f"{name:<10} {row['recall']:>9.3f} {candidate_recall:>10} "
+              f"{row['mean_ms']:>10.2f} {row['p95_ms']:>10.2f} {row['batch_ms']:>10.2f} {scan:>10} {memory:>11}")
+
+def main():
+    # 使い方: python src/vector_search_benchmark.py [ストア種別 ...]
+    processor = VectorDBProcessor(vector_store='hnsw')
+    if not processor.collection or processor.collection.count() == 0:
+        print("❌ ベクトルデータベースが空です")
+        return
+    run_benchmark(processor, kinds=sys.argv[1:] or None)
+
+if __name__ == "__main__":
+    main()
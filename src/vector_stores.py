@@ -0,0 +1,352 @@
+"""
+ベクトルストアモジュール - 正規化済み埋め込みをメモリマップ配列に保持して候補を検索
+（float32での厳密検索、またはfloat16・int8・符号ビットの圧縮表現で候補を出し、
+元の精度のベクトルで再ランキングする用途）
+
+圧縮ストアは再ランキング用のfloat32配列も別ファイルに持つが、検索のたびに読むのは
+候補行だけなので、常に走査されてメモリに載るのは圧縮配列のみになる。
+"""
+
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# 配列の初期容量と、スコア計算を分割する行数
+# （ブロックごとにfloat32へ変換するため、一時的なメモリはこの行数×次元数×4バイト）
+INITIAL_CAPACITY = 1024
+SCORE_BLOCK_ROWS = 4096
+
+VECTORS_FILE = "vectors.npy"
+RERANK_VECTORS_FILE = "rerank_vectors.npy"
+INDEX_FILE = "index.json"
+
+
+class VectorStore:
+    """メモリマップ配列による行ID → ベクトルのストア（サブクラスで格納形式とスコアを定義）
+
+    削除した行は空き行として再利用する。exact が False のストアは近似スコアを返すため、
+    呼び出し側で get_vectors() の元の精度のベクトルによる再ランキングを行う。
+    """
+
+    kind = ""
+    dtype = np.float32
+    exact = False
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._vectors_path = os.path.join(directory, VECTORS_FILE)
+        self._rerank_path = os.path.join(directory, RERANK_VECTORS_FILE)
+        self._index_path = os.path.join(directory, INDEX_FILE)
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.dim = None
+        self._ids: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._vectors = None
+        self._rerank = None
+        self.needs_rebuild = False
+
+        if os.path.exists(self._index_path) and os.path.exists(self._vectors_path):
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('kind') != self.kind:
+                raise ValueError(f"ストアの形式が一致しません: {index.get('kind')} != {self.kind}")
+            self.dim = index['dim']
+            self._ids = index['ids']
+            self._vectors = np.lib.format.open_memmap(self._vectors_path, mode='r+')
+            if not self.exact:
+                if os.path.exists(self._rerank_path):
+                    self._rerank = np.lib.format.open_memmap(self._rerank_path, mode='r+')
+                else:
+                    # 再ランキング用配列のない古い形式（呼び出し側で再構築する）
+                    self.needs_rebuild = True
+            for row, row_id in enumerate(self._ids):
+                if row_id is None:
+                    self._free.append(row)
+                else:
+                    self._rows[row_id] = row
+
+    # === サブクラスで定義する格納形式 ===
+
+    def _row_width(self, dim: int) -> int:
+        """1行あたりの要素数"""
+        return dim
+
+    def _encode_rows(self, vectors: np.ndarray) -> np.ndarray:
+        """正規化済みfloat32ベクトルを格納形式に変換"""
+        raise NotImplementedError
+
+    def _score_block(self, block: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """格納形式の行ブロックとクエリ（float32, m×dim）の類似度（行数×m、大きいほど近い）"""
+        raise NotImplementedError
+
+    # === 更新 ===
+
+    def count(self) -> int:
+        """格納済みのベクトル数"""
+        with self._lock:
+            return len(self._rows)
+
+    def memory_bytes(self) -> int:
+        """走査するベクトル配列のうち使用中の領域のバイト数（再ランキング用配列は含まない）"""
+        with self._lock:
+            if self._vectors is None:
+                return 0
+            return len(self._ids) * self._vectors.shape[1] * self._vectors.itemsize
+
+    def rerank_bytes(self) -> int:
+        """再ランキング用float32配列のうち使用中の領域のバイト数（検索時は候補行だけ読む）"""
+        with self._lock:
+            if self._rerank is None:
+                return 0
+            return len(self._ids) * self._rerank.shape[1] * self._rerank.itemsize
+
+    def upsert(self, ids: List[str], embeddings: Iterable):
+        """行IDとベクトルを登録（既存の行IDは上書き）"""
+        if not ids:
+            return
+        vectors = np.asarray(list(embeddings), dtype=np.float32)
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            encoded = self._encode_rows(vectors)
+
+            rows = []
+            for row_id in ids:
+                row = self._rows.get(row_id)
+                if row is None:
+                    row = self._free.pop() if self._free else len(self._ids)
+                    if row == len(self._ids):
+                        self._ids.append(row_id)
+                    else:
+                        self._ids[row] = row_id
+                    self._rows[row_id] = row
+                rows.append(row)
+
+            self._ensure_capacity(len(self._ids))
+            self._vectors[rows] = encoded
+            if self._rerank is not None:
+                self._rerank[rows] = vectors
+            self._save_locked()
+
+    def delete(self, ids: List[str]):
+        """行を削除（空き行として再利用する）"""
+        with self._lock:
+            removed = False
+            for row_id in ids:
+                row = self._rows.pop(row_id, None)
+                if row is not None:
+                    self._ids[row] = None
+                    self._vectors[row] = 0
+                    if self._rerank is not None:
+                        self._rerank[row] = 0
+                    self._free.append(row)
+                    removed = True
+            if removed:
+                self._save_locked()
+
+    def clear(self):
+        """全削除"""
+        with self._lock:
+            self._ids = []
+            self._rows = {}
+            self._free = []
+            if self._vectors is not None:
+                self._vectors[:] = 0
+            if self._rerank is not None:
+                self._rerank[:] = 0
+            self.needs_rebuild = False
+            self._save_locked()
+
+    def _ensure_capacity(self, size: int):
+        """必要なら配列を倍々で拡張してファイルを置き換える（圧縮ストアは再ランキング用配列も）"""
+        has_rerank = self.exact or self._rerank is not None
+        if self._vectors is not None and self._vectors.shape[0] >= size and has_rerank:
+            return
+
+        capacity = max(size, INITIAL_CAPACITY, (self._vectors.shape[0] * 2) if self._vectors is not None else 0)
+        if self._vectors is None or self._vectors.shape[0] < capacity:
+            self._vectors = _grow_memmap(self._vectors_path, self._vectors, self.dtype,
+                                         (capacity, self._row_width(self.dim)))
+        if not self.exact:
+            self._rerank = _grow_memmap(self._rerank_path, self._rerank, np.float32, (capacity, self.dim))
+
+    def _save_locked(self):
+        """行IDの対応表を書き出す（一時ファイル経由で置き換え）"""
+        if self._vectors is not None:
+            self._vectors.flush()
+        if self._rerank is not None:
+            self._rerank.flush()
+        temp_path = self._index_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'kind': self.kind, 'dim': self.dim, 'ids': self._ids}, f)
+        os.replace(temp_path, self._index_path)
+
+    # === 検索 ===
+
+    def get_vectors(self, ids: List[str]) -> Tuple[List[str], np.ndarray]:
+        """行IDの元の精度（float32）のベクトルを (見つかった行ID, 行列) で返す（該当行だけ読む）"""
+        with self._lock:
+            found = [row_id for row_id in ids if row_id in self._rows]
+            source = self._vectors if self.exact else self._rerank
+            if not found or source is None:
+                return [], np.empty((0, self.dim or 0), dtype=np.float32)
+            rows = [self._rows[row_id] for row_id in found]
+            return found, np.asarray(source[rows], dtype=np.float32)
+
+    def search(self, query_embeddings, k: int,
+               allowed_ids: Optional[Iterable[str]] = None) -> List[List[Tuple[str, float]]]:
+        """複数クエリの上位k件を (行ID, 類似度) のリストで返す（allowed_ids で対象行を限定）"""
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+
+        with self._lock:
+            size = len(self._ids)
+            if size == 0 or not self._rows:
+                return [[] for _ in range(len(queries))]
+
+            scores = np.empty((size, len(queries)), dtype=np.float32)
+            for start in range(0, size, SCORE_BLOCK_ROWS):
+                end = min(start + SCORE_BLOCK_ROWS, size)
+                scores[start:end] = self._score_block(self._vectors[start:end], queries)
+
+            # 空き行と対象外の行は候補から外す
+            if allowed_ids is not None:
+                valid = np.zeros(size, dtype=bool)
+                allowed_rows = [self._rows[row_id] for row_id in allowed_ids if row_id in self._rows]
+                valid[allowed_rows] = True
+            else:
+                valid = np.ones(size, dtype=bool)
+                valid[self._free] = False
+            scores[~valid] = -np.inf
+            ids = list(self._ids)
+
+        k = min(k, int(valid.sum()))
+        if k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        all_hits = []
+        for column in scores.T:
+            top = np.argpartition(-column, k - 1)[:k]
+            top = top[np.argsort(-column[top])]
+            all_hits.append([(ids[row], float(column[row])) for row in top])
+        return all_hits
+
+
+def _grow_memmap(path: str, current, dtype, shape: Tuple[int, int]):
+    """メモリマップ配列を指定の形に拡張（既存行をコピーして一時ファイル経由で置き換え）"""
+    temp_path = path + ".tmp"
+    grown = np.lib.format.open_memmap(temp_path, mode='w+', dtype=dtype, shape=shape)
+    if current is not None:
+        grown[:current.shape[0]] = current
+    grown.flush()
+    del grown
+    os.replace(temp_path, path)
+    return np.lib.format.open_memmap(path, mode='r+')
+
+
+class Float32VectorStore(VectorStore):
+    """float32のまま保持する厳密検索用ストア（数千〜数万件ならHNSWより単純で結果も厳密）
+
+    1回の行列積とargpartitionで上位を求めるため、再ランキングは不要。
+    """
+
+    kind = "float32"
+    dtype = np.float32
+    exact = True
+
+    def _encode_rows(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors
+
+    def _score_block(self, block: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        return block @ queries.T
+
+
+class Float16VectorStore(VectorStore):
+    """float16で保持（float32の半分のメモリ、類似度の誤差は1e-3程度）"""
+
+    kind = "float16"
+    dtype = np.float16
+
+    def _encode_rows(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors.astype(np.float16)
+
+    def _score_block(self, block: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        return block.astype(np.float32) @ queries.T
+
+
+class Int8VectorStore(VectorStore):
+    """int8で保持（float32の1/4のメモリ、正規化済みベクトルの各成分を127倍して丸める）"""
+
+    kind = "int8"
+    dtype = np.int8
+    SCALE = 127.0
+
+    def _encode_rows(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors * self.SCALE), -127, 127).astype(np.int8)
+
+    def _score_block(self, block: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        return (block.astype(np.float32) @ queries.T) / self.SCALE
+
+
+# 16ビット値ごとの立っているビット数（NumPy 2未満には np.bitwise_count がないため表引き）
+_POPCOUNT_16 = np.array([bin(value).count('1') for value in range(1 << 16)], dtype=np.uint8)
+
+
+def popcount_rows(words: np.ndarray) -> np.ndarray:
+    """uint64配列の各行の立っているビット数の合計"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+    halves = np.ascontiguousarray(words).view(np.uint16)
+    return _POPCOUNT_16[halves].sum(axis=1, dtype=np.int32)
+
+
+def pack_sign_bits(vectors: np.ndarray) -> np.ndarray:
+    """各成分の符号ビットを詰めてuint64の配列にする（次元数は64の倍数に切り上げ）"""
+    vectors = np.atleast_2d(vectors)
+    bits = vectors > 0
+    padding = (-bits.shape[1]) % 64
+    if padding:
+        bits = np.pad(bits, ((0, 0), (0, padding)))
+    return np.packbits(bits, axis=1).view(np.uint64)
+
+
+class BinaryVectorStore(VectorStore):
+    """符号ビットだけを保持（float32の1/32のメモリ）し、ハミング距離で候補を出す
+
+    384次元は6個のuint64になる。XORとビット数の集計だけで走査できるため高速だが
+    近似が粗いので、必ず元の精度のベクトルで再ランキングする。
+    """
+
+    kind = "binary"
+    dtype = np.uint64
+
+    def _row_width(self, dim: int) -> int:
+        return (dim + 63) // 64
+
+    def _encode_rows(self, vectors: np.ndarray) -> np.ndarray:
+        return pack_sign_bits(vectors)
+
+    def _score_block(self, block: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        # ハミング距離を [-1, 1] の類似度に換算（一致ビットが多いほど大きい）
+        query_codes = pack_sign_bits(queries)
+        scores = np.empty((len(block), len(query_codes)), dtype=np.float32)
+        for column, query_code in enumerate(query_codes):
+            distances = popcount_rows(np.bitwise_xor(block, query_code))
+            scores[:, column] = 1.0 - 2.0 * distances / self.dim
+        return scores
+
+
+# ストア種別名 → クラス
+VECTOR_STORE_CLASSES = {
+    Float32VectorStore.kind: Float32VectorStore,
+    Float16VectorStore.kind: Float16VectorStore,
+    Int8VectorStore.kind: Int8VectorStore,
+    BinaryVectorStore.kind: BinaryVectorStore,
+}